@@ -1,18 +1,25 @@
 import cv2
 import numpy as np
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-import urllib.request
 import os
+import threading
+import time
+import sys
 
-# Download the model if not present
-MODEL_PATH = "pose_landmarker_lite.task"
-if not os.path.exists(MODEL_PATH):
-    print("Downloading pose model...")
-    url = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task"
-    urllib.request.urlretrieve(url, MODEL_PATH)
-    print("Download complete!")
+# Shared modules (model_assets, pose_backends, ...) live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis_bus
+import event_log
+import model_assets
+import profiler
+import pose_backends
+from motion_governor import MotionGovernor
+from frame_ingest import FrameIngest, AllocationMeter
+from landmark_adapter import LandmarkAdapter, joint_angles, to_pixels, X
+from landmark_filter import LandmarkFilter
+from pose_quality import QualityGate, REPOSITION
+from instant_replay import ReplayBuffer
+
+# Pose backend is picked per machine in main() - importing this module never downloads
 
 # Landmark indices
 LEFT_SHOULDER = 11
@@ -21,35 +28,16 @@ LEFT_WRIST = 15
 RIGHT_SHOULDER = 12
 RIGHT_ELBOW = 14
 RIGHT_WRIST = 16
-
-def calculate_angle(a, b, c):
-    """Calculate angle between three points"""
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-    
-    ba = a - b
-    bc = c - b
-    
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    angle = np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-    return angle
+ELBOW_TRIPLETS = np.array([
+    [LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST],
+    [RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST],
+])
 
 def check_shoulder_press_form(landmarks):
-    """Check shoulder press form - returns (is_correct, errors, angles)"""
-    
-    # Get landmark coordinates
-    left_shoulder = [landmarks[LEFT_SHOULDER].x, landmarks[LEFT_SHOULDER].y]
-    left_elbow = [landmarks[LEFT_ELBOW].x, landmarks[LEFT_ELBOW].y]
-    left_wrist = [landmarks[LEFT_WRIST].x, landmarks[LEFT_WRIST].y]
-    
-    right_shoulder = [landmarks[RIGHT_SHOULDER].x, landmarks[RIGHT_SHOULDER].y]
-    right_elbow = [landmarks[RIGHT_ELBOW].x, landmarks[RIGHT_ELBOW].y]
-    right_wrist = [landmarks[RIGHT_WRIST].x, landmarks[RIGHT_WRIST].y]
+    """Check shoulder press form on a (33, 4) landmark array - returns (is_correct, errors, angles)"""
     
-    # Calculate elbow angles
-    left_elbow_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
-    right_elbow_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
+    # Calculate both elbow angles in one pass
+    left_elbow_angle, right_elbow_angle = joint_angles(landmarks, ELBOW_TRIPLETS)
     
     errors = []
     
@@ -58,10 +46,10 @@ def check_shoulder_press_form(landmarks):
         errors.append("Keep arms moving evenly")
     
     # Elbow-over-wrist check (important for safety)
-    lw_x = left_wrist[0]
-    le_x = left_elbow[0]
-    rw_x = right_wrist[0]
-    re_x = right_elbow[0]
+    lw_x = landmarks[LEFT_WRIST, X]
+    le_x = landmarks[LEFT_ELBOW, X]
+    rw_x = landmarks[RIGHT_WRIST, X]
+    re_x = landmarks[RIGHT_ELBOW, X]
     
     if abs(le_x - lw_x) > 0.05 or abs(re_x - rw_x) > 0.05:
         errors.append("Stack wrists over elbows")
@@ -71,8 +59,9 @@ def check_shoulder_press_form(landmarks):
     return is_correct, errors, (left_elbow_angle, right_elbow_angle)
 
 def draw_landmarks(image, landmarks, color):
-    """Draw pose landmarks on image with connecting lines"""
+    """Draw pose landmarks (33, 4 array) on image with connecting lines"""
     h, w = image.shape[:2]
+    pts = to_pixels(landmarks, w, h)
     
     # Connections for upper body (arms and torso)
     connections = [
@@ -84,77 +73,159 @@ def draw_landmarks(image, landmarks, color):
     
     # Draw connections
     for start, end in connections:
-        if start < len(landmarks) and end < len(landmarks):
-            x1 = int(landmarks[start].x * w)
-            y1 = int(landmarks[start].y * h)
-            x2 = int(landmarks[end].x * w)
-            y2 = int(landmarks[end].y * h)
-            cv2.line(image, (x1, y1), (x2, y2), color, 3)
+        cv2.line(image, pts[start], pts[end], color, 3)
     
     # Draw joint points
     for i in [11, 12, 13, 14, 15, 16, 23, 24]:  # Upper body landmarks
-        if i < len(landmarks):
-            x = int(landmarks[i].x * w)
-            y = int(landmarks[i].y * h)
-            cv2.circle(image, (x, y), 5, color, -1)
+        cv2.circle(image, pts[i], 5, color, -1)
+
+def make_display(pool, startup):
+    """Draw overlays on the frame snapshot and show it (latest-wins bus subscriber, main thread)"""
+    def on_display(result):
+        frame = result["frame"]
+        if result["status"] == REPOSITION:
+            cv2.putText(frame, result["hint"], (50, 50),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+        elif result["landmarks"] is not None:
+            is_correct, errors = result["is_correct"], result["errors"]
+            
+            # Set color: Green = correct, Red = incorrect
+            color = (0, 255, 0) if is_correct else (0, 0, 255)
+            
+            # Draw skeleton
+            draw_landmarks(frame, result["landmarks"], color)
+            
+            # Display status
+            status = "GOOD FORM!" if is_correct else "FIX FORM"
+            cv2.putText(frame, status, (50, 50), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
+            startup.first_feedback()
+            
+            # Show errors
+            for i, error in enumerate(errors):
+                cv2.putText(frame, error, (50, 200 + i*40),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        cv2.imshow('Shoulder Press Form Checker', frame)
+        pool.release(frame)
+    return on_display
 
 def main():
-    # Setup pose landmarker
-    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
-    options = vision.PoseLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.VIDEO
-    )
-    
+    prof = profiler.from_argv()  # --profile: per-stage timings on exit
+    startup = model_assets.StartupTimer()
+
     cap = cv2.VideoCapture(0)
-    
-    with vision.PoseLandmarker.create_from_options(options) as landmarker:
-        frame_count = 0
+    startup.mark("camera")
+
+    # Pick the best pose backend for this host (cached after the first calibration,
+    # measured on a camera frame - stand in view on the first run)
+    backend = pose_backends.select_backend(camera=cap)
+    startup.mark("backend")
+    log = event_log.open_log("combined")
+    log.emit("session_start", exercise="shoulder_press", backend=backend.name)
+
+    # The frame loop runs on a worker thread and publishes results; drawing
+    # and imshow consume them on the main thread
+    pool = analysis_bus.FramePool()
+    bus = analysis_bus.AnalysisBus()
+    bus.subscribe("display", make_display(pool, startup), main_thread=True,
+                  on_drop=lambda result: pool.release(result["frame"]))
+    bus.start()
+    stop = threading.Event()
+    governor = MotionGovernor()
+    ingest = FrameIngest()
+    alloc_meter = AllocationMeter()
+    gate = QualityGate(ELBOW_TRIPLETS)  # shoulders, elbows, wrists
+    replay = ReplayBuffer()  # last few seconds, saved as a clip when a mistake appears
+    frame_count = 0
+    
+    def frame_loop():
+        nonlocal frame_count
+        adapter = LandmarkAdapter()
+        smoother = LandmarkFilter()  # One Euro, single person
+        poses = adapter.poses
+        last_errors = None  # form state, logged on change
+        landmarks, is_correct, errors = None, True, []  # last good analysis
         
-        while cap.isOpened():
-            ret, frame = cap.read()
+        while cap.isOpened() and not stop.is_set():
+            alloc_meter.frame_start()
+            prof.frame_start()
+            ret, frame = ingest.read(cap)
+            prof.lap("capture")
             if not ret:
                 break
             
             frame_count += 1
             
-            # Convert to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-            
-            # Detect pose
-            timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
-            result = landmarker.detect_for_video(mp_image, timestamp_ms)
-            
-            if result.pose_landmarks and len(result.pose_landmarks) > 0:
-                landmarks = result.pose_landmarks[0]
+            # Skip inference while the scene is static (last result is reused)
+            infer = governor.should_infer(frame)
+            prof.lap("governor")
+            if infer:
+                # Convert to RGB (into a reused buffer)
+                rgb_frame = ingest.to_rgb(frame)
+                prof.lap("to_rgb")
                 
-                # Check form
-                is_correct, errors, (left_angle, right_angle) = check_shoulder_press_form(landmarks)
-                
-                # Set color: Green = correct, Red = incorrect
-                color = (0, 255, 0) if is_correct else (0, 0, 255)
-                
-                # Draw skeleton
-                draw_landmarks(frame, landmarks, color)
+                # Detect pose
+                timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
+                result = backend.detect(rgb_frame, timestamp_ms)
+                poses = adapter.update(result)
+                governor.observe(poses[0] if len(poses) > 0 else None)
+                prof.lap("detect")
                 
-                # Display status
-                status = "GOOD FORM!" if is_correct else "FIX FORM"
-                cv2.putText(frame, status, (50, 50), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
+                # Angles and checks run on smoothed landmarks (filtered in the buffer)
+                if len(poses) == 1:
+                    poses[0] = smoother(poses[0], time.perf_counter())
+                else:
+                    smoother.reset()
+                prof.lap("smooth")
+            
+            # Joints occluded or out of frame: keep the last good analysis
+            fresh = len(poses) > 0 and gate.check(poses[0])
+            if fresh:
+                # Copied: the adapter's buffer is rewritten by the next detection
+                landmarks = poses[0].copy()
                 
-                # Show errors
-                for i, error in enumerate(errors):
-                    cv2.putText(frame, error, (50, 200 + i*40),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                # Check form
+                is_correct, errors, _ = check_shoulder_press_form(landmarks)
+                prof.lap("check_form")
+                if errors != last_errors:
+                    log.emit("form", correct=is_correct, errors=errors)
+                    last_errors = errors
+                for mistake in replay.update(errors):
+                    log.emit("replay", mistake=mistake)
+            elif len(poses) == 0:
+                landmarks, is_correct, errors = None, True, []
+                gate.reset()
+            if gate.changed:
+                log.emit("quality", status=gate.status, hint=gate.hint())
             
-            cv2.imshow('Shoulder Press Form Checker', frame)
+            replay.push(frame)
+            prof.lap("replay")
             
+            bus.publish({"frame": pool.snapshot(frame), "landmarks": landmarks,
+                         "is_correct": is_correct, "errors": errors,
+                         "status": gate.status, "hint": gate.hint()})
+            prof.lap("publish")
+            alloc_meter.frame_end()
+    
+    with backend.load():
+        startup.mark("load")
+        producer = analysis_bus.run_producer(frame_loop, stop)
+        while not stop.is_set():
+            bus.pump(0.005)
             if cv2.waitKey(1) & 0xFF == 27: # press ESC to exit
-                break
+                stop.set()
+        producer.join()
     
+    bus.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(f"Motion governor: {governor.stats()}")
+    alloc_meter.report(ingest)
+    bus.report()
+    print(f"Quality gate: {gate.stats()}")
+    replay.close()
+    print(f"Instant replay: {replay.stats()}")
+    log.emit("session_end", frames=frame_count, quality=gate.stats())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
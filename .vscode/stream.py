@@ -1,502 +1,51 @@
 import cv2
 import numpy as np
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 import os
-import urllib.request
+import queue
+import sys
+import threading
+import time
 from PIL import Image
 from io import BytesIO
 import requests
 
-# ============================================================
-# CONFIGURATION
-# ============================================================
+# Shared modules (model_assets, pose_backends, ...) live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis_bus
+import event_log
+import model_assets
+import profiler
+import pose_backends
+from motion_governor import MotionGovernor
+from frame_ingest import FrameIngest, AllocationMeter
+from landmark_adapter import LandmarkAdapter, to_pixels, X, Y
+from landmark_filter import LandmarkFilter
+from form_analysis import EXERCISES, ANGLE_KEYS, angle_plan, get_all_angles, check_form
+from rep_similarity import RepLibrary, RepRecorder, rep_features
+from rep_metrics import RepTracker, has_reps, describe, summarize
+from session_stats import SessionStats
+from exercise_recognition import ANGLE_INPUTS, ExerciseIndex, ExerciseRecognizer
+from pose_tracking import GroupCoach
+from pose_quality import QualityGate, REPOSITION
+from instant_replay import ReplayBuffer
 
-MODEL_PATH = "pose_landmarker_lite.task"
-
-# ============================================================
-# EXERCISES WITH BETTER ANGLE DEFINITIONS
 # ============================================================
-
-EXERCISES = {
-    "shoulder_press": {
-        "name": "Shoulder Press",
-        "target": "shoulders, triceps",
-        "camera_position": "FRONT or SIDE",
-        "phases": {
-            "BOTTOM": {
-                "description": "Starting position - weights at shoulders",
-                "angles": {
-                    "left_elbow": (70, 110),      # Range: 70-110 degrees
-                    "right_elbow": (70, 110),
-                    "left_arm_raise": (70, 100),  # Arm raised to shoulder height
-                    "right_arm_raise": (70, 100)
-                }
-            },
-            "TOP": {
-                "description": "Arms fully extended overhead",
-                "angles": {
-                    "left_elbow": (150, 180),     # Almost straight
-                    "right_elbow": (150, 180),
-                    "left_arm_raise": (160, 180), # Arms overhead
-                    "right_arm_raise": (160, 180)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("back_arch", "back", "<", 160, "Don't arch your back"),
-            ("elbow_flare", "elbow_diff", ">", 30, "Keep elbows even"),
-        ],
-        "instructions": [
-            "Stand with feet shoulder-width apart",
-            "Hold weights at shoulder height",
-            "Press straight up overhead",
-            "Lower with control"
-        ]
-    },
-    "squat": {
-        "name": "Squat",
-        "target": "quads, glutes, hamstrings",
-        "camera_position": "SIDE view recommended",
-        "phases": {
-            "STANDING": {
-                "description": "Standing tall",
-                "angles": {
-                    "left_knee": (160, 180),
-                    "right_knee": (160, 180),
-                    "left_hip": (160, 180),
-                    "right_hip": (160, 180)
-                }
-            },
-            "BOTTOM": {
-                "description": "Full squat depth",
-                "angles": {
-                    "left_knee": (70, 110),
-                    "right_knee": (70, 110),
-                    "left_hip": (70, 110),
-                    "right_hip": (70, 110)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("knee_cave", "knee_diff", ">", 20, "Knees caving in"),
-            ("forward_lean", "back", "<", 100, "Leaning too far forward"),
-            ("not_deep", "avg_knee", ">", 120, "Go deeper")
-        ],
-        "instructions": [
-            "Feet shoulder-width apart",
-            "Keep chest up, back straight",
-            "Lower until thighs parallel to ground",
-            "Push through heels to stand"
-        ]
-    },
-    "bicep_curl": {
-        "name": "Bicep Curl",
-        "target": "biceps",
-        "camera_position": "FRONT or SIDE",
-        "phases": {
-            "BOTTOM": {
-                "description": "Arms extended",
-                "angles": {
-                    "left_elbow": (150, 180),
-                    "right_elbow": (150, 180)
-                }
-            },
-            "TOP": {
-                "description": "Full contraction",
-                "angles": {
-                    "left_elbow": (30, 60),
-                    "right_elbow": (30, 60)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("swinging", "shoulder_movement", ">", 20, "Don't swing - control the weight"),
-            ("uneven", "elbow_diff", ">", 25, "Keep both arms even")
-        ],
-        "instructions": [
-            "Stand with arms at sides",
-            "Keep elbows close to body",
-            "Curl weights to shoulders",
-            "Lower slowly with control"
-        ]
-    },
-    "pushup": {
-        "name": "Push Up",
-        "target": "chest, triceps, shoulders",
-        "camera_position": "SIDE view recommended",
-        "phases": {
-            "TOP": {
-                "description": "Arms extended",
-                "angles": {
-                    "left_elbow": (160, 180),
-                    "right_elbow": (160, 180),
-                    "back": (160, 180)
-                }
-            },
-            "BOTTOM": {
-                "description": "Chest near ground",
-                "angles": {
-                    "left_elbow": (70, 100),
-                    "right_elbow": (70, 100),
-                    "back": (160, 180)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("sagging_hips", "back", "<", 150, "Keep hips up - straight line"),
-            ("pike", "back", ">", 190, "Don't pike up"),
-            ("partial_rep", "avg_elbow", ">", 120, "Go lower")
-        ],
-        "instructions": [
-            "Hands slightly wider than shoulders",
-            "Keep body in straight line",
-            "Lower until chest nearly touches ground",
-            "Push back up fully"
-        ]
-    },
-    "lunge": {
-        "name": "Lunge",
-        "target": "quads, glutes, hamstrings",
-        "camera_position": "SIDE view recommended",
-        "phases": {
-            "STANDING": {
-                "description": "Standing tall",
-                "angles": {
-                    "left_knee": (160, 180),
-                    "right_knee": (160, 180)
-                }
-            },
-            "BOTTOM": {
-                "description": "Deep lunge",
-                "angles": {
-                    "left_knee": (80, 110),
-                    "right_knee": (80, 110)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("knee_over_toe", "front_knee", "<", 70, "Knee too far forward"),
-            ("not_deep", "avg_knee", ">", 120, "Go deeper")
-        ],
-        "instructions": [
-            "Step forward with one leg",
-            "Lower hips until both knees at 90°",
-            "Keep front knee over ankle",
-            "Push back to start"
-        ]
-    },
-    "plank": {
-        "name": "Plank",
-        "target": "core, shoulders",
-        "camera_position": "SIDE view required",
-        "phases": {
-            "HOLD": {
-                "description": "Straight body line",
-                "angles": {
-                    "back": (165, 185),
-                    "left_hip": (165, 185),
-                    "right_hip": (165, 185)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("sagging", "back", "<", 160, "Hips sagging - engage core"),
-            ("pike", "back", ">", 190, "Hips too high")
-        ],
-        "instructions": [
-            "Forearms on ground, elbows under shoulders",
-            "Keep body in straight line",
-            "Engage core, don't let hips sag",
-            "Hold position"
-        ]
-    },
-    "lateral_raise": {
-        "name": "Lateral Raise",
-        "target": "side deltoids",
-        "camera_position": "FRONT view recommended",
-        "phases": {
-            "BOTTOM": {
-                "description": "Arms at sides",
-                "angles": {
-                    "left_arm_raise": (0, 30),
-                    "right_arm_raise": (0, 30)
-                }
-            },
-            "TOP": {
-                "description": "Arms parallel to ground",
-                "angles": {
-                    "left_arm_raise": (80, 100),
-                    "right_arm_raise": (80, 100)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("too_high", "avg_arm_raise", ">", 110, "Don't raise above shoulder"),
-            ("uneven", "arm_raise_diff", ">", 20, "Keep arms even")
-        ],
-        "instructions": [
-            "Stand with dumbbells at sides",
-            "Slight bend in elbows",
-            "Raise arms to shoulder height",
-            "Lower with control"
-        ]
-    },
-    "deadlift": {
-        "name": "Deadlift",
-        "target": "back, hamstrings, glutes",
-        "camera_position": "SIDE view required",
-        "phases": {
-            "BOTTOM": {
-                "description": "Bent over, gripping bar",
-                "angles": {
-                    "left_hip": (60, 100),
-                    "right_hip": (60, 100),
-                    "back": (140, 180)  # Back should stay straight
-                }
-            },
-            "TOP": {
-                "description": "Standing tall",
-                "angles": {
-                    "left_hip": (165, 185),
-                    "right_hip": (165, 185),
-                    "back": (165, 185)
-                }
-            }
-        },
-        "common_mistakes": [
-            ("rounded_back", "back", "<", 140, "Keep back straight!"),
-            ("not_locked", "avg_hip", "<", 160, "Stand up fully")
-        ],
-        "instructions": [
-            "Feet hip-width apart",
-            "Bend at hips, keep back straight",
-            "Grip bar, chest up",
-            "Drive through heels to stand"
-        ]
-    }
-}
-
-# ============================================================
-# DOWNLOAD MODEL
-# ============================================================
-
-def download_model():
-    if not os.path.exists(MODEL_PATH):
-        print("Downloading pose model...")
-        url = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task"
-        urllib.request.urlretrieve(url, MODEL_PATH)
-        print("Download complete!")
-
-# ============================================================
-# IMPROVED ANGLE CALCULATIONS
+# CONFIGURATION
 # ============================================================
 
-def calculate_angle(p1, p2, p3):
-    """Calculate angle at p2 between p1-p2-p3"""
-    v1 = np.array([p1[0] - p2[0], p1[1] - p2[1]])
-    v2 = np.array([p3[0] - p2[0], p3[1] - p2[1]])
-    
-    cos_angle = np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2) + 1e-6)
-    cos_angle = np.clip(cos_angle, -1, 1)
-    angle = np.arccos(cos_angle) * 180 / np.pi
-    
-    return angle
-
-def get_point(landmarks, idx):
-    """Get x, y coordinates from landmark"""
-    return (landmarks[idx].x, landmarks[idx].y)
-
-def get_all_angles(landmarks):
-    """Calculate all relevant angles from landmarks"""
-    angles = {}
-    
-    # Landmark indices
-    NOSE = 0
-    LEFT_SHOULDER = 11
-    RIGHT_SHOULDER = 12
-    LEFT_ELBOW = 13
-    RIGHT_ELBOW = 14
-    LEFT_WRIST = 15
-    RIGHT_WRIST = 16
-    LEFT_HIP = 23
-    RIGHT_HIP = 24
-    LEFT_KNEE = 25
-    RIGHT_KNEE = 26
-    LEFT_ANKLE = 27
-    RIGHT_ANKLE = 28
-    
-    try:
-        # Elbow angles (shoulder-elbow-wrist)
-        angles['left_elbow'] = calculate_angle(
-            get_point(landmarks, LEFT_SHOULDER),
-            get_point(landmarks, LEFT_ELBOW),
-            get_point(landmarks, LEFT_WRIST)
-        )
-        angles['right_elbow'] = calculate_angle(
-            get_point(landmarks, RIGHT_SHOULDER),
-            get_point(landmarks, RIGHT_ELBOW),
-            get_point(landmarks, RIGHT_WRIST)
-        )
-        
-        # Knee angles (hip-knee-ankle)
-        angles['left_knee'] = calculate_angle(
-            get_point(landmarks, LEFT_HIP),
-            get_point(landmarks, LEFT_KNEE),
-            get_point(landmarks, LEFT_ANKLE)
-        )
-        angles['right_knee'] = calculate_angle(
-            get_point(landmarks, RIGHT_HIP),
-            get_point(landmarks, RIGHT_KNEE),
-            get_point(landmarks, RIGHT_ANKLE)
-        )
-        
-        # Hip angles (shoulder-hip-knee)
-        angles['left_hip'] = calculate_angle(
-            get_point(landmarks, LEFT_SHOULDER),
-            get_point(landmarks, LEFT_HIP),
-            get_point(landmarks, LEFT_KNEE)
-        )
-        angles['right_hip'] = calculate_angle(
-            get_point(landmarks, RIGHT_SHOULDER),
-            get_point(landmarks, RIGHT_HIP),
-            get_point(landmarks, RIGHT_KNEE)
-        )
-        
-        # Arm raise angle (how high arms are raised)
-        # Angle between torso and upper arm
-        angles['left_arm_raise'] = calculate_angle(
-            get_point(landmarks, LEFT_HIP),
-            get_point(landmarks, LEFT_SHOULDER),
-            get_point(landmarks, LEFT_ELBOW)
-        )
-        angles['right_arm_raise'] = calculate_angle(
-            get_point(landmarks, RIGHT_HIP),
-            get_point(landmarks, RIGHT_SHOULDER),
-            get_point(landmarks, RIGHT_ELBOW)
-        )
-        
-        # Back angle (shoulder-hip-knee alignment)
-        mid_shoulder = (
-            (landmarks[LEFT_SHOULDER].x + landmarks[RIGHT_SHOULDER].x) / 2,
-            (landmarks[LEFT_SHOULDER].y + landmarks[RIGHT_SHOULDER].y) / 2
-        )
-        mid_hip = (
-            (landmarks[LEFT_HIP].x + landmarks[RIGHT_HIP].x) / 2,
-            (landmarks[LEFT_HIP].y + landmarks[RIGHT_HIP].y) / 2
-        )
-        mid_knee = (
-            (landmarks[LEFT_KNEE].x + landmarks[RIGHT_KNEE].x) / 2,
-            (landmarks[LEFT_KNEE].y + landmarks[RIGHT_KNEE].y) / 2
-        )
-        angles['back'] = calculate_angle(mid_shoulder, mid_hip, mid_knee)
-        
-        # Computed values
-        angles['avg_elbow'] = (angles['left_elbow'] + angles['right_elbow']) / 2
-        angles['avg_knee'] = (angles['left_knee'] + angles['right_knee']) / 2
-        angles['avg_hip'] = (angles['left_hip'] + angles['right_hip']) / 2
-        angles['avg_arm_raise'] = (angles['left_arm_raise'] + angles['right_arm_raise']) / 2
-        angles['elbow_diff'] = abs(angles['left_elbow'] - angles['right_elbow'])
-        angles['knee_diff'] = abs(angles['left_knee'] - angles['right_knee'])
-        angles['arm_raise_diff'] = abs(angles['left_arm_raise'] - angles['right_arm_raise'])
-        
-    except Exception as e:
-        print(f"Angle calculation error: {e}")
-    
-    return angles
-
-# ============================================================
-# IMPROVED FORM CHECKING
-# ============================================================
+# Pose backend is picked per machine by pose_backends.select_backend()
 
-def check_form(exercise_key, angles):
-    """Check form against exercise definition"""
-    
-    if exercise_key not in EXERCISES:
-        return 50, [], "UNKNOWN", {}
-    
-    exercise = EXERCISES[exercise_key]
-    phases = exercise.get('phases', {})
-    
-    # Determine current phase
-    current_phase = None
-    best_phase_score = 0
-    phase_scores = {}
-    
-    for phase_name, phase_data in phases.items():
-        phase_angles = phase_data.get('angles', {})
-        score = 0
-        total = 0
-        
-        for angle_name, (min_val, max_val) in phase_angles.items():
-            if angle_name in angles:
-                total += 1
-                angle_val = angles[angle_name]
-                
-                if min_val <= angle_val <= max_val:
-                    score += 1
-                elif angle_val < min_val:
-                    # Partial credit for being close
-                    diff = min_val - angle_val
-                    score += max(0, 1 - diff / 30)
-                else:
-                    diff = angle_val - max_val
-                    score += max(0, 1 - diff / 30)
-        
-        phase_score = (score / total * 100) if total > 0 else 0
-        phase_scores[phase_name] = phase_score
-        
-        if phase_score > best_phase_score:
-            best_phase_score = phase_score
-            current_phase = phase_name
-    
-    # Check for common mistakes
-    feedback = []
-    mistakes = exercise.get('common_mistakes', [])
-    penalty = 0
-    
-    for mistake in mistakes:
-        name, angle_key, operator, threshold, message = mistake
-        
-        if angle_key in angles:
-            val = angles[angle_key]
-            
-            triggered = False
-            if operator == '<' and val < threshold:
-                triggered = True
-            elif operator == '>' and val > threshold:
-                triggered = True
-            
-            if triggered:
-                feedback.append(message)
-                penalty += 15
-    
-    # Calculate final score
-    accuracy = max(0, min(100, best_phase_score - penalty))
-    
-    # Add phase-specific feedback
-    if current_phase and current_phase in phases:
-        phase_data = phases[current_phase]
-        for angle_name, (min_val, max_val) in phase_data.get('angles', {}).items():
-            if angle_name in angles:
-                val = angles[angle_name]
-                if val < min_val - 15:
-                    nice_name = angle_name.replace('_', ' ').title()
-                    feedback.append(f"{nice_name}: extend more")
-                elif val > max_val + 15:
-                    nice_name = angle_name.replace('_', ' ').title()
-                    feedback.append(f"{nice_name}: bend more")
-    
-    return accuracy, feedback[:4], current_phase or "ACTIVE", angles
+# People to coach at once (>1 enables group mode with per-person tracking)
+MAX_PEOPLE = int(os.environ.get("FORMFIT_MAX_PEOPLE", "1"))
 
 # ============================================================
 # DRAWING
 # ============================================================
 
 def draw_skeleton(image, landmarks, color, highlight_joints=None):
-    """Draw skeleton with optional joint highlighting"""
+    """Draw skeleton from a (33, 4) landmark array with optional joint highlighting"""
     h, w = image.shape[:2]
+    pts = to_pixels(landmarks, w, h)
     
     connections = [
         # Torso
@@ -515,20 +64,10 @@ def draw_skeleton(image, landmarks, color, highlight_joints=None):
     
     # Draw connections
     for start, end in connections:
-        if start < len(landmarks) and end < len(landmarks):
-            x1 = int(landmarks[start].x * w)
-            y1 = int(landmarks[start].y * h)
-            x2 = int(landmarks[end].x * w)
-            y2 = int(landmarks[end].y * h)
-            cv2.line(image, (x1, y1), (x2, y2), color, 4)
+        cv2.line(image, pts[start], pts[end], color, 4)
     
     # Draw joints
-    for i, landmark in enumerate(landmarks):
-        if i > 32:
-            break
-        x = int(landmark.x * w)
-        y = int(landmark.y * h)
-        
+    for i, pt in enumerate(pts):
         # Highlight specific joints if needed
         joint_color = color
         radius = 6
@@ -537,79 +76,34 @@ def draw_skeleton(image, landmarks, color, highlight_joints=None):
             joint_color = (0, 255, 255)  # Yellow for highlighted
             radius = 10
         
-        cv2.circle(image, (x, y), radius, joint_color, -1)
-        cv2.circle(image, (x, y), radius, (255, 255, 255), 2)
+        cv2.circle(image, pt, radius, joint_color, -1)
+        cv2.circle(image, pt, radius, (255, 255, 255), 2)
+
+def accuracy_color(accuracy):
+    """Map an accuracy score to (BGR color, status text)"""
+    if accuracy >= 85:
+        return (0, 255, 0), "PERFECT!"       # Green
+    elif accuracy >= 70:
+        return (0, 200, 255), "GOOD"         # Orange
+    elif accuracy >= 50:
+        return (0, 150, 255), "KEEP GOING"   # Light orange
+    return (0, 0, 255), "ADJUST FORM"        # Red
 
 def draw_angle_indicator(image, landmarks, idx1, idx2, idx3, angle_val, w, h):
     """Draw angle arc at a joint"""
-    x = int(landmarks[idx2].x * w)
-    y = int(landmarks[idx2].y * h)
+    x = int(landmarks[idx2, X] * w)
+    y = int(landmarks[idx2, Y] * h)
     
     # Draw angle value
     cv2.putText(image, f"{angle_val:.0f}", (x + 10, y - 10),
                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 2)
 
-# ============================================================
-# MAIN FORM CHECKER
-# ============================================================
-
-def run_form_checker():
-    download_model()
-    
-    exercises = list(EXERCISES.keys())
-    
-    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
-    options = vision.PoseLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.VIDEO
-    )
-    
-    print("\n" + "="*55)
-    print("       EXERCISE FORM CHECKER v4 - IMPROVED ACCURACY")
-    print("="*55)
-    print("\nAvailable exercises:")
-    for i, ex in enumerate(exercises):
-        print(f"  [{i+1}] {EXERCISES[ex]['name']:20} | {EXERCISES[ex]['camera_position']}")
-    print("\nControls:")
-    print("  1-9: Select exercise")
-    print("  N/P: Next/Previous")
-    print("  D:   Toggle debug info (show all angles)")
-    print("  Q:   Quit")
-    print("="*55 + "\n")
-    
-    current_idx = 0
-    current_key = exercises[current_idx]
-    show_debug = False
-    
-    cap = cv2.VideoCapture(0)
-    
-    # Try to set higher resolution
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    
-    landmarker = vision.PoseLandmarker.create_from_options(options)
-    frame_count = 0
-    
-    # Smoothing for accuracy (reduce jitter)
-    accuracy_history = []
-    SMOOTHING_FRAMES = 5
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame = cv2.flip(frame, 1)  # Mirror
-        frame_count += 1
+def make_display(pool, startup):
+    """Overlays + imshow for one analysis result (latest-wins bus subscriber, main thread)"""
+    def on_display(view):
+        frame = view["frame"]
         h, w = frame.shape[:2]
-        
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-        
-        timestamp_ms = int(frame_count * 1000 / 30)
-        result = landmarker.detect_for_video(mp_image, timestamp_ms)
-        
-        exercise = EXERCISES[current_key]
+        exercise = EXERCISES[view["exercise"]]
         
         # Header
         cv2.rectangle(frame, (0, 0), (w, 75), (40, 40, 40), -1)
@@ -620,41 +114,40 @@ def run_form_checker():
         cv2.putText(frame, f"Camera: {exercise['camera_position']}", (w - 250, 35),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (100, 200, 255), 1)
         
-        if result.pose_landmarks and len(result.pose_landmarks) > 0:
-            landmarks = result.pose_landmarks[0]
-            
-            # Calculate angles
-            angles = get_all_angles(landmarks)
-            
-            # Check form
-            accuracy, feedback, phase, _ = check_form(current_key, angles)
+        if view["people"] is not None:
+            for person_landmarks, person_id, accuracy, reps, feedback in view["people"]:
+                color, _ = accuracy_color(accuracy)
+                draw_skeleton(frame, person_landmarks, color)
+                
+                nose_x, nose_y = to_pixels(person_landmarks, w, h)[0]
+                label_y = max(95, nose_y - 40)
+                cv2.putText(frame, f"P{person_id}  {accuracy:.0f}%  Reps: {reps}",
+                           (nose_x - 80, label_y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                if feedback:
+                    cv2.putText(frame, feedback[0], (nose_x - 80, label_y + 22),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 100, 255), 2)
             
-            # Smooth accuracy
-            accuracy_history.append(accuracy)
-            if len(accuracy_history) > SMOOTHING_FRAMES:
-                accuracy_history.pop(0)
-            smooth_accuracy = sum(accuracy_history) / len(accuracy_history)
+            cv2.putText(frame, f"People: {view['num_poses']}", (20, 120),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            startup.first_feedback()
+        
+        elif view["landmarks"] is not None:
+            smooth_accuracy = view["accuracy"]
+            startup.first_feedback()
             
             # Determine color
-            if smooth_accuracy >= 85:
-                color = (0, 255, 0)   # Green
-                status = "PERFECT!"
-            elif smooth_accuracy >= 70:
-                color = (0, 200, 255) # Orange
-                status = "GOOD"
-            elif smooth_accuracy >= 50:
-                color = (0, 150, 255) # Light orange
-                status = "KEEP GOING"
-            else:
-                color = (0, 0, 255)   # Red
-                status = "ADJUST FORM"
+            color, status = accuracy_color(smooth_accuracy)
             
             # Draw skeleton
-            draw_skeleton(frame, landmarks, color)
+            draw_skeleton(frame, view["landmarks"], color)
             
-            # Status display
-            cv2.putText(frame, status, (20, 120),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 3)
+            # Status display (held analysis while the exercise's joints can't be seen)
+            if view["status"] == REPOSITION:
+                cv2.putText(frame, view["hint"], (20, 120),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+            else:
+                cv2.putText(frame, status, (20, 120),
+                           cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 3)
             
             # Accuracy bar
             bar_w = 200
@@ -668,23 +161,35 @@ def run_form_checker():
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
             # Phase
-            cv2.putText(frame, f"Phase: {phase}", (20, 195),
+            cv2.putText(frame, f"Phase: {view['phase']}", (20, 195),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 2)
+            last_rep = view["last_rep"]
+            if last_rep is not None:
+                cv2.putText(frame, f"Last rep: {last_rep[0]:.0f}% (worst: {last_rep[1]})", (250, 195),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 2)
+            if view["metrics"] is not None:
+                cv2.putText(frame, describe(view["metrics"]), (20, h - 90),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
             
             # Feedback
             y_pos = 230
-            for fb in feedback:
+            for fb in view["feedback"]:
                 cv2.putText(frame, f"• {fb}", (20, y_pos),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 100, 255), 2)
                 y_pos += 28
             
             # Debug info - show all angles
-            if show_debug:
+            if view["debug"] is not None:
+                angles = view["angles"]
+                governor_state, motion_score = view["debug"]
                 debug_y = 100
-                cv2.rectangle(frame, (w - 220, 80), (w - 10, 350), (30, 30, 30), -1)
+                cv2.rectangle(frame, (w - 220, 80), (w - 10, 375), (30, 30, 30), -1)
                 cv2.putText(frame, "DEBUG - Angles:", (w - 210, debug_y),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
                 debug_y += 25
+                cv2.putText(frame, f"governor: {governor_state} {motion_score:.1f}",
+                           (w - 210, debug_y), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (200, 200, 200), 1)
+                debug_y += 22
                 
                 for angle_name in ['left_elbow', 'right_elbow', 'left_knee', 'right_knee',
                                    'left_hip', 'right_hip', 'left_arm_raise', 'right_arm_raise', 'back']:
@@ -695,48 +200,319 @@ def run_form_checker():
                         debug_y += 22
         
         else:
-            cv2.putText(frame, "Stand in frame - full body visible", (20, 120),
+            cv2.putText(frame, view["hint"] or "Stand in frame - full body visible", (20, 120),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
-            accuracy_history = []  # Reset smoothing
         
         # Instructions at bottom
         cv2.rectangle(frame, (0, h - 70), (w, h), (40, 40, 40), -1)
         if exercise.get('instructions'):
             cv2.putText(frame, exercise['instructions'][0], (20, h - 45),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (180, 180, 180), 1)
-        cv2.putText(frame, "[1-9] Select | [N/P] Navigate | [D] Debug | [Q] Quit",
+        cv2.putText(frame, f"[1-9] Select | [N/P] Navigate | [A] Auto {'on' if view['auto_detect'] else 'off'} | [D] Debug | [Q] Quit",
                    (20, h - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (120, 120, 120), 1)
         
         cv2.imshow('Exercise Form Checker', frame)
-        
-        key = cv2.waitKey(1) & 0xFF
-        
-        if key == ord('q'):
-            break
-        elif key == ord('d'):
+        pool.release(frame)
+    return on_display
+
+# ============================================================
+# MAIN FORM CHECKER
+# ============================================================
+
+def run_form_checker():
+    prof = profiler.from_argv()  # --profile: per-stage timings on exit
+    startup = model_assets.StartupTimer()
+    exercises = list(EXERCISES.keys())
+    
+    print("\n" + "="*55)
+    print("       EXERCISE FORM CHECKER v4 - IMPROVED ACCURACY")
+    print("="*55)
+    print("\nAvailable exercises:")
+    for i, ex in enumerate(exercises):
+        print(f"  [{i+1}] {EXERCISES[ex]['name']:20} | {EXERCISES[ex]['camera_position']}")
+    print("\nControls:")
+    print("  1-9: Select exercise")
+    print("  N/P: Next/Previous")
+    print("  A:   Toggle automatic exercise detection")
+    print("  D:   Toggle debug info (show all angles)")
+    print("  Q:   Quit")
+    print("="*55 + "\n")
+    
+    current_idx = 0
+    current_key = exercises[current_idx]
+    show_debug = False
+    auto_detect = True
+    
+    cap = cv2.VideoCapture(0)
+    
+    # Try to set higher resolution
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    startup.mark("camera")
+    # Calibrated on a camera frame on the first run - stand in view
+    backend = pose_backends.select_backend(num_poses=MAX_PEOPLE, camera=cap)
+    startup.mark("backend")
+    log = event_log.open_log("stream")
+    log.emit("session_start", exercise=current_key, backend=backend.name, max_people=MAX_PEOPLE)
+    
+    backend.load(1280, 720)
+    startup.mark("load")
+    frame_count = 0
+    governor = MotionGovernor()
+    ingest = FrameIngest()
+    alloc_meter = AllocationMeter()
+    group = GroupCoach()
+    
+    # Smoothing for accuracy (reduce jitter) - short, landmarks are already filtered
+    accuracy_history = []
+    SMOOTHING_FRAMES = 3
+    
+    # Rep-by-rep similarity to reference reps (library loaded per exercise)
+    rep_libraries = {}
+    recorder = RepRecorder(current_key)
+    last_rep = None
+    
+    # ROM / tempo / asymmetry per rep (O(1) per frame)
+    tracker = RepTracker(current_key) if has_reps(current_key) else None
+    set_metrics = []
+    
+    # Angle / rep / mistake statistics per set, constant memory
+    session_stats = SessionStats()
+    session_stats.start_set(current_key)
+    
+    # Switches exercise when the movement clearly matches another one
+    recognizer = ExerciseRecognizer(ExerciseIndex.load())
+    recognizer.set_current(current_key)
+    
+    # Angles evaluated per frame: only what the exercise's checks, the rep
+    # scorer, the set stats (+ rep driver) and, when on, the recognizer read
+    def plan_angles():
+        extra = rep_features(current_key) + session_stats.current.angles.columns
+        return angle_plan(current_key, extra + ANGLE_INPUTS if auto_detect else extra)
+    plan = plan_angles()
+    
+    # Single-person analysis only runs on frames where the exercise's own
+    # joints are visible and in the picture
+    gate = QualityGate(angle_plan(current_key).landmarks)
+    
+    # Last few seconds of video, saved as a clip when one of the exercise's
+    # common mistakes shows up in the feedback
+    replay = ReplayBuffer()
+    mistakes = {m[4] for m in EXERCISES[current_key].get('common_mistakes', [])}
+    
+    # The frame loop runs on a worker thread and publishes one result per
+    # frame; drawing + imshow consume them on the main thread, which also
+    # forwards key presses to the loop
+    pool = analysis_bus.FramePool()
+    bus = analysis_bus.AnalysisBus()
+    bus.subscribe("display", make_display(pool, startup), main_thread=True,
+                  on_drop=lambda result: pool.release(result["frame"]))
+    bus.start()
+    stop = threading.Event()
+    controls = queue.SimpleQueue()
+    
+    def switch_to(key):
+        nonlocal current_key, accuracy_history, recorder, last_rep, tracker, set_metrics, plan, mistakes
+        current_key = key
+        accuracy_history = []
+        group.reset()
+        recorder, last_rep = RepRecorder(current_key), None
+        tracker = RepTracker(current_key) if has_reps(current_key) else None
+        set_metrics = []
+        session_stats.start_set(current_key)
+        plan = plan_angles()
+        gate.set_joints(angle_plan(current_key).landmarks)
+        mistakes = {m[4] for m in EXERCISES[current_key].get('common_mistakes', [])}
+    
+    def handle_key(key):
+        nonlocal current_idx, auto_detect, show_debug, plan
+        if key == ord('a'):
+            auto_detect = not auto_detect
+            recognizer.set_current(current_key)
+            plan = plan_angles()
+            print(f"Auto detect: {'ON' if auto_detect else 'OFF'}")
+            return
+        if key == ord('d'):
             show_debug = not show_debug
             print(f"Debug mode: {'ON' if show_debug else 'OFF'}")
-        elif key == ord('n'):
+            return
+        if key == ord('n'):
             current_idx = (current_idx + 1) % len(exercises)
-            current_key = exercises[current_idx]
-            accuracy_history = []
-            print(f"Switched to: {EXERCISES[current_key]['name']}")
         elif key == ord('p'):
             current_idx = (current_idx - 1) % len(exercises)
-            current_key = exercises[current_idx]
-            accuracy_history = []
-            print(f"Switched to: {EXERCISES[current_key]['name']}")
-        elif ord('1') <= key <= ord('9'):
-            idx = key - ord('1')
-            if idx < len(exercises):
-                current_idx = idx
-                current_key = exercises[current_idx]
-                accuracy_history = []
-                print(f"Switched to: {EXERCISES[current_key]['name']}")
+        elif ord('1') <= key <= ord('9') and key - ord('1') < len(exercises):
+            current_idx = key - ord('1')
+        else:
+            return
+        switch_to(exercises[current_idx])
+        recognizer.set_current(current_key)
+        print(f"Switched to: {EXERCISES[current_key]['name']}")
+        log.emit("exercise", exercise=current_key, source="manual")
+    
+    def frame_loop():
+        nonlocal frame_count, current_idx, accuracy_history, last_rep
+        adapter = LandmarkAdapter(MAX_PEOPLE)
+        smoother = LandmarkFilter()  # One Euro, single person
+        poses = adapter.poses
+        last_feedback = None  # form state, logged on change
+        held = {}  # last good single-person analysis, shown while the gate rejects
+        
+        while cap.isOpened() and not stop.is_set():
+            while not controls.empty():
+                handle_key(controls.get())
+            alloc_meter.frame_start()
+            prof.frame_start()
+            ret, frame = ingest.read(cap)
+            prof.lap("capture")
+            if not ret:
+                break
+            
+            frame_count += 1
+            
+            # Skip inference while the scene is static (last result is reused)
+            infer = governor.should_infer(frame)
+            prof.lap("governor")
+            if infer:
+                rgb_frame = ingest.to_rgb(frame)
+                prof.lap("to_rgb")
+                
+                timestamp_ms = int(frame_count * 1000 / 30)
+                result = backend.detect(rgb_frame, timestamp_ms)
+                poses = adapter.update(result)
+                adapter.mirror()  # mirror in landmark space - the model sees the unflipped frame
+                governor.observe(poses[0] if len(poses) > 0 else None)
+                prof.lap("detect")
+                
+                # Angles and checks run on smoothed landmarks (filtered in the buffer)
+                if len(poses) == 1:
+                    poses[0] = smoother(poses[0], time.perf_counter())
+                else:
+                    smoother.reset()
+                prof.lap("smooth")
+            
+            ingest.mirror_inplace(frame)  # Mirror for display
+            
+            # Everything the display needs; landmarks are copied because the
+            # adapter's buffer is rewritten by the next detection
+            view = {"exercise": current_key, "auto_detect": auto_detect, "people": None, "landmarks": None,
+                    "status": gate.status, "hint": ""}
+            
+            if MAX_PEOPLE > 1 and len(poses) > 0:
+                # Group class: everyone analysed in one batched pass, state per person
+                tracks = group.update(current_key, poses)
+                prof.lap("group_form")
+                view["people"] = [(poses[track.pose_index].copy(), track.state.person_id, track.state.accuracy,
+                                   track.state.reps, list(track.state.feedback)) for track in tracks]
+                view["num_poses"] = len(poses)
+            
+            elif len(poses) > 0 and not gate.check(poses[0]):
+                view.update(held, status=gate.status, hint=gate.hint())
+                if gate.changed:
+                    log.emit("quality", exercise=current_key, status=gate.status, hint=gate.hint())
+            
+            elif len(poses) > 0:
+                if gate.changed:
+                    log.emit("quality", exercise=current_key, status=gate.status)
+                landmarks = poses[0]
+                
+                # Calculate angles (the current plan's)
+                angles = get_all_angles(landmarks, plan)
+                prof.lap("angles")
+                
+                if auto_detect:
+                    detected = recognizer.update(angles, landmarks)
+                    if detected is not None:
+                        current_idx = exercises.index(detected)
+                        switch_to(detected)
+                        print(f"Detected: {EXERCISES[current_key]['name']} ({100 * recognizer.confidence:.0f}%)")
+                        log.emit("exercise", exercise=current_key, source="recognized",
+                                 confidence=round(recognizer.confidence, 3))
+                        view["exercise"] = current_key
+                    prof.lap("recognize")
+                
+                # Check form
+                accuracy, feedback, phase, _ = check_form(current_key, angles)
+                prof.lap("check_form")
+                session_stats.observe(angles, feedback)
+                if feedback != last_feedback:
+                    log.emit("form", exercise=current_key, accuracy=round(accuracy, 1), feedback=feedback)
+                    last_feedback = feedback
+                for mistake in replay.update([fb for fb in feedback if fb in mistakes]):
+                    log.emit("replay", exercise=current_key, mistake=mistake)
+                
+                # Score each finished rep against the reference library
+                finished = recorder.update([angles.get(k, np.nan) for k in ANGLE_KEYS], phase, time.monotonic())
+                if finished is not None:
+                    if current_key not in rep_libraries:
+                        rep_libraries[current_key] = RepLibrary.load(current_key)
+                    last_rep = rep_libraries[current_key].score_angles(*finished)
+                    if last_rep is not None:
+                        log.emit("rep", exercise=current_key, score=round(last_rep[0], 1), worst=last_rep[1],
+                                 duration_s=round(finished[1], 2))
+                prof.lap("rep_score")
+                
+                if tracker is not None:
+                    metrics = tracker.update(angles, time.monotonic())
+                    if metrics is not None:
+                        set_metrics.append(metrics)
+                        session_stats.add_rep(metrics)
+                        log.emit("rep_metrics", exercise=current_key,
+                                 **{k: round(v, 3) for k, v in metrics._asdict().items()})
+                prof.lap("rep_metrics")
+                
+                # Smooth accuracy
+                accuracy_history.append(accuracy)
+                if len(accuracy_history) > SMOOTHING_FRAMES:
+                    accuracy_history.pop(0)
+                held = dict(landmarks=landmarks.copy(), angles=angles, feedback=feedback, phase=phase,
+                            accuracy=sum(accuracy_history) / len(accuracy_history), last_rep=last_rep,
+                            metrics=set_metrics[-1] if set_metrics else None,
+                            debug=(governor.state, governor.motion_score) if show_debug else None)
+                view.update(held, status=gate.status)
+            
+            else:
+                held = {}
+                gate.reset()
+                if gate.changed:
+                    log.emit("quality", exercise=current_key, status=gate.status)
+                accuracy_history = []  # Reset smoothing
+                recognizer.reset()
+                if tracker is not None:
+                    tracker.reset()
+            
+            replay.push(frame)
+            prof.lap("replay")
+            view["frame"] = pool.snapshot(frame)
+            bus.publish(view)
+            prof.lap("publish")
+            alloc_meter.frame_end()
+    
+    producer = analysis_bus.run_producer(frame_loop, stop)
+    while not stop.is_set():
+        bus.pump(0.005)
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
+            stop.set()
+        elif key != 0xFF:
+            controls.put(key)
+    producer.join()
     
+    bus.close()
     cap.release()
     cv2.destroyAllWindows()
-    landmarker.close()
+    backend.close()
+    print(f"Motion governor: {governor.stats()}")
+    alloc_meter.report(ingest)
+    bus.report()
+    if set_metrics:
+        print(f"Rep metrics ({current_key}): {summarize(set_metrics)}")
+    session_stats.end_set()
+    print(f"Workout summary:\n{session_stats.describe()}")
+    if MAX_PEOPLE == 1:
+        print(f"Quality gate: {gate.stats()}")
+    replay.close()
+    print(f"Instant replay: {replay.stats()}")
+    log.emit("session_end", frames=frame_count, quality=gate.stats())
 
 if __name__ == "__main__":
     run_form_checker()
\ No newline at end of file
@@ -1,48 +1,40 @@
 import cv2
 import numpy as np
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-import urllib.request
 import os
+import threading
+import time
+import sys
 
-# Download the model if not present
-MODEL_PATH = "pose_landmarker_lite.task"
-if not os.path.exists(MODEL_PATH):
-    print("Downloading pose model...")
-    url = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task"
-    urllib.request.urlretrieve(url, MODEL_PATH)
-    print("Download complete!")
+# Shared modules (model_assets, pose_backends, ...) live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis_bus
+import event_log
+import model_assets
+import profiler
+import pose_backends
+from motion_governor import MotionGovernor
+from frame_ingest import FrameIngest, AllocationMeter
+from landmark_adapter import LandmarkAdapter, joint_angles, to_pixels, X
+from landmark_filter import LandmarkFilter
+from pose_quality import QualityGate, REPOSITION
 
-def calculate_angle(a, b, c):
-    """Calculate angle between three points"""
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-    
-    radians = np.arctan2(c[1]-b[1], c[0]-b[0]) - np.arctan2(a[1]-b[1], a[0]-b[0])
-    angle = np.abs(radians * 180.0 / np.pi)
-    
-    if angle > 180.0:
-        angle = 360 - angle
-    return angle
+# Pose backend is picked per machine in main() - importing this module never downloads
+
+# Landmark indices for pose
+LEFT_SHOULDER = 11
+LEFT_HIP = 23
+LEFT_KNEE = 25
+LEFT_ANKLE = 27
+
+SQUAT_TRIPLETS = np.array([
+    [LEFT_HIP, LEFT_KNEE, LEFT_ANKLE],       # knee
+    [LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE],    # back
+])
 
 def check_squat_form(landmarks, frame_width, frame_height):
-    """Check squat form - returns (is_correct, errors, knee_angle)"""
+    """Check squat form on a (33, 4) landmark array - returns (is_correct, errors, knee_angle)"""
     
-    # Landmark indices for pose
-    LEFT_HIP = 23
-    LEFT_KNEE = 25
-    LEFT_ANKLE = 27
-    LEFT_SHOULDER = 11
-    
-    hip = [landmarks[LEFT_HIP].x, landmarks[LEFT_HIP].y]
-    knee = [landmarks[LEFT_KNEE].x, landmarks[LEFT_KNEE].y]
-    ankle = [landmarks[LEFT_ANKLE].x, landmarks[LEFT_ANKLE].y]
-    shoulder = [landmarks[LEFT_SHOULDER].x, landmarks[LEFT_SHOULDER].y]
-    
-    knee_angle = calculate_angle(hip, knee, ankle)
-    back_angle = calculate_angle(shoulder, hip, knee)
+    knee_angle, back_angle = joint_angles(landmarks, SQUAT_TRIPLETS)
     
     errors = []
     
@@ -52,15 +44,16 @@ def check_squat_form(landmarks, frame_width, frame_height):
     if back_angle < 60:
         errors.append("Leaning too far forward")
     
-    if landmarks[LEFT_KNEE].x < landmarks[LEFT_ANKLE].x - 0.05:
+    if landmarks[LEFT_KNEE, X] < landmarks[LEFT_ANKLE, X] - 0.05:
         errors.append("Knee caving inward")
     
     is_correct = len(errors) == 0
     return is_correct, errors, knee_angle
 
 def draw_landmarks(image, landmarks, color):
-    """Draw pose landmarks on image"""
+    """Draw pose landmarks (33, 4 array) on image"""
     h, w = image.shape[:2]
+    pts = to_pixels(landmarks, w, h)
     
     # Connections for body
     connections = [
@@ -72,80 +65,155 @@ def draw_landmarks(image, landmarks, color):
     
     # Draw connections
     for start, end in connections:
-        if start < len(landmarks) and end < len(landmarks):
-            x1 = int(landmarks[start].x * w)
-            y1 = int(landmarks[start].y * h)
-            x2 = int(landmarks[end].x * w)
-            y2 = int(landmarks[end].y * h)
-            cv2.line(image, (x1, y1), (x2, y2), color, 3)
+        cv2.line(image, pts[start], pts[end], color, 3)
     
     # Draw points
-    for landmark in landmarks:
-        x = int(landmark.x * w)
-        y = int(landmark.y * h)
-        cv2.circle(image, (x, y), 5, color, -1)
+    for pt in pts:
+        cv2.circle(image, pt, 5, color, -1)
+
+def make_display(pool, startup):
+    """Draw overlays on the frame snapshot and show it (latest-wins bus subscriber, main thread)"""
+    def on_display(result):
+        frame = result["frame"]
+        if result["status"] == REPOSITION:
+            cv2.putText(frame, result["hint"], (50, 50),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+        elif result["landmarks"] is not None:
+            is_correct, errors = result["is_correct"], result["errors"]
+            
+            # Set color: Green = correct, Red = incorrect
+            color = (0, 255, 0) if is_correct else (0, 0, 255)
+            
+            # Draw skeleton
+            draw_landmarks(frame, result["landmarks"], color)
+            
+            # Display status
+            status = "GOOD FORM" if is_correct else "FIX FORM"
+            cv2.putText(frame, status, (50, 50), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
+            startup.first_feedback()
+            
+            cv2.putText(frame, f"Knee: {int(result['knee_angle'])} deg", (50, 100),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            
+            # Show errors
+            for i, error in enumerate(errors):
+                cv2.putText(frame, error, (50, 150 + i*40),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        cv2.imshow('Exercise Form Checker', frame)
+        pool.release(frame)
+    return on_display
 
 def main():
-    # Setup pose landmarker
-    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
-    options = vision.PoseLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.VIDEO
-    )
-    
+    prof = profiler.from_argv()  # --profile: per-stage timings on exit
+    startup = model_assets.StartupTimer()
+
     cap = cv2.VideoCapture(0)
-    
-    with vision.PoseLandmarker.create_from_options(options) as landmarker:
-        frame_count = 0
+    startup.mark("camera")
+
+    # Pick the best pose backend for this host (cached after the first calibration,
+    # measured on a camera frame - stand in view on the first run)
+    backend = pose_backends.select_backend(camera=cap)
+    startup.mark("backend")
+    log = event_log.open_log("test")
+    log.emit("session_start", exercise="squat", backend=backend.name)
+
+    # The frame loop runs on a worker thread and publishes results; drawing
+    # and imshow consume them on the main thread
+    pool = analysis_bus.FramePool()
+    bus = analysis_bus.AnalysisBus()
+    bus.subscribe("display", make_display(pool, startup), main_thread=True,
+                  on_drop=lambda result: pool.release(result["frame"]))
+    bus.start()
+    stop = threading.Event()
+    governor = MotionGovernor()
+    ingest = FrameIngest()
+    alloc_meter = AllocationMeter()
+    gate = QualityGate(SQUAT_TRIPLETS)  # left shoulder, hip, knee, ankle
+    frame_count = 0
+    
+    def frame_loop():
+        nonlocal frame_count
+        adapter = LandmarkAdapter()
+        smoother = LandmarkFilter()  # One Euro, single person
+        poses = adapter.poses
+        last_errors = None  # form state, logged on change
+        landmarks, is_correct, errors, knee_angle = None, True, [], 0.0  # last good analysis
         
-        while cap.isOpened():
-            ret, frame = cap.read()
+        while cap.isOpened() and not stop.is_set():
+            alloc_meter.frame_start()
+            prof.frame_start()
+            ret, frame = ingest.read(cap)
+            prof.lap("capture")
             if not ret:
                 break
             
             frame_count += 1
             h, w = frame.shape[:2]
             
-            # Convert to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-            
-            # Detect pose
-            timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
-            result = landmarker.detect_for_video(mp_image, timestamp_ms)
+            # Skip inference while the scene is static (last result is reused)
+            infer = governor.should_infer(frame)
+            prof.lap("governor")
+            if infer:
+                # Convert to RGB (into a reused buffer)
+                rgb_frame = ingest.to_rgb(frame)
+                prof.lap("to_rgb")
+                
+                # Detect pose
+                timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
+                result = backend.detect(rgb_frame, timestamp_ms)
+                poses = adapter.update(result)
+                governor.observe(poses[0] if len(poses) > 0 else None)
+                prof.lap("detect")
+                
+                # Angles and checks run on smoothed landmarks (filtered in the buffer)
+                if len(poses) == 1:
+                    poses[0] = smoother(poses[0], time.perf_counter())
+                else:
+                    smoother.reset()
+                prof.lap("smooth")
             
-            if result.pose_landmarks and len(result.pose_landmarks) > 0:
-                landmarks = result.pose_landmarks[0]
+            # Joints occluded or out of frame: keep the last good analysis
+            fresh = len(poses) > 0 and gate.check(poses[0])
+            if fresh:
+                # Copied: the adapter's buffer is rewritten by the next detection
+                landmarks = poses[0].copy()
                 
                 # Check form
                 is_correct, errors, knee_angle = check_squat_form(landmarks, w, h)
-                
-                # Set color: Green = correct, Red = incorrect
-                color = (0, 255, 0) if is_correct else (0, 0, 255)
-                
-                # Draw skeleton
-                draw_landmarks(frame, landmarks, color)
-                
-                # Display status
-                status = "GOOD FORM" if is_correct else "FIX FORM"
-                cv2.putText(frame, status, (50, 50), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
-                
-                cv2.putText(frame, f"Knee: {int(knee_angle)} deg", (50, 100),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                
-                # Show errors
-                for i, error in enumerate(errors):
-                    cv2.putText(frame, error, (50, 150 + i*40),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            
-            cv2.imshow('Exercise Form Checker', frame)
+                prof.lap("check_form")
+                if errors != last_errors:
+                    log.emit("form", correct=is_correct, errors=errors)
+                    last_errors = errors
+            elif len(poses) == 0:
+                landmarks, is_correct, errors, knee_angle = None, True, [], 0.0
+                gate.reset()
+            if gate.changed:
+                log.emit("quality", status=gate.status, hint=gate.hint())
             
+            bus.publish({"frame": pool.snapshot(frame), "landmarks": landmarks, "is_correct": is_correct,
+                         "errors": errors, "knee_angle": knee_angle,
+                         "status": gate.status, "hint": gate.hint()})
+            prof.lap("publish")
+            alloc_meter.frame_end()
+    
+    with backend.load():
+        startup.mark("load")
+        producer = analysis_bus.run_producer(frame_loop, stop)
+        while not stop.is_set():
+            bus.pump(0.005)
             if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+                stop.set()
+        producer.join()
     
+    bus.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(f"Motion governor: {governor.stats()}")
+    alloc_meter.report(ingest)
+    bus.report()
+    print(f"Quality gate: {gate.stats()}")
+    log.emit("session_end", frames=frame_count, quality=gate.stats())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,219 @@
+"""
+FormFit Admission Control
+Keeps an agent worker from taking more fitness sessions than it can coach
+well. Past that point every session on the worker degrades together: late
+cues, choppy voice.
+
+The load score is the largest of three pressures, each 1.0 at the host
+class's budget:
+
+    sessions   (active jobs + accepted ones not active yet) / max_sessions
+    cpu        host CPU use (cgroup-aware, mean of the last ~2.5s) / cpu_budget
+    lag        event-loop lag (worst of the last ~5s) / lag_budget_ms
+
+It is reported to the dispatcher through AgentServer(load_fnc=...,
+load_threshold=LOAD_HIGH). While the worker reports a load at or above the
+threshold, the dispatcher offers new jobs to other workers. The
+request_fnc also rejects jobs without terminating them, so the next worker
+gets them. That covers the gap between load reports, and LiveKit Cloud,
+which ignores custom load functions.
+
+Hysteresis: admission closes when the score reaches LOAD_HIGH and reopens
+only once it is back under LOAD_LOW (with 12 sessions allowed: closed at
+12, open again at 10). While closed, the reported load is held
+at LOAD_HIGH or above, so the worker doesn't flap at the edge.
+
+An accepted job takes a moment to show up in the worker's active jobs, so
+admit() counts its accepts as pending until the active count rises to
+cover them (or PENDING_TIMEOUT_S passes) - a burst of requests can't all
+be admitted against the same stale count. update() runs from load_fnc on
+an executor thread and admit() on the loop; one lock covers the decision
+state, and on_change(stats) is called whenever admission opens or closes.
+
+The lag probe measures the loop it is attached to. That is the worker's own
+loop, which answers the dispatcher and relays every job's IPC, or the
+sessions' loop when they share one (thread executor, agent_loadtest). Job
+processes also show up in the CPU term.
+
+    FORMFIT_HOST_CLASS     density preset, see HOST_CLASSES (default "standard")
+    FORMFIT_MAX_SESSIONS   sessions per worker, overrides the preset
+    FORMFIT_LOAD_HIGH      score that closes admission (default 1.0: a budget is reached)
+    FORMFIT_LOAD_LOW       score that reopens it (default 0.85)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from livekit.agents.utils.hw import get_cpu_monitor
+
+# Sessions per worker and the CPU / lag each host class can afford - starting
+# points; calibrate on the real machines with agent_loadtest (its "load"
+# column) and override with FORMFIT_MAX_SESSIONS.
+HOST_CLASSES = {
+    "small":    {"max_sessions": 4,  "cpu_budget": 0.70, "lag_budget_ms": 80.0},   # 2 vCPU
+    "standard": {"max_sessions": 12, "cpu_budget": 0.80, "lag_budget_ms": 50.0},   # 4-8 vCPU
+    "large":    {"max_sessions": 32, "cpu_budget": 0.85, "lag_budget_ms": 50.0},   # 16+ vCPU
+}
+
+HOST_CLASS = os.environ.get("FORMFIT_HOST_CLASS", "standard")
+MAX_SESSIONS = int(os.environ.get("FORMFIT_MAX_SESSIONS", "0"))  # 0: the host class's
+LOAD_HIGH = float(os.environ.get("FORMFIT_LOAD_HIGH", "1.0"))
+LOAD_LOW = float(os.environ.get("FORMFIT_LOAD_LOW", "0.85"))
+
+SAMPLE_INTERVAL_S = 0.5
+CPU_SAMPLES = 5     # ~2.5s mean, like LiveKit's default load
+LAG_SAMPLES = 10    # ~5s, worst counts
+PENDING_TIMEOUT_S = 10.0  # an accept that never shows up as an active job stops counting
+
+
+class AdmissionControl:
+    def __init__(self, host_class=HOST_CLASS, max_sessions=MAX_SESSIONS, high=LOAD_HIGH, low=LOAD_LOW,
+                 on_change=None):
+        if host_class not in HOST_CLASSES:
+            raise ValueError(f"host class must be one of {sorted(HOST_CLASSES)}")
+        if not low < high:
+            raise ValueError("FORMFIT_LOAD_LOW must be below FORMFIT_LOAD_HIGH")
+        preset = HOST_CLASSES[host_class]
+        self.host_class = host_class
+        self.max_sessions = max_sessions or preset["max_sessions"]
+        self.cpu_budget = preset["cpu_budget"]
+        self.lag_budget_s = preset["lag_budget_ms"] / 1000
+        self.high = high
+        self.low = low
+
+        self.on_change = on_change  # called with stats() when admission opens or closes
+        self.admitting = True
+        self.score = 0.0
+        self.pressures = {"sessions": 0.0, "cpu": 0.0, "lag": 0.0}
+        self.accepted = 0
+        self.rejected = 0
+        self.closures = 0
+
+        self._cpu = deque(maxlen=CPU_SAMPLES)
+        self._lag = deque(maxlen=LAG_SAMPLES)
+        self._probe_sent = None   # perf_counter() of the probe still waiting for the loop
+        self._loop = None
+        self._pending = deque()   # monotonic() of accepts not yet counted in the active sessions
+        self._active = 0          # active sessions on the last update()
+        self._lock = threading.Lock()           # samples
+        self._decide_lock = threading.Lock()    # decision state: load_fnc (executor thread) vs request_fnc (loop)
+        self._sampler = None
+
+    # ---------------- sampling ----------------
+
+    def attach(self, loop=None):
+        """Measure lag on `loop` (default: the running one) and start sampling"""
+        self._loop = loop or asyncio.get_running_loop()
+        self._start()
+
+    def _start(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, name="admission-sampler", daemon=True)
+            self._sampler.start()
+
+    def _on_probe(self, sent):
+        with self._lock:
+            self._lag.append(time.perf_counter() - sent)
+            self._probe_sent = None
+
+    def _sample(self):
+        monitor = get_cpu_monitor()
+        while True:
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                with self._lock:
+                    sent = None
+                    if self._probe_sent is None:
+                        sent = self._probe_sent = time.perf_counter()
+                if sent is not None:
+                    loop.call_soon_threadsafe(self._on_probe, sent)
+            # Blocks for the interval - doubles as the sampling sleep
+            cpu = monitor.cpu_percent(interval=SAMPLE_INTERVAL_S)
+            with self._lock:
+                self._cpu.append(cpu)
+
+    def _lag_s(self):
+        with self._lock:
+            worst = max(self._lag, default=0.0)
+            if self._probe_sent is not None:
+                # A probe that hasn't run yet is lag too (a blocked loop never answers)
+                worst = max(worst, time.perf_counter() - self._probe_sent)
+        return worst
+
+    # ---------------- decisions ----------------
+
+    def update(self, sessions) -> float:
+        """Score for `sessions` active jobs (plus pending accepts); applies hysteresis and returns the load to report"""
+        load, changed = self._decide(sessions, admit=False)
+        if changed:
+            self._notify()
+        return load
+
+    def admit(self, sessions) -> bool:
+        """Decide one job request against the current score; an accept counts as a session until it is active"""
+        admitted, changed = self._decide(sessions, admit=True)
+        if changed:
+            self._notify()
+        return admitted
+
+    def _decide(self, sessions, admit):
+        self._start()
+        with self._lock:
+            cpu = sum(self._cpu) / len(self._cpu) if self._cpu else 0.0
+        lag = self._lag_s()
+        with self._decide_lock:
+            # Accepts the active count has caught up with, or that never arrived
+            now = time.monotonic()
+            for _ in range(max(0, sessions - self._active)):
+                if self._pending:
+                    self._pending.popleft()
+            self._active = sessions
+            while self._pending and now - self._pending[0] > PENDING_TIMEOUT_S:
+                self._pending.popleft()
+
+            self.pressures = {"sessions": (sessions + len(self._pending)) / self.max_sessions,
+                              "cpu": cpu / self.cpu_budget,
+                              "lag": lag / self.lag_budget_s}
+            self.score = max(self.pressures.values())
+
+            previous = self.admitting
+            if self.admitting and self.score >= self.high:
+                self.admitting = False
+                self.closures += 1
+            elif not self.admitting and self.score < self.low:
+                self.admitting = True
+            changed = self.admitting != previous
+
+            if not admit:
+                return (self.score if self.admitting else max(self.score, self.high)), changed
+            if self.admitting:
+                self.accepted += 1
+                self._pending.append(now)
+            else:
+                self.rejected += 1
+            return self.admitting, changed
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self.stats())
+
+    def bottleneck(self) -> str:
+        return max(self.pressures, key=self.pressures.get)
+
+    def stats(self) -> dict:
+        with self._decide_lock:
+            return {
+                "host_class": self.host_class,
+                "max_sessions": self.max_sessions,
+                "admitting": self.admitting,
+                "score": round(self.score, 3),
+                "bottleneck": self.bottleneck(),
+                **{k: round(v, 3) for k, v in self.pressures.items()},
+                "pending": len(self._pending),
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "closures": self.closures,
+            }
@@ -7,18 +7,45 @@ Users can say:
 - "Let's do some squats"  
 - "How's my form?"
 - "How many reps?"
+- "How did I do today?"
 - "Stop" / "End workout"
 """
 
 from dotenv import load_dotenv
 from livekit import agents, rtc
-from livekit.agents import AgentSession, Agent, RoomInputOptions
+from livekit.agents import AgentSession, Agent, RoomInputOptions, JobProcess, RunContext, function_tool
 from livekit.plugins import openai, noise_cancellation
 import os
 import json
+import time
+import asyncio
+from collections import deque
+
+import numpy as np
+
+import event_log
+import profiler
+from admission import AdmissionControl
+from coaching_audio import CoachingAudio, exercise_intro
+from command_channel import CommandChannel
+from exercise_recognition import ANGLE_INPUTS, ExerciseIndex, ExerciseRecognizer
+from form_analysis import angle_plan, get_all_angles
+from motion_governor import MotionGovernor
+from pose_quality import QualityGate
+from rep_metrics import RepTracker, has_reps
+from session_stats import SessionStats
+from workout_digest import WorkoutDigest, inject
 
 load_dotenv(".env.local")
 
+# --profile / FORMFIT_PROFILE=1: span timings per process, printed on exit.
+# Parsed at import so the flags are gone before the LiveKit CLI sees argv.
+prof = profiler.from_argv()
+
+# Session events (packets, exercise switches, reps, digests) go to the
+# process-wide "agent" event log (see event_log), opened on first use so
+# importing this module starts no writer thread
+
 
 # ============================================================
 # EXERCISE DATABASE
@@ -64,6 +91,14 @@ EXERCISES = {
 }
 
 
+# EXERCISES ids -> form_analysis / exercise_recognition keys
+POSE_KEYS = {
+    "push_up": "pushup", "squat": "squat", "bicep_curl": "bicep_curl",
+    "shoulder_press": "shoulder_press", "lunge": "lunge", "lateral_raise": "lateral_raise",
+}
+EXERCISE_IDS = {pose_key: exercise_id for exercise_id, pose_key in POSE_KEYS.items()}
+
+
 def find_exercise(user_input: str) -> str | None:
     """Find exercise ID from user input"""
     user_input = user_input.lower().strip()
@@ -87,33 +122,90 @@ def get_exercise_list() -> str:
 # ============================================================
 
 class WorkoutState:
-    def __init__(self):
+    def __init__(self, recognizer: ExerciseRecognizer | None = None):
         self.active = False
         self.current_exercise = None
         self.reps = 0
         self.is_correct = False
         self.errors = []
         self.is_moving = False
+        self.phase = None
+        self.motion = MotionGovernor()
+        self.recognizer = recognizer  # None: exercise only changes when picked
+        self.rep_tracker = None       # per-rep metrics from landmarks, when the exercise has reps
+        self.rep_metrics = deque(maxlen=20)  # RepMetrics of the current set, newest last
+        self.stats = SessionStats()          # constant-memory angle / rep / mistake stats per set
+        self.angle_plan = self._plan_angles(None)
+        self.quality = QualityGate()         # landmarks only feed our angles while the exercise's joints are visible
+    
+    def _plan_angles(self, pose_key):
+        """Angles worth computing per frame: what the set stats (exercise checks + rep driver) and the recognizer read"""
+        extra = list(self.stats.current.angles.columns) if self.stats.current is not None else []
+        if self.recognizer is not None:
+            extra += ANGLE_INPUTS
+        return angle_plan(pose_key or (), extra)
     
     def start_exercise(self, exercise_id: str):
         self.active = True
         self.current_exercise = exercise_id
         self.reps = 0
         self.errors = []
+        pose_key = POSE_KEYS.get(exercise_id)
+        self.rep_tracker = RepTracker(pose_key) if has_reps(pose_key) else None
+        self.rep_metrics.clear()
+        self.stats.start_set(pose_key or exercise_id)
+        self.angle_plan = self._plan_angles(pose_key)
+        self.quality.set_joints(angle_plan(pose_key or ()).landmarks)
+        if self.recognizer is not None:
+            self.recognizer.set_current(pose_key)
     
     def end_exercise(self):
         self.active = False
         self.current_exercise = None
+        self.stats.end_set()
     
-    def update_from_frontend(self, data: dict):
-        """Update state from frontend pose analysis"""
+    def update_from_frontend(self, data: dict) -> str | None:
+        """Update state from frontend pose analysis; returns an exercise id if recognition switched to it"""
         self.reps = data.get("reps", self.reps)
         self.is_correct = data.get("isCorrect", False)
         self.errors = data.get("errors", [])
+        self.phase = data.get("phase", self.phase)
+        
+        # Prefer our own motion estimate when the frontend sends a full MediaPipe pose
+        landmarks = data.get("landmarks")
+        if landmarks and len(landmarks) == 33:
+            pose = np.array([(p["x"], p["y"], p.get("z", 0.0), p.get("visibility", 1.0)) for p in landmarks],
+                            dtype=np.float32)
+            self.motion.observe(pose)
+            self.is_moving = self.motion.is_moving
+            if not self.quality.check(pose):
+                # Joints occluded or out of frame: no angles, reps or recognition from this one
+                self.stats.observe(mistakes=self.errors)
+                return None
+            angles = get_all_angles(pose, self.angle_plan)
+            if self.rep_tracker is not None:
+                metrics = self.rep_tracker.update(angles, time.monotonic())
+                if metrics is not None:
+                    self.rep_metrics.append(metrics)
+                    self.stats.add_rep(metrics)
+            self.stats.observe(angles, self.errors)
+            if self.recognizer is not None:
+                return self._recognize(pose, angles)
+            return None
+
+        # No landmarks, or a partial set (e.g. 17 COCO points): the frontend's own flag
         self.is_moving = data.get("isMoving", False)
-
-
-workout_state = WorkoutState()
+        self.quality.reset()
+        self.stats.observe(mistakes=self.errors)
+        return None
+    
+    def _recognize(self, pose: np.ndarray, angles: dict) -> str | None:
+        pose_key = self.recognizer.update(angles, pose)
+        exercise_id = EXERCISE_IDS.get(pose_key)
+        if exercise_id is None:
+            return None  # nothing recognized, or an exercise the coach doesn't offer
+        self.start_exercise(exercise_id)
+        return exercise_id
 
 
 # ============================================================
@@ -121,7 +213,8 @@ workout_state = WorkoutState()
 # ============================================================
 
 class FitnessCoachAgent(Agent):
-    def __init__(self) -> None:
+    def __init__(self, workout_state: WorkoutState | None = None) -> None:
+        self.workout_state = workout_state
         super().__init__(
             instructions="""You are FormFit AI, a friendly and energetic voice fitness coach.
 
@@ -140,15 +233,36 @@ Personality:
 - Supportive but push users to improve
 - Use short phrases during active exercise
 
+You'll get short system notes starting with "[workout]" summarizing the user's
+recent reps, form and main issue, and when available the last rep's range of
+motion, down / up tempo and left/right difference ("last rep: ..."). Use them to
+ground your feedback - e.g. slow the lowering, go deeper, even out the sides -
+but don't read them out verbatim. A "Reposition - ..." part means the camera
+can't see the joints the exercise needs: ask them to step back or move the camera.
+
 When user wants to start an exercise:
 1. Confirm the exercise enthusiastically
 2. Give a brief instruction
 3. Tell them to get in position
 4. You'll receive form data to give feedback
 
+For end-of-set or end-of-workout recaps ("how did I do?"), call
+workout_summary and pick the one or two most useful points from it.
+
+When an exercise is picked on screen its instructions are played for you
+(you'll see them in the conversation) - don't repeat them, just encourage.
+
 Keep responses SHORT during exercise - users are moving!
 """
         )
+    
+    @function_tool
+    async def workout_summary(self, context: RunContext) -> str:
+        """Statistics for this workout so far, per exercise: sets, reps, joint angle
+        range, rep tempo, left/right balance and trend, and the most common form issue."""
+        if self.workout_state is None:
+            return "No workout data."
+        return self.workout_state.stats.describe()
 
 
 # ============================================================
@@ -157,63 +271,180 @@ Keep responses SHORT during exercise - users are moving!
 
 from livekit.agents import AgentServer
 
-server = AgentServer()
 
+def prewarm(proc: JobProcess):
+    """Load heavy plugins once per worker process, before any job is assigned"""
+    t0 = time.perf_counter()
+    proc.userdata["noise_cancellation"] = noise_cancellation.BVC()
+    proc.userdata["coaching_audio"] = CoachingAudio().load()
+    proc.userdata["exercise_index"] = ExerciseIndex.load()
+    proc.userdata["prewarm_ms"] = (time.perf_counter() - t0) * 1000
 
-@server.rtc_session()
-async def fitness_session(ctx: agents.JobContext):
-    """Main voice agent session"""
-    
-    session = AgentSession(
+
+# Load score (sessions, CPU, loop lag) reported to the dispatcher; above the
+# host class's budget new jobs go to other workers - see admission
+admission = AdmissionControl(on_change=lambda stats: event_log.open_log("agent").emit("admission", **stats))
+
+
+def worker_load(worker: AgentServer) -> float:
+    """load_fnc: called off the event loop every ~0.5s and before each availability answer"""
+    return admission.update(len(worker.active_jobs))
+
+
+async def on_job_request(req: agents.JobRequest):
+    """Re-check at request time - load reports lag, and LiveKit Cloud ignores load_fnc"""
+    if admission.admit(len(server.active_jobs)):
+        await req.accept()
+        return
+    # Not terminated: the dispatcher offers the job to another worker
+    await req.reject(terminate=False)
+    event_log.open_log("agent").emit("job_rejected", room=req.room.name, **admission.stats())
+
+
+server = AgentServer(setup_fnc=prewarm, load_fnc=worker_load, load_threshold=admission.high)
+server.on("worker_started", admission.attach)
+
+
+def create_session() -> AgentSession:
+    return AgentSession(
         llm=openai.realtime.RealtimeModel(
             voice="coral",  # Energetic voice
             temperature=0.7,
             model="gpt-4o-realtime-preview"
         )
     )
+
+
+def handle_packet(workout_state: WorkoutState, payload: dict) -> str | None:
+    """Apply one frontend data-channel message to the session's workout state.
+
+    Returns the exercise id when pose recognition switched exercises.
+    """
+    if payload.get("type") == "pose_update":
+        return workout_state.update_from_frontend(payload)
+        
+    elif payload.get("type") == "rep_counted":
+        workout_state.reps = payload.get("reps", 0)
+        
+    elif payload.get("type") == "exercise_selected":
+        exercise_id = payload.get("exerciseId")
+        if exercise_id:
+            workout_state.start_exercise(exercise_id)
+    return None
+
+
+async def run_fitness_session(ctx: agents.JobContext, session_factory=create_session):
+    """Session body; the load-test harness passes a fake ctx and a stub session_factory"""
+    job_t0 = time.perf_counter()
+    log = event_log.open_log("agent")
+    
+    session = session_factory()
+    # One per session - a worker can host several jobs
+    index = ctx.proc.userdata.get("exercise_index")
+    workout_state = WorkoutState(ExerciseRecognizer(index) if index is not None else None)
+    agent = FitnessCoachAgent(workout_state)
+    
+    digest = WorkoutDigest()
+    digest_task = None
+    room = ctx.room.name
+    
+    async def push_digest(text: str, sequence: int):
+        try:
+            with prof.span("digest_push"):
+                await agent.update_chat_ctx(inject(agent.chat_ctx, text, sequence, digest.keep))
+            log.emit("digest", room=room, sequence=sequence, chars=len(text))
+        except Exception as e:
+            print(f"Error updating chat context: {e}")
+            log.emit("error", room=room, where="digest_push", error=str(e))
+    
+    coaching_audio = ctx.proc.userdata.get("coaching_audio")
+    
+    def play_intro(exercise_id: str):
+        """Fixed instructions from the pre-rendered cache; the model stays free for replies"""
+        text = exercise_intro(EXERCISES[exercise_id])
+        frames = coaching_audio.frames(text) if coaching_audio else None
+        if frames is not None:
+            session.say(text, audio=frames)
+        log.emit("intro", room=room, exercise=exercise_id, cached=frames is not None)
     
-    agent = FitnessCoachAgent()
+    last_metrics = None
     
     # Handle data from frontend (pose analysis results)
     @ctx.room.on("data_received")
     def on_data(data: rtc.DataPacket):
-        try:
-            payload = json.loads(data.data.decode())
-            
-            if payload.get("type") == "pose_update":
-                workout_state.update_from_frontend(payload)
-                
-            elif payload.get("type") == "rep_counted":
-                workout_state.reps = payload.get("reps", 0)
-                
-            elif payload.get("type") == "exercise_selected":
-                exercise_id = payload.get("exerciseId")
-                if exercise_id:
-                    workout_state.start_exercise(exercise_id)
-                    
-        except Exception as e:
-            print(f"Error processing data: {e}")
-    
-    # Function to send commands to frontend
-    async def send_to_frontend(command: dict):
-        data = json.dumps(command).encode()
-        await ctx.room.local_participant.publish_data(data)
-    
-    await session.start(
-        room=ctx.room,
-        agent=agent,
-        room_input_options=RoomInputOptions(
-            noise_cancellation=noise_cancellation.BVC(),
-        ),
-    )
+        nonlocal digest_task, last_metrics
+        with prof.span("on_data"):
+            try:
+                payload = json.loads(data.data.decode())
+                kind = payload.get("type")
+                reps = workout_state.reps
+                recognized = handle_packet(workout_state, payload)
+                # Pose updates are logged without the landmarks - type and size only
+                log.emit("packet", room=room, type=kind, bytes=len(data.data))
+                if kind == "exercise_selected":
+                    log.emit("exercise", room=room, exercise=workout_state.current_exercise, source="selected")
+                    if workout_state.current_exercise in EXERCISES:
+                        play_intro(workout_state.current_exercise)
+                if recognized:
+                    # The user started something else without saying so - follow along
+                    send_to_frontend({"type": "exercise_start", "exerciseId": recognized, "source": "recognized"})
+                    log.emit("exercise", room=room, exercise=recognized, source="recognized")
+                if workout_state.reps != reps:
+                    log.emit("rep", room=room, exercise=workout_state.current_exercise, reps=workout_state.reps)
+                if workout_state.rep_metrics and workout_state.rep_metrics[-1] is not last_metrics:
+                    last_metrics = workout_state.rep_metrics[-1]
+                    log.emit("rep_metrics", room=room, exercise=workout_state.current_exercise,
+                             **{k: round(v, 3) for k, v in last_metrics._asdict().items()})
+                digest.observe(workout_state)
+                # One context update in flight at a time; the next due check catches up
+                if digest.due() and (digest_task is None or digest_task.done()):
+                    digest_task = asyncio.create_task(push_digest(digest.build(), digest.sequence))
+            except Exception as e:
+                print(f"Error processing data: {e}")
+                log.emit("error", room=room, where="on_data", error=str(e))
+    
+    # Commands to frontend: batched per tick, lossy latest-wins for UI hints
+    channel = CommandChannel(ctx.room.local_participant)
+    ctx.add_shutdown_callback(channel.aclose)
+    
+    def send_to_frontend(command: dict, reliable: bool | None = None):
+        channel.send(command, reliable)
+    
+    with prof.span("session_start"):
+        await session.start(
+            room=ctx.room,
+            agent=agent,
+            room_input_options=RoomInputOptions(
+                noise_cancellation=ctx.proc.userdata.get("noise_cancellation") or noise_cancellation.BVC(),
+            ),
+        )
+    session_ready_ms = (time.perf_counter() - job_t0) * 1000
+    log.emit("session_start", room=room, ready_ms=round(session_ready_ms, 1))
+    
+    async def log_session_end():
+        workout_state.stats.end_set()
+        log.emit("session_end", room=room, exercise=workout_state.current_exercise, reps=workout_state.reps,
+                 summary=workout_state.stats.summary())
+    ctx.add_shutdown_callback(log_session_end)
     
     # Initial greeting
-    await session.generate_reply(
+    greeting = session.generate_reply(
         instructions="""Greet the user as their AI fitness coach! 
         Tell them you can help with exercises like push ups, squats, and curls.
         Ask what exercise they'd like to do today.
         Be energetic but brief!"""
     )
+    with prof.span("greeting"):
+        await greeting
+    print(f"Startup: prewarm {ctx.proc.userdata.get('prewarm_ms', 0):.0f}ms | "
+          f"session ready {session_ready_ms:.0f}ms | "
+          f"first reply {(time.perf_counter() - job_t0) * 1000:.0f}ms")
+
+
+@server.rtc_session(on_request=on_job_request)
+async def fitness_session(ctx: agents.JobContext):
+    """Main voice agent session"""
+    await run_fitness_session(ctx)
 
 
 # ============================================================
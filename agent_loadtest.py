@@ -0,0 +1,319 @@
+"""
+FormFit Agent Load Test
+How many concurrent fitness sessions can one worker sustain?
+
+Runs the real session body (agent.run_fitness_session) N times in one event
+loop, with a local fake room / data channel in place of ctx.room and a stub
+session in place of AgentSession + openai.realtime.RealtimeModel (no network,
+no audio). Simulated participants send pose_update / rep_counted /
+exercise_selected traffic at a configurable rate and burst shape; pose
+payloads come from synthetic_poses so they carry real landmark arrays.
+
+Reported per run: packets handled per second, per-packet latency (send ->
+handler done, including time queued on the loop) and pure handler time,
+event-loop lag, RSS growth per session, and the admission score
+(admission.AdmissionControl for FORMFIT_HOST_CLASS) the worker would report
+at that load - calibrate HOST_CLASSES with it.
+
+LiveKit runs each job in its own process by default, so this measures the
+per-session cost inside one process; size the fleet on the handler and lag
+numbers plus the per-process baseline.
+
+    python agent_loadtest.py --sessions 1,10,50,100 --rate 30 --shape burst
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import gc
+import json
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import psutil
+from livekit import rtc
+
+import agent
+from admission import AdmissionControl
+import synthetic_poses
+from exercise_recognition import ExerciseIndex
+
+SHAPES = ("steady", "poisson", "burst")
+
+# agent.EXERCISES ids -> synthetic_poses / form_analysis keys
+POSE_EXERCISES = {
+    "push_up": "pushup", "squat": "squat", "bicep_curl": "bicep_curl",
+    "shoulder_press": "shoulder_press", "lunge": "lunge", "lateral_raise": "lateral_raise",
+}
+
+
+# ============================================================
+# LIVEKIT STAND-INS
+# ============================================================
+
+class FakeLocalParticipant:
+    identity = "agent"
+
+    def __init__(self):
+        self.sent = 0
+        self.sent_bytes = 0
+
+    async def publish_data(self, payload, *, reliable=True, destination_identities=[], topic=""):
+        self.sent += 1
+        self.sent_bytes += len(payload)
+
+
+class FakeRoom(rtc.EventEmitter):
+    """ctx.room stand-in: data packets are dispatched on the loop like the SDK does"""
+
+    def __init__(self, stats):
+        super().__init__()
+        self.name = "loadtest"
+        self.local_participant = FakeLocalParticipant()
+        self._stats = stats
+        self._loop = asyncio.get_running_loop()
+
+    def deliver(self, data: bytes, reliable=True):
+        kind = rtc.DataPacketKind.KIND_RELIABLE if reliable else rtc.DataPacketKind.KIND_LOSSY
+        self._loop.call_soon(self._dispatch, rtc.DataPacket(data=data, kind=kind, participant=None),
+                             time.perf_counter())
+
+    def _dispatch(self, packet, sent_at):
+        start = time.perf_counter()
+        self.emit("data_received", packet)
+        done = time.perf_counter()
+        self._stats.record(done - sent_at, done - start)
+
+
+class StubSpeech:
+    """Awaitable like a SpeechHandle; finishes after the simulated model latency"""
+
+    def __init__(self, delay):
+        self._task = asyncio.ensure_future(asyncio.sleep(delay))
+
+    def __await__(self):
+        return self._task.__await__()
+
+
+class StubSession:
+    """AgentSession stand-in: no model, no audio, fixed reply latency"""
+
+    def __init__(self, reply_delay=0.3):
+        self.reply_delay = reply_delay
+        self.replies = 0
+
+    async def start(self, room, agent, room_input_options=None, **kwargs):
+        self.room = room
+        self.agent = agent
+
+    def generate_reply(self, instructions=None, **kwargs):
+        self.replies += 1
+        return StubSpeech(self.reply_delay)
+
+    def say(self, text, audio=None, **kwargs):
+        self.replies += 1
+        return StubSpeech(self.reply_delay)
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+class LoadStats:
+    def __init__(self):
+        self.latency = []
+        self.handler = []
+
+    def record(self, latency, handler):
+        self.latency.append(latency)
+        self.handler.append(handler)
+
+
+class _ErrorCounter:
+    """stdout sink during the run: counts the session's error prints, drops the rest"""
+
+    def __init__(self):
+        self.errors = 0
+        self.last_error = None
+
+    def write(self, text):
+        if text.startswith("Error"):
+            self.errors += 1
+            self.last_error = text.strip()
+
+    def flush(self):
+        pass
+
+
+async def _monitor_loop_lag(lags, interval=0.01):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - t - interval)
+
+
+def _percentiles_ms(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3),
+            "max": round(max(values) * 1000, 3)}
+
+
+# ============================================================
+# SIMULATED PARTICIPANTS
+# ============================================================
+
+@functools.lru_cache(maxsize=None)
+def _pose_payloads(exercise_id, landmarks=True, frames=120):
+    """Pre-encoded pose_update packets, so encoding doesn't count against the agent"""
+    trace = synthetic_poses.generate(POSE_EXERCISES[exercise_id], reps=3, seed=0)
+    step = max(1, len(trace) // frames)
+    payloads = []
+    for i in range(0, len(trace), step):
+        message = {"type": "pose_update", "reps": int(trace.rep[i]), "isCorrect": True,
+                   "errors": [], "isMoving": True}
+        if landmarks:
+            message["landmarks"] = [{"x": round(float(x), 4), "y": round(float(y), 4)}
+                                    for x, y in trace.landmarks[i, :, :2]]
+        payloads.append(json.dumps(message).encode())
+    return payloads
+
+
+async def participant(room, rng, stop_at, rate=30.0, shape="steady", burst=5,
+                      rep_period=2.5, switch_period=60.0, landmarks=True):
+    exercises = list(POSE_EXERCISES)
+
+    def select(exercise_id):
+        room.deliver(json.dumps({"type": "exercise_selected", "exerciseId": exercise_id}).encode())
+        return _pose_payloads(exercise_id, landmarks)
+
+    payloads = select(rng.choice(exercises))
+    frame, reps = rng.randrange(len(payloads)), 0
+    now = time.perf_counter()
+    next_rep, next_switch = now + rep_period, now + switch_period
+
+    while (now := time.perf_counter()) < stop_at:
+        count = burst if shape == "burst" else 1
+        for _ in range(count):
+            room.deliver(payloads[frame % len(payloads)], reliable=False)
+            frame += 1
+        if now >= next_rep:
+            reps += 1
+            room.deliver(json.dumps({"type": "rep_counted", "reps": reps}).encode())
+            next_rep += rep_period
+        if now >= next_switch:
+            payloads, reps = select(rng.choice(exercises)), 0
+            next_switch += switch_period
+
+        if shape == "poisson":
+            await asyncio.sleep(rng.expovariate(rate))
+        else:
+            await asyncio.sleep(count / rate)
+
+
+# ============================================================
+# RUN
+# ============================================================
+
+async def run_load(sessions=10, duration=10.0, rate=30.0, shape="steady", burst=5,
+                   reply_delay=0.3, landmarks=True, seed=0):
+    if shape not in SHAPES:
+        raise ValueError(f"shape must be one of {SHAPES}")
+    stats = LoadStats()
+    lags = []
+    rng = random.Random(seed)
+    process = psutil.Process()
+
+    for exercise_id in POSE_EXERCISES:
+        _pose_payloads(exercise_id, landmarks)  # build outside the measured window
+    exercise_index = ExerciseIndex.load()  # shared like prewarm's, one recognizer per session
+    gc.collect()
+    rss_before = process.memory_info().rss
+    monitor = asyncio.create_task(_monitor_loop_lag(lags))
+    admission = AdmissionControl()
+    admission.attach()
+    sink = _ErrorCounter()
+
+    with contextlib.redirect_stdout(sink):
+        rooms = []
+        for _ in range(sessions):
+            room = FakeRoom(stats)
+            ctx = SimpleNamespace(room=room, proc=SimpleNamespace(userdata={"noise_cancellation": object(),
+                                                                           "exercise_index": exercise_index}),
+                                  add_shutdown_callback=lambda callback: None)
+            await agent.run_fitness_session(ctx, session_factory=lambda: StubSession(reply_delay))
+            rooms.append(room)
+        rss_sessions = process.memory_info().rss
+
+        lags.clear()
+        t0 = time.perf_counter()
+        stop_at = t0 + duration
+        await asyncio.gather(*(
+            participant(room, random.Random(rng.random()), stop_at, rate=rate, shape=shape,
+                        burst=burst, landmarks=landmarks)
+            for room in rooms))
+        await asyncio.sleep(0)  # let the last dispatches run
+        elapsed = time.perf_counter() - t0
+        admission.update(sessions)
+
+    monitor.cancel()
+    rss_after = process.memory_info().rss
+    return {
+        "sessions": sessions,
+        "shape": shape,
+        "rate_hz": rate,
+        "packets": len(stats.latency),
+        "throughput_pps": round(len(stats.latency) / elapsed, 1),
+        "latency_ms": _percentiles_ms(stats.latency),
+        "handler_ms": _percentiles_ms(stats.handler),
+        "loop_lag_ms": _percentiles_ms(lags),
+        "rss_per_session_kb": round((rss_after - rss_before) / sessions / 1024, 1),
+        "rss_setup_per_session_kb": round((rss_sessions - rss_before) / sessions / 1024, 1),
+        "admission": admission.stats(),
+        "errors": sink.errors,
+        "last_error": sink.last_error,
+    }
+
+
+def _print_report(report, latency_budget_ms):
+    ok = (report["latency_ms"]["p99"] <= latency_budget_ms
+          and report["loop_lag_ms"]["p99"] <= latency_budget_ms and not report["errors"])
+    lat, lag = report["latency_ms"], report["loop_lag_ms"]
+    print(f"{report['sessions']:>5} sessions | {report['throughput_pps']:>9.0f} pkt/s | "
+          f"latency p50 {lat['p50']:.2f} p99 {lat['p99']:.2f} ms | "
+          f"handler p99 {report['handler_ms']['p99']:.3f} ms | "
+          f"loop lag p99 {lag['p99']:.2f} ms | "
+          f"{report['rss_per_session_kb']:.0f} KB/session | "
+          f"load {report['admission']['score']:.2f} ({report['admission']['bottleneck']}) | "
+          f"errors {report['errors']} | {'OK' if ok else 'OVER BUDGET'}")
+    if report["last_error"]:
+        print(f"      last error: {report['last_error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test fitness_session with a fake room")
+    parser.add_argument("--sessions", default="1,10,50", help="comma separated session counts to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    parser.add_argument("--rate", type=float, default=30.0, help="pose_update packets/s per participant")
+    parser.add_argument("--shape", choices=SHAPES, default="steady")
+    parser.add_argument("--burst", type=int, default=5, help="packets per burst for --shape burst")
+    parser.add_argument("--reply-delay", type=float, default=0.3, help="stub model reply latency (s)")
+    parser.add_argument("--no-landmarks", action="store_true", help="send pose_update without landmarks")
+    parser.add_argument("--latency-budget-ms", type=float, default=50.0)
+    parser.add_argument("--json", help="write all step reports to this file")
+    args = parser.parse_args()
+
+    reports = []
+    for n in [int(s) for s in args.sessions.split(",")]:
+        report = asyncio.run(run_load(n, args.duration, args.rate, args.shape, args.burst,
+                                      args.reply_delay, not args.no_landmarks))
+        _print_report(report, args.latency_budget_ms)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
@@ -0,0 +1,285 @@
+"""
+FormFit Analysis Bus
+In-process publish/subscribe for per-frame analysis results, so the frame
+loop only captures, infers and analyses, and everything downstream (voice
+cues, overlays and imshow, logging, network publishing) consumes at its own
+pace without being able to stall it.
+
+    bus = AnalysisBus()
+    bus.subscribe("voice", on_voice, policy="lossless", capacity=64)
+    bus.subscribe("display", draw, policy="latest", main_thread=True)
+    bus.start()
+    ...
+    bus.publish({"frame": frame, "errors": errors, ...})   # frame loop, ~2us per subscriber
+    ...
+    bus.pump()          # main thread: runs main_thread subscribers (OpenCV GUI calls)
+    bus.close()         # drains lossless mailboxes, stops threads, prints per-subscriber lag
+
+Per subscriber:
+  policy "latest"    one-slot mailbox, a newer message replaces an unhandled
+                     one (counted as dropped) - displays, status, UI hints
+  policy "lossless"  bounded FIFO of `capacity`; when full the publisher
+                     waits for room (counted as stall time) - voice, logs
+  max_rate_hz        handler called at most this often (latest-wins subscribers
+                     then always see the newest message)
+  main_thread        handled by pump() on the calling thread instead of a
+                     worker thread (cv2.imshow / waitKey must stay on the main
+                     thread on macOS)
+
+Lag (publish -> handler start) and handler time are kept per subscriber in
+a ring of the last LAG_SAMPLES messages; stats() / report() summarize them.
+
+Frames: FrameIngest only double-buffers, so a capture buffer can be
+rewritten while a slow display still holds it. Publish a FramePool snapshot
+instead; the display releases it after imshow, and on_drop releases the
+ones a newer frame replaced - steady state is three buffers, no allocation.
+
+run_producer() runs a frame loop in a worker thread, so the main thread is
+free to pump the display.
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+LAG_SAMPLES = 1024
+POLICIES = ("latest", "lossless")
+
+
+class Subscriber:
+    def __init__(self, name, handler, policy="latest", capacity=1, max_rate_hz=None, main_thread=False,
+                 on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.capacity = 1 if policy == "latest" else max(1, capacity)
+        self.min_interval = 1.0 / max_rate_hz if max_rate_hz else 0.0
+        self.main_thread = main_thread
+        self.on_drop = on_drop
+
+        self._mailbox = deque()     # (published_at, message)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._last_call = 0.0
+        self._thread = None
+
+        self.published = 0
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.stall_s = 0.0
+        self._lag = np.zeros(LAG_SAMPLES)
+        self._busy = np.zeros(LAG_SAMPLES)
+
+    # ---------------- publisher side ----------------
+
+    def offer(self, message, now):
+        with self._cond:
+            if self._closed:
+                return
+            self.published += 1
+            if self.policy == "latest":
+                if self._mailbox:
+                    _, replaced = self._mailbox.popleft()
+                    self.dropped += 1
+                    if self.on_drop is not None:
+                        self.on_drop(replaced)
+            elif len(self._mailbox) >= self.capacity:
+                # Lossless and full: wait for the consumer rather than drop
+                t0 = time.perf_counter()
+                while len(self._mailbox) >= self.capacity and not self._closed:
+                    self._cond.wait(0.1)
+                self.stall_s += time.perf_counter() - t0
+            self._mailbox.append((now, message))
+            self._cond.notify_all()
+
+    # ---------------- consumer side ----------------
+
+    def _take(self, timeout):
+        with self._cond:
+            if not self._mailbox and not self._closed and timeout:
+                self._cond.wait(timeout)
+            if not self._mailbox:
+                return None
+            item = self._mailbox.popleft()
+            self._cond.notify_all()  # room for a waiting lossless publisher
+            return item
+
+    def _handle(self, item):
+        published_at, message = item
+        start = time.perf_counter()
+        try:
+            self.handler(message)
+        except Exception as e:
+            self.errors += 1
+            if self.errors <= 3:
+                print(f"Subscriber {self.name} error: {e}")
+        end = time.perf_counter()
+        i = self.handled % LAG_SAMPLES
+        self._lag[i] = start - published_at
+        self._busy[i] = end - start
+        self.handled += 1
+        self._last_call = end
+
+    def _wait_rate(self):
+        if self.min_interval:
+            wait = self._last_call + self.min_interval - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+    def _run(self):
+        while True:
+            self._wait_rate()
+            item = self._take(0.1)
+            if item is not None:
+                self._handle(item)
+            elif self._closed:
+                return
+
+    def pump(self, timeout=0.0):
+        """Handle what's waiting now (main-thread subscribers); returns messages handled"""
+        if self.min_interval and time.perf_counter() - self._last_call < self.min_interval:
+            return 0
+        handled = 0
+        item = self._take(timeout)
+        while item is not None:
+            self._handle(item)
+            handled += 1
+            if self.policy == "latest":
+                break
+            item = self._take(0)
+        return handled
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        elif self.policy == "lossless":
+            self.pump()
+
+    # ---------------- stats ----------------
+
+    def stats(self) -> dict:
+        n = min(self.handled, LAG_SAMPLES)
+        out = {"published": self.published, "handled": self.handled, "dropped": self.dropped,
+               "backlog": len(self._mailbox), "errors": self.errors, "stall_ms": round(self.stall_s * 1000, 1)}
+        if n:
+            p50, p95 = np.percentile(self._lag[:n], [50, 95]) * 1000
+            out.update(lag_p50_ms=round(p50, 2), lag_p95_ms=round(p95, 2),
+                       busy_mean_ms=round(self._busy[:n].mean() * 1000, 2))
+        return out
+
+
+class AnalysisBus:
+    def __init__(self):
+        self.subscribers = {}
+        self._started = False
+
+    def subscribe(self, name, handler, policy="latest", capacity=1, max_rate_hz=None, main_thread=False,
+                  on_drop=None):
+        sub = Subscriber(name, handler, policy, capacity, max_rate_hz, main_thread, on_drop)
+        self.subscribers[name] = sub
+        if self._started:
+            self._start(sub)
+        return sub
+
+    def _start(self, sub):
+        if not sub.main_thread and sub._thread is None:
+            sub._thread = threading.Thread(target=sub._run, name=f"bus-{sub.name}", daemon=True)
+            sub._thread.start()
+
+    def start(self):
+        self._started = True
+        for sub in self.subscribers.values():
+            self._start(sub)
+        return self
+
+    def publish(self, message):
+        """Fan a result out to every subscriber; only lossless subscribers that are full can block"""
+        now = time.perf_counter()
+        for sub in self.subscribers.values():
+            sub.offer(message, now)
+
+    def pump(self, timeout=0.0):
+        """Run main-thread subscribers; waits up to `timeout` for the first of them"""
+        handled = 0
+        for sub in self.subscribers.values():
+            if sub.main_thread:
+                handled += sub.pump(timeout)
+                timeout = 0.0
+        return handled
+
+    def close(self):
+        for sub in self.subscribers.values():
+            sub.close()
+
+    def stats(self) -> dict:
+        return {name: sub.stats() for name, sub in self.subscribers.items()}
+
+    def report(self):
+        print("Analysis bus:")
+        for name, s in self.stats().items():
+            lag = (f"lag p50 {s['lag_p50_ms']:.2f}ms p95 {s['lag_p95_ms']:.2f}ms, busy {s['busy_mean_ms']:.2f}ms"
+                   if "lag_p50_ms" in s else "no messages handled")
+            print(f"  {name:<10} {s['handled']:>7} handled, {s['dropped']:>6} dropped, "
+                  f"stalled {s['stall_ms']:.0f}ms | {lag}")
+
+
+class FramePool:
+    """Reusable frame snapshots for subscribers that outlive the capture buffer"""
+
+    def __init__(self):
+        self._free = []
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def snapshot(self, frame):
+        with self._lock:
+            buf = self._free.pop() if self._free else None
+        if buf is None or buf.shape != frame.shape:
+            buf = np.empty_like(frame)
+            self.allocations += 1
+        np.copyto(buf, frame)
+        return buf
+
+    def release(self, buf):
+        if buf is not None:
+            with self._lock:
+                self._free.append(buf)
+
+
+class Producer:
+    """A frame loop on a worker thread; exceptions are re-raised by join()"""
+
+    def __init__(self, target, stop):
+        self.stop = stop
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(target,), name="frame-loop", daemon=True)
+
+    def _run(self, target):
+        try:
+            target()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.stop.set()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def run_producer(target, stop=None) -> Producer:
+    """Start target() (which should return once `stop` is set) on a worker thread"""
+    return Producer(target, stop or threading.Event()).start()
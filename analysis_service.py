@@ -0,0 +1,442 @@
+"""
+FormFit Analysis Service
+Form analysis over the network: landmark frames in, phase / accuracy /
+feedback / reps out, for the browser, the voice agent or anything else that
+can't import form_analysis.
+
+Requests that arrive within FORMFIT_SERVICE_BATCH_MS of each other (default
+3ms) are evaluated together - one batch_angles() over the stacked frames and
+one batch_check_form() per exercise - so the per-frame cost falls as load
+rises instead of every request paying for its own numpy calls. Each client
+keeps streaming state (exercise, phase, rep count) between frames.
+
+    WebSocket  /ws?exercise=squat
+        text   {"landmarks": [[x, y, z, vis] * 33] or [{"x":..,"y":..}, ...],
+                "t": capture time in seconds (optional),
+                "exercise": "lunge" (optional, switches), "reset": true (optional)}
+        binary 33 * 4 little-endian float32 (x, y, z, visibility),
+               optionally followed by the capture time as a little-endian float64
+        reply  {"type": "analysis", "seq", "phase", "accuracy", "feedback", "reps", "status", "hint"}
+
+    POST /analyze   {"client": id, "exercise": key, "landmarks": ..., "t": seconds}
+                    (or "frames": [landmarks, ...] for several in order,
+                    with "times": [seconds, ...])
+    GET  /stats
+
+Rep counting needs to know when each frame was captured. Send "t" (any
+clock, as long as a client keeps using it) when frames aren't analysed as
+they are captured. Without it a frame is stamped with its arrival time, but
+never less than 1 / NOMINAL_FPS after the client's previous frame, so a
+recorded trace sent in one request is timed as if it were captured at
+NOMINAL_FPS.
+
+Exercise keys are form_analysis.EXERCISES keys (shoulder_press, squat, ...).
+
+Frames where the exercise's joints are occluded or out of the picture
+(pose_quality.QualityGate) skip the batch and are answered at once with the
+client's unchanged state; "status" turns "reposition" (with a "hint") when
+that goes on for a few frames.
+
+    python analysis_service.py                      # serve on 127.0.0.1:8765
+    python analysis_service.py bench --clients 1,10,100,400
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+from aiohttp import web, WSMsgType
+
+import event_log
+from form_analysis import EXERCISES, angle_plan, batch_angles, batch_check_form
+from pose_quality import QualityGate
+from pose_tracking import PersonState
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+HOST = os.environ.get("FORMFIT_SERVICE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("FORMFIT_SERVICE_PORT", "8765"))
+
+# How long the first request of a batch waits for company, and the batch cap
+BATCH_WINDOW_S = float(os.environ.get("FORMFIT_SERVICE_BATCH_MS", "3")) / 1000
+MAX_BATCH = int(os.environ.get("FORMFIT_SERVICE_MAX_BATCH", "512"))
+
+# HTTP clients are identified by "client"; their state is dropped after this long idle
+CLIENT_TTL_S = 120.0
+
+# Frame rate assumed for frames that arrive together without a "t"
+NOMINAL_FPS = 30.0
+
+NUM_LANDMARKS = 33
+FRAME_BYTES = NUM_LANDMARKS * 4 * 4
+TIMED_FRAME_BYTES = FRAME_BYTES + 8  # + float64 capture time
+
+
+# ============================================================
+# CLIENT STATE
+# ============================================================
+
+class ClientSession:
+    """Streaming state for one client: exercise plus rep / phase tracking"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, exercise=None):
+        check_exercise(exercise)
+        self.client_id = next(self._ids)
+        self.exercise = exercise
+        self.state = PersonState(self.client_id)
+        self.quality = QualityGate(self._joints())
+        self.frames = 0
+        self.last_seen = time.monotonic()
+        self._last_t = float("-inf")  # timestamp of the previous frame
+
+    def set_exercise(self, exercise):
+        check_exercise(exercise)
+        if exercise != self.exercise:
+            self.exercise = exercise
+            self.state.reset()
+            self.quality.set_joints(self._joints())
+
+    def frame_time(self, t=None):
+        """Timestamp for the next frame: the client's `t`, else its arrival time
+        but at least one NOMINAL_FPS frame after the previous one"""
+        if t is None:
+            t = max(time.monotonic(), self._last_t + 1 / NOMINAL_FPS)
+        self._last_t = t
+        return t
+
+    def _joints(self):
+        return angle_plan(self.exercise).landmarks if self.exercise in EXERCISES else ()
+
+    def result(self, seq):
+        return {"type": "analysis", "seq": seq, "exercise": self.exercise,
+                "phase": self.state.phase, "accuracy": round(self.state.accuracy, 1),
+                "feedback": self.state.feedback, "reps": self.state.reps,
+                "status": self.quality.status, "hint": self.quality.hint()}
+
+
+def check_exercise(exercise):
+    """ValueError unless `exercise` is None or an EXERCISES key (checked before anything is stored)"""
+    if exercise is not None and (not isinstance(exercise, str) or exercise not in EXERCISES):
+        raise ValueError(f"unknown exercise {exercise!r}, expected one of {sorted(EXERCISES)}")
+
+
+def parse_time(value):
+    """Optional "t" field -> seconds (float) or None"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+        raise ValueError(f"t must be a number of seconds, got {value!r}")
+    return float(value)
+
+
+def parse_landmarks(data):
+    """JSON landmarks (33 [x, y, z, vis] rows or MediaPipe-style dicts) -> (33, 4) float32"""
+    if len(data) != NUM_LANDMARKS:
+        raise ValueError(f"expected {NUM_LANDMARKS} landmarks, got {len(data)}")
+    if isinstance(data[0], dict):
+        data = [(p["x"], p["y"], p.get("z", 0.0), p.get("visibility", 1.0)) for p in data]
+    pose = np.asarray(data, dtype=np.float32)
+    if pose.ndim != 2:
+        raise ValueError(f"landmarks must be {NUM_LANDMARKS} rows of 2 or 4 values")
+    if pose.shape[1] == 2:
+        pose = np.concatenate([pose, np.zeros((NUM_LANDMARKS, 1), np.float32),
+                               np.ones((NUM_LANDMARKS, 1), np.float32)], axis=1)
+    if pose.shape != (NUM_LANDMARKS, 4):
+        raise ValueError(f"landmarks must be {NUM_LANDMARKS} x 2 or 4 values")
+    return pose
+
+
+# ============================================================
+# MICRO-BATCHING
+# ============================================================
+
+class MicroBatcher:
+    """Collects frames for up to `window` seconds (or `max_batch` frames) and
+    evaluates them in one vectorized pass.
+
+    Frames are applied to their client's state in arrival order, so a client
+    with several frames in one batch still counts reps correctly.
+    """
+
+    def __init__(self, window=BATCH_WINDOW_S, max_batch=MAX_BATCH, log=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.log = log or event_log.NullEventLog()
+        self._poses = np.zeros((max_batch, NUM_LANDMARKS, 4), dtype=np.float32)  # reused
+        self._pending = []  # (session, future, frame time)
+        self._timer = None
+
+        self.frames = 0
+        self.batches = 0
+        self.eval_s = 0.0
+        self.largest = 0
+        self.rejected = 0
+
+    def submit(self, session, pose, t=None) -> asyncio.Future:
+        """Queue one (33, 4) frame captured at `t` seconds (see ClientSession.frame_time);
+        the future resolves to the client's result dict"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        t = session.frame_time(t)
+        if not session.quality.check(pose):
+            # Not worth a batch slot: answer now with the state as it stands
+            self.rejected += 1
+            session.frames += 1
+            future.set_result(session.result(session.frames))
+            return future
+        self._poses[len(self._pending)] = pose
+        self._pending.append((session, future, t))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            self._evaluate(pending)
+        except Exception as e:
+            # Nobody in the batch may be left waiting on a future that never resolves
+            for _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(e)
+            self.log.emit("error", where="flush", batch=len(pending), error=repr(e))
+
+    def _evaluate(self, pending):
+        t0 = time.perf_counter()
+        n = len(pending)
+        # One batch_check_form per exercise present in the batch, over only
+        # the angles those exercises read (plans are cached per exercise set)
+        exercises = [session.exercise for session, _, _ in pending]
+        rows = {}
+        for i, key in enumerate(exercises):
+            rows.setdefault(key, []).append(i)
+        angles = batch_angles(self._poses[:n], angle_plan(tuple(rows)))
+        accuracy = np.empty(n, dtype=np.float32)
+        feedback = [None] * n
+        phases = [None] * n
+        for key, idx in rows.items():
+            acc, fb, ph = batch_check_form(key, angles[idx])
+            accuracy[idx] = acc
+            for j, i in enumerate(idx):
+                feedback[i], phases[i] = fb[j], ph[j]
+
+        for i, (session, future, now) in enumerate(pending):
+            session.state.update(session.exercise, float(accuracy[i]), feedback[i], phases[i], angles[i], now)
+            session.frames += 1
+            if not future.done():
+                future.set_result(session.result(session.frames))
+
+        self.eval_s += time.perf_counter() - t0
+        self.frames += n
+        self.batches += 1
+        self.largest = max(self.largest, n)
+
+    def stats(self) -> dict:
+        return {"frames": self.frames, "batches": self.batches, "largest_batch": self.largest,
+                "mean_batch": round(self.frames / max(1, self.batches), 1), "rejected": self.rejected,
+                "eval_us_per_frame": round(self.eval_s / max(1, self.frames) * 1e6, 2)}
+
+
+# ============================================================
+# HTTP / WEBSOCKET
+# ============================================================
+
+def create_app(window=BATCH_WINDOW_S, max_batch=MAX_BATCH) -> web.Application:
+    app = web.Application()
+    log = event_log.open_log("analysis_service")  # here, not at import: starts the writer thread
+    batcher = app["batcher"] = MicroBatcher(window, max_batch, log)
+    http_clients = app["http_clients"] = {}
+    ws_sessions = app["ws_sessions"] = set()
+
+    async def ws_handler(request):
+        ws = web.WebSocketResponse(max_msg_size=1 << 20)
+        await ws.prepare(request)
+        try:
+            session = ClientSession(request.query.get("exercise"))
+        except ValueError as e:
+            await ws.send_json({"type": "error", "error": str(e)})
+            await ws.close()
+            return ws
+        ws_sessions.add(session)
+        log.emit("client_connect", client=session.client_id, exercise=session.exercise,
+                 remote=request.remote)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.BINARY:
+                    if len(msg.data) not in (FRAME_BYTES, TIMED_FRAME_BYTES):
+                        await ws.send_json({"type": "error", "error": f"binary frames are {FRAME_BYTES} bytes, "
+                                                                      f"{TIMED_FRAME_BYTES} with a time"})
+                        continue
+                    pose = np.frombuffer(msg.data, dtype="<f4", count=NUM_LANDMARKS * 4).reshape(NUM_LANDMARKS, 4)
+                    t = None
+                    if len(msg.data) == TIMED_FRAME_BYTES:
+                        try:
+                            t = parse_time(float(np.frombuffer(msg.data, dtype="<f8", offset=FRAME_BYTES)[0]))
+                        except ValueError as e:
+                            await ws.send_json({"type": "error", "error": str(e)})
+                            continue
+                elif msg.type == WSMsgType.TEXT:
+                    try:
+                        message = json.loads(msg.data)
+                        if not isinstance(message, dict):
+                            raise ValueError("text frames must be JSON objects")
+                        if "exercise" in message:
+                            session.set_exercise(message["exercise"])
+                        if message.get("reset"):
+                            session.state.reset()
+                        if "landmarks" not in message:
+                            continue
+                        pose = parse_landmarks(message["landmarks"])
+                        t = parse_time(message.get("t"))
+                    except (ValueError, KeyError, TypeError) as e:
+                        await ws.send_json({"type": "error", "error": str(e)})
+                        continue
+                else:
+                    break
+                try:
+                    result = await batcher.submit(session, pose, t)
+                except Exception as e:
+                    result = {"type": "error", "error": f"analysis failed: {e}"}
+                await ws.send_json(result)
+        finally:
+            ws_sessions.discard(session)
+            log.emit("client_disconnect", client=session.client_id, frames=session.frames,
+                     reps=session.state.reps)
+        return ws
+
+    async def analyze_handler(request):
+        try:
+            body = await request.json()
+            if not isinstance(body, dict):
+                raise ValueError("request body must be a JSON object")
+            if "frames" in body:
+                frames = body["frames"]
+                times = body.get("times") or [None] * len(frames)
+            else:
+                frames, times = [body["landmarks"]], [body.get("t")]
+            if len(times) != len(frames):
+                raise ValueError(f"{len(frames)} frames but {len(times)} times")
+            poses = [parse_landmarks(f) for f in frames]
+            times = [parse_time(t) for t in times]
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        try:
+            client = body.get("client")
+            session = http_clients.get(client) if client is not None else None
+            if session is None:
+                session = ClientSession(body.get("exercise"))
+                if client is not None:
+                    http_clients[client] = session
+            elif "exercise" in body:
+                session.set_exercise(body["exercise"])
+        except (ValueError, TypeError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        session.last_seen = time.monotonic()
+
+        # Submitted together so they land in the same batch, in order
+        try:
+            results = await asyncio.gather(*[batcher.submit(session, pose, t) for pose, t in zip(poses, times)])
+        except Exception as e:
+            return web.json_response({"error": f"analysis failed: {e}"}, status=500)
+        return web.json_response(results[-1] if "frames" not in body else {"results": results})
+
+    async def stats_handler(request):
+        return web.json_response(dict(batcher.stats(), ws_clients=len(ws_sessions),
+                                      http_clients=len(http_clients)))
+
+    async def expire_http_clients(app):
+        async def sweep():
+            while True:
+                await asyncio.sleep(CLIENT_TTL_S / 4)
+                cutoff = time.monotonic() - CLIENT_TTL_S
+                for client in [c for c, s in http_clients.items() if s.last_seen < cutoff]:
+                    del http_clients[client]
+        task = asyncio.create_task(sweep())
+        yield
+        task.cancel()
+
+    app.router.add_get("/ws", ws_handler)
+    app.router.add_post("/analyze", analyze_handler)
+    app.router.add_get("/stats", stats_handler)
+    app.cleanup_ctx.append(expire_http_clients)
+    return app
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+async def _bench_run(clients, seconds, window, port):
+    """`clients` WebSocket clients streaming binary frames back-to-back"""
+    import aiohttp
+    import synthetic_poses
+
+    app = create_app(window)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    keys = list(EXERCISES)
+    traces = {key: synthetic_poses.generate(key, reps=3, seed=0).landmarks.astype("<f4") for key in keys}
+    latencies = []
+    stop_at = time.perf_counter() + seconds
+
+    async def client(i, http):
+        key = keys[i % len(keys)]
+        frames = traces[key]
+        async with http.ws_connect(f"http://127.0.0.1:{port}/ws?exercise={key}") as ws:
+            frame = i
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                await ws.send_bytes(frames[frame % len(frames)].tobytes())
+                await ws.receive()
+                latencies.append(time.perf_counter() - t0)
+                frame += 1
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+        await asyncio.gather(*[client(i, http) for i in range(clients)])
+    stats = app["batcher"].stats()
+    await runner.cleanup()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"  {clients:>5} clients  {len(latencies) / seconds:>8,.0f} frames/s  "
+          f"batch {stats['mean_batch']:>6}  eval {stats['eval_us_per_frame']:>7.2f}us/frame  "
+          f"round trip p50 {p50:.2f}ms p99 {p99:.2f}ms")
+
+
+def _bench(args):
+    print(f"Analysis service: batch window {args.window_ms}ms, {args.seconds}s per run "
+          f"(clients and server share one process)")
+    for clients in [int(c) for c in args.clients.split(",")]:
+        asyncio.run(_bench_run(clients, args.seconds, args.window_ms / 1000, args.port))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FormFit form-analysis service")
+    parser.add_argument("mode", nargs="?", choices=["serve", "bench"], default="serve")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", default="1,10,100,400", help="bench: client counts to run")
+    parser.add_argument("--seconds", type=float, default=5.0, help="bench: seconds per run")
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW_S * 1000)
+    args = parser.parse_args()
+
+    if args.mode == "bench":
+        _bench(args)
+    else:
+        web.run_app(create_app(args.window_ms / 1000), host=args.host, port=args.port)
@@ -0,0 +1,238 @@
+"""
+FormFit Coaching Audio
+Pre-rendered clips for the fixed coaching texts (exercise instructions and
+tips), so starting an exercise plays audio straight onto the agent's track
+instead of having the realtime model generate the same words every time.
+
+Clips are rendered offline with the platform's local TTS (espeak-ng /
+espeak on Linux, `say` on macOS, SAPI on Windows), resampled to 24 kHz mono
+and cached as WAV files keyed by (text, engine, voice, version):
+
+    python coaching_audio.py build              # render everything missing
+    python coaching_audio.py build --voice en-us+f3 --force
+    python coaching_audio.py list
+
+Cache location: FORMFIT_AUDIO_CACHE, default ~/.cache/formfit/audio. Bump
+AUDIO_VERSION when the rendering pipeline changes.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+
+SAMPLE_RATE = 24000
+FRAME_MS = 20
+AUDIO_VERSION = 1
+
+
+def cache_dir() -> str:
+    path = os.environ.get("FORMFIT_AUDIO_CACHE")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "audio")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def clip_key(text, engine, voice, version=AUDIO_VERSION) -> str:
+    return hashlib.sha256(f"{version}|{engine}|{voice}|{text}".encode()).hexdigest()[:20]
+
+
+# ============================================================
+# FIXED TEXTS
+# ============================================================
+
+def exercise_intro(exercise: dict) -> str:
+    """What the agent says when an exercise starts (agent.EXERCISES entry)"""
+    return f"{exercise['name']}! {exercise['instructions']} {exercise['tips']}"
+
+
+def fixed_texts() -> list[str]:
+    """Every static coaching text worth pre-rendering"""
+    import agent
+    import form_analysis
+
+    texts = [exercise_intro(ex) for ex in agent.EXERCISES.values()]
+    for ex in form_analysis.EXERCISES.values():
+        texts.extend(ex.get('instructions', []))
+    return list(dict.fromkeys(texts))
+
+
+# ============================================================
+# OFFLINE RENDERING
+# ============================================================
+
+def detect_engine() -> str | None:
+    system = platform.system()
+    if system == "Darwin" and shutil.which("say"):
+        return "say"
+    if system == "Windows":
+        return "sapi"
+    for engine in ("espeak-ng", "espeak"):
+        if shutil.which(engine):
+            return engine
+    return None
+
+
+def render_wav(text, engine, voice, out_path):
+    if engine in ("espeak-ng", "espeak"):
+        cmd = [engine, "-w", out_path] + (["-v", voice] if voice else []) + [text]
+    elif engine == "say":
+        cmd = ["say", "-o", out_path, f"--data-format=LEI16@{SAMPLE_RATE}"] + (["-v", voice] if voice else []) + [text]
+    elif engine == "sapi":
+        escaped = text.replace("'", "''")
+        select = f"$s.SelectVoice('{voice}');" if voice else ""
+        cmd = ["powershell", "-Command",
+               "Add-Type -AssemblyName System.Speech;"
+               "$s = New-Object System.Speech.Synthesis.SpeechSynthesizer;"
+               f"{select}$s.SetOutputToWaveFile('{out_path}');$s.Speak('{escaped}');$s.Dispose()"]
+    else:
+        raise ValueError(f"Unknown TTS engine: {engine}")
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def _to_pcm24k(path) -> bytes:
+    """Any mono/stereo 16-bit WAV -> 24 kHz mono int16 PCM"""
+    import numpy as np
+    from livekit import rtc
+
+    with wave.open(path, "rb") as wav:
+        rate, channels = wav.getframerate(), wav.getnchannels()
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit PCM")
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    if rate == SAMPLE_RATE:
+        return pcm.tobytes()
+
+    resampler = rtc.AudioResampler(rate, SAMPLE_RATE, num_channels=1)
+    frames = resampler.push(bytearray(pcm.tobytes())) + resampler.flush()
+    return b"".join(bytes(frame.data) for frame in frames)
+
+
+def build(texts=None, engine=None, voice="", force=False) -> dict:
+    """Render missing clips into the cache and update its manifest"""
+    engine = engine or detect_engine()
+    if engine is None:
+        raise RuntimeError("No local TTS found (install espeak-ng, or use macOS `say` / Windows SAPI)")
+    texts = texts if texts is not None else fixed_texts()
+    root = cache_dir()
+    manifest = load_manifest(root)
+
+    rendered = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for text in texts:
+            key = clip_key(text, engine, voice)
+            clip_path = os.path.join(root, f"{key}.wav")
+            if key in manifest and os.path.exists(clip_path) and not force:
+                continue
+            raw = os.path.join(tmp, "raw.wav")
+            render_wav(text, engine, voice, raw)
+            pcm = _to_pcm24k(raw)
+            with wave.open(clip_path + ".part", "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(SAMPLE_RATE)
+                wav.writeframes(pcm)
+            os.replace(clip_path + ".part", clip_path)
+            manifest[key] = {"text": text, "engine": engine, "voice": voice,
+                             "version": AUDIO_VERSION, "duration_s": round(len(pcm) / 2 / SAMPLE_RATE, 2)}
+            rendered += 1
+
+    with open(os.path.join(root, "manifest.json.part"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(root, "manifest.json.part"), os.path.join(root, "manifest.json"))
+    print(f"Rendered {rendered} clip(s) with {engine}{f' ({voice})' if voice else ''}; {len(manifest)} cached")
+    return manifest
+
+
+def load_manifest(root=None) -> dict:
+    try:
+        with open(os.path.join(root or cache_dir(), "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ============================================================
+# RUNTIME
+# ============================================================
+
+class CoachingAudio:
+    """In-memory clips for one engine/voice; load once per worker process (prewarm)"""
+
+    def __init__(self, engine=None, voice=None):
+        self.engine = engine    # None: clips from any engine / voice in the cache
+        self.voice = voice
+        self._clips = {}  # text -> int16 PCM bytes
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> "CoachingAudio":
+        root = cache_dir()
+        for key, entry in load_manifest(root).items():
+            if (entry.get("version") != AUDIO_VERSION
+                    or self.engine is not None and entry.get("engine") != self.engine
+                    or self.voice is not None and entry.get("voice") != self.voice):
+                continue
+            try:
+                with wave.open(os.path.join(root, f"{key}.wav"), "rb") as wav:
+                    self._clips[entry["text"]] = wav.readframes(wav.getnframes())
+            except (OSError, wave.Error):
+                continue  # missing / corrupt clip: that text falls back to the model
+        return self
+
+    def __len__(self):
+        return len(self._clips)
+
+    def has(self, text) -> bool:
+        return text in self._clips
+
+    def frames(self, text):
+        """Async iterator of 20ms rtc.AudioFrames for session.say(text, audio=...), or None"""
+        pcm = self._clips.get(text)
+        if pcm is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _iter_frames(pcm)
+
+
+async def _iter_frames(pcm):
+    from livekit import rtc
+
+    step = SAMPLE_RATE * FRAME_MS // 1000 * 2  # bytes per frame
+    for start in range(0, len(pcm), step):
+        chunk = pcm[start:start + step]
+        yield rtc.AudioFrame(chunk, SAMPLE_RATE, 1, len(chunk) // 2)
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render fixed coaching texts with a local TTS")
+    parser.add_argument("command", choices=["build", "list"])
+    parser.add_argument("--engine", help="espeak-ng, espeak, say or sapi (default: detect)")
+    parser.add_argument("--voice", default="", help="engine voice name")
+    parser.add_argument("--force", action="store_true", help="re-render cached clips")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            build(engine=args.engine, voice=args.voice, force=args.force)
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            print(f"Build failed: {e}")
+            sys.exit(1)
+    else:
+        for key, entry in load_manifest().items():
+            print(f"{key}  {entry['engine']:<9} {entry['voice'] or '-':<10} {entry['duration_s']:>5.1f}s  {entry['text'][:60]}")
@@ -0,0 +1,154 @@
+"""
+FormFit Command Channel
+Outbound agent -> frontend commands, batched per tick, over the right channel.
+
+- State changes (exercise_start / exercise_end, transcripts, ...) go out on
+  the reliable channel, in order, never dropped.
+- UI hints (joint highlights, progress bars) go out lossy, latest-wins: a
+  newer hint of the same type (and same "key", if given) replaces an unsent
+  older one.
+- Commands issued within one flush interval are merged into a single packet
+  ({"type": "batch", "commands": [...]}; a lone command is sent as-is).
+- A token-bucket send budget caps data-channel bytes/s so bursts can't
+  starve the audio track; over budget, reliable commands wait and lossy
+  hints keep collapsing to the latest value.
+"""
+
+import asyncio
+import json
+import time
+
+# Sent lossy / latest-wins unless the caller says otherwise
+LOSSY_TYPES = {"highlight_joints", "progress", "ui_hint", "form_score"}
+
+# Lossy packets should fit one MTU; reliable ones are reassembled by the SDK
+MAX_LOSSY_BYTES = 1300
+MAX_RELIABLE_BYTES = 15000
+
+
+def pack(parts, limit):
+    """Group pre-encoded commands into as few packets as fit under `limit`"""
+    packets, group, size = [], [], 0
+    for part in parts:
+        if group and size + len(part) + 1 > limit:
+            packets.append(group)
+            group, size = [], 0
+        group.append(part)
+        size += len(part) + 1
+    if group:
+        packets.append(group)
+    return packets
+
+
+def encode_packet(group):
+    return group[0] if len(group) == 1 else b'{"type":"batch","commands":[' + b",".join(group) + b"]}"
+
+
+class CommandChannel:
+    def __init__(self, participant, flush_interval=0.02, budget_bytes_per_s=16_000, burst_bytes=8_000):
+        self.participant = participant              # rtc.LocalParticipant (or anything with publish_data)
+        self.flush_interval = flush_interval        # seconds commands are collected before a packet goes out
+        self.budget_bytes_per_s = budget_bytes_per_s
+        self.burst_bytes = burst_bytes
+
+        self._reliable = []     # encoded commands, in order
+        self._lossy = {}        # (type, key) -> encoded command, latest wins
+        self._tokens = burst_bytes
+        self._refilled_at = time.monotonic()
+        self._flush_task = None
+        self._closed = False
+
+        self.commands = 0
+        self.packets = 0
+        self.bytes_sent = 0
+        self.lossy_replaced = 0
+        self.budget_waits = 0
+
+    def send(self, command: dict, reliable: bool | None = None):
+        """Queue a command; never blocks. reliable=None picks by command type."""
+        if self._closed:
+            return
+        if reliable is None:
+            reliable = command.get("type") not in LOSSY_TYPES
+        encoded = json.dumps(command, separators=(",", ":")).encode()
+        self.commands += 1
+        if reliable:
+            self._reliable.append(encoded)
+        else:
+            slot = (command.get("type"), command.get("key"))
+            if slot in self._lossy:
+                self.lossy_replaced += 1
+            self._lossy[slot] = encoded
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        while self._reliable or self._lossy:
+            if not await self.flush():
+                # Over budget: wait for enough tokens to be worth another try
+                self.budget_waits += 1
+                await asyncio.sleep(max(0.005, -self._tokens / self.budget_bytes_per_s))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst_bytes,
+                           self._tokens + (now - self._refilled_at) * self.budget_bytes_per_s)
+        self._refilled_at = now
+
+    async def _publish(self, payload, reliable):
+        self._tokens -= len(payload)
+        self.packets += 1
+        self.bytes_sent += len(payload)
+        await self.participant.publish_data(payload, reliable=reliable)
+
+    async def flush(self) -> bool:
+        """Send what the budget allows; False if anything had to stay queued"""
+        self._refill()
+        # Reliable first - a packet may push the bucket negative, the next one waits
+        if self._reliable:
+            parts, self._reliable = self._reliable, []
+            groups = pack(parts, min(MAX_RELIABLE_BYTES, self.burst_bytes))
+            sent = 0
+            try:
+                for group in groups:
+                    if self._tokens < 0:
+                        return False
+                    await self._publish(encode_packet(group), reliable=True)
+                    sent += 1
+            finally:
+                # Put back what didn't go out (over budget, or cancelled mid-send), still in order
+                if sent < len(groups):
+                    self._reliable = [p for g in groups[sent:] for p in g] + self._reliable
+
+        if self._lossy:
+            if self._tokens < 0:
+                return False  # keep collapsing hints until there's budget
+            parts, self._lossy = list(self._lossy.values()), {}
+            for group in pack(parts, MAX_LOSSY_BYTES):
+                await self._publish(encode_packet(group), reliable=False)
+        return True
+
+    async def aclose(self):
+        """Flush remaining reliable commands (ignoring the budget) and stop"""
+        self._closed = True
+        task, self._flush_task = self._flush_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            # Let it unwind: a send it interrupted puts its groups back in _reliable
+            await asyncio.gather(task, return_exceptions=True)
+        self._lossy.clear()
+        for group in pack(self._reliable, MAX_RELIABLE_BYTES):
+            await self._publish(encode_packet(group), reliable=True)
+        self._reliable = []
+
+    def stats(self) -> dict:
+        return {
+            "commands": self.commands,
+            "packets": self.packets,
+            "bytes_sent": self.bytes_sent,
+            "lossy_replaced": self.lossy_replaced,
+            "budget_waits": self.budget_waits,
+        }
+
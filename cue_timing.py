@@ -0,0 +1,392 @@
+"""
+FormFit Cue Timing
+Makes spoken cues land on the movement they refer to instead of after it.
+
+A cue is heard `lead` seconds after it is queued: waiting for the current
+utterance, synthesis, audio device start - plus however long ago the
+camera frame that triggered it was captured. On a slow host that's easily
+half a second, so "Rep 5" arrives while the user is already lowering.
+
+- SpeechChannel replaces the fire-and-forget speech thread: cues are
+  Popen'd (so they can be cancelled), their durations are measured, and
+  lead(text) estimates queue wait + synthesis + playback start.
+- The per-host synthesis time and speaking rate are calibrated once by
+  rendering a short cue to a WAV file (cached per host/engine in
+  ~/.cache/formfit/cue_latency.json, FORMFIT_CUE_LATENCY) and refined from
+  every utterance. Device start isn't observable from here:
+  FORMFIT_CUE_PLAYBACK_MS, default 60.
+- CrossingPredictor fits angular velocity and deceleration over the last
+  few frames and predicts when (and whether) a signal will cross a
+  threshold.
+- PredictiveCue fires a cue as soon as the predicted crossing is closer
+  than the lead, confirms it when the crossing happens, and cancels it
+  (dropped from the queue, or the speech process killed before audio
+  starts) when the signal turns back or the deadline passes.
+"""
+
+import json
+import os
+import platform
+import queue
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+from coaching_audio import detect_engine, render_wav
+
+CALIBRATION_TEXT = "Rep 5"
+DEFAULT_SYNTH_S = 0.25      # before calibration / without a local TTS
+DEFAULT_CHARS_PER_S = 14.0
+EMA = 0.2
+
+
+def latency_path() -> str:
+    path = os.environ.get("FORMFIT_CUE_LATENCY")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "cue_latency.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def speak_command(engine, text, voice=""):
+    if engine in ("espeak-ng", "espeak"):
+        return [engine] + (["-v", voice] if voice else []) + [text]
+    if engine == "say":
+        return ["say"] + (["-v", voice] if voice else []) + [text]
+    if engine == "sapi":
+        escaped = text.replace("'", "''")
+        return ["powershell", "-Command", f"(New-Object -ComObject SAPI.SpVoice).Speak('{escaped}')"]
+    raise ValueError(f"Unknown TTS engine: {engine}")
+
+
+# ============================================================
+# LATENCY MODEL
+# ============================================================
+
+class LatencyModel:
+    """Synthesis time and speaking rate for one host + engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.key = f"{socket.gethostname()}|{platform.system()}|{engine}"
+        self.synth_s = DEFAULT_SYNTH_S
+        self.chars_per_s = DEFAULT_CHARS_PER_S
+        self.playback_s = float(os.environ.get("FORMFIT_CUE_PLAYBACK_MS", "60")) / 1000
+        self.calibrated = False
+
+    def load(self) -> "LatencyModel":
+        try:
+            with open(latency_path()) as f:
+                entry = json.load(f).get(self.key)
+        except (OSError, ValueError):
+            entry = None
+        if entry:
+            self.synth_s, self.chars_per_s = entry["synth_s"], entry["chars_per_s"]
+            self.calibrated = True
+        return self
+
+    def save(self):
+        path = latency_path()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.key] = {"synth_s": round(self.synth_s, 4), "chars_per_s": round(self.chars_per_s, 2)}
+        with open(path + ".part", "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + ".part", path)
+
+    def calibrate(self, runs=3) -> "LatencyModel":
+        """Render a short cue to a WAV file: wall time ~ time to first audio, length -> rate"""
+        if self.engine is None:
+            return self
+        synth, rates = [], []
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "cue.wav")
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                try:
+                    render_wav(CALIBRATION_TEXT, self.engine, "", out)
+                except (OSError, subprocess.CalledProcessError):
+                    return self  # engine unusable: keep the defaults
+                synth.append(time.perf_counter() - t0)
+                with wave.open(out, "rb") as wav:
+                    rates.append(len(CALIBRATION_TEXT) / max(wav.getnframes() / wav.getframerate(), 1e-3))
+        self.synth_s = float(np.median(synth))
+        self.chars_per_s = float(np.median(rates))
+        self.calibrated = True
+        self.save()
+        return self
+
+    def start_delay(self) -> float:
+        """Seconds from process start to audible sound"""
+        return self.synth_s + self.playback_s
+
+    def duration(self, text) -> float:
+        return self.start_delay() + len(text) / self.chars_per_s
+
+    def observe(self, text, elapsed):
+        """A finished utterance took `elapsed` seconds from process start to exit"""
+        spoken = elapsed - self.start_delay()
+        if spoken > 0.05:
+            self.chars_per_s += EMA * (len(text) / spoken - self.chars_per_s)
+
+
+# ============================================================
+# SPEECH CHANNEL
+# ============================================================
+
+class Cue:
+    __slots__ = ("text", "queued_at", "started_at", "finished_at", "cancelled")
+
+    def __init__(self, text, queued_at):
+        self.text = text
+        self.queued_at = queued_at
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+
+
+class SpeechChannel:
+    """One utterance at a time on a background thread; queued or starting cues can be cancelled"""
+
+    def __init__(self, engine=None, voice="", latency=None):
+        self.engine = engine or detect_engine()
+        self.voice = voice
+        self.latency = latency or LatencyModel(self.engine).load()
+        if not self.latency.calibrated:
+            self.latency.calibrate()
+        self._queue = queue.Queue()
+        self._pending = deque()   # queued, not started (for the wait estimate)
+        self._current = None
+        self._proc = None
+        self._lock = threading.Lock()
+        self.spoken = 0
+        self.cancelled = 0
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            cue = self._queue.get()
+            if cue is None:
+                break
+            with self._lock:
+                if cue in self._pending:
+                    self._pending.remove(cue)
+                if cue.cancelled:
+                    continue
+                if self.engine is None:
+                    print(f"[voice] {cue.text}")  # no local TTS
+                    cue.started_at = cue.finished_at = time.perf_counter()
+                    self.spoken += 1
+                    continue
+                cue.started_at = time.perf_counter()
+                self._current = cue
+                try:
+                    self._proc = subprocess.Popen(speak_command(self.engine, cue.text, self.voice),
+                                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                except (OSError, ValueError) as e:
+                    print(f"Speech error: {e}")
+                    self._proc = None
+            if self._proc is not None:
+                self._proc.wait()
+            with self._lock:
+                cue.finished_at = time.perf_counter()
+                if not cue.cancelled:
+                    self.spoken += 1
+                    self.latency.observe(cue.text, cue.finished_at - cue.started_at)
+                self._current = self._proc = None
+
+    def say(self, text) -> Cue:
+        cue = Cue(text, time.perf_counter())
+        with self._lock:
+            self._pending.append(cue)
+        self._queue.put(cue)
+        return cue
+
+    def cancel(self, cue) -> bool:
+        """Drop a cue; True if it was stopped before any of it was audible"""
+        with self._lock:
+            if cue.cancelled or cue.finished_at is not None:
+                return cue.cancelled
+            if cue.started_at is not None:
+                if time.perf_counter() - cue.started_at >= self.latency.start_delay():
+                    return False  # already speaking - let it finish
+                if self._proc is not None:
+                    self._proc.terminate()
+            cue.cancelled = True
+            self.cancelled += 1
+            return True
+
+    def busy_for(self, now=None) -> float:
+        """Estimated seconds until a newly queued cue would start"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            wait = 0.0
+            if self._current is not None:
+                wait = max(0.0, self._current.started_at + self.latency.duration(self._current.text) - now)
+            return wait + sum(self.latency.duration(c.text) for c in self._pending if not c.cancelled)
+
+    def lead(self, text=None, now=None) -> float:
+        """Seconds between say() now and the cue becoming audible"""
+        return self.busy_for(now) + self.latency.start_delay()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+# ============================================================
+# PREDICTION
+# ============================================================
+
+class CrossingPredictor:
+    """Time until a signal crosses a threshold, from a quadratic fit over recent frames.
+
+    The curvature term matters: a joint slows down before it stops, so a
+    straight-line fit would "see" a lockout in every rep that stops short.
+    """
+
+    def __init__(self, threshold, rising=True, window=7, min_rate=15.0, horizon=1.0, margin=0.0):
+        self.threshold = threshold
+        self.rising = rising
+        self.window = window
+        self.margin = margin        # predicted overshoot required when the signal is slowing
+        self.min_rate = min_rate    # units/s - slower than this isn't "heading there"
+        self.horizon = horizon      # don't extrapolate further than this (s)
+        self._t = deque(maxlen=window)
+        self._v = deque(maxlen=window)
+        self.rate = 0.0
+        self.accel = 0.0
+
+    def reset(self):
+        self._t.clear()
+        self._v.clear()
+        self.rate = self.accel = 0.0
+
+    def crossed(self, value) -> bool:
+        return value >= self.threshold if self.rising else value <= self.threshold
+
+    def update(self, t, value):
+        """Feed one sample; returns seconds until the crossing (0 if past it) or None if not heading there"""
+        self._t.append(t)
+        self._v.append(value)
+        if self.crossed(value):
+            return 0.0
+        if len(self._t) < 4:
+            return None
+        ts = np.fromiter(self._t, dtype=np.float64, count=len(self._t)) - t
+        vs = np.fromiter(self._v, dtype=np.float64, count=len(self._v))
+        a2, b, c = np.polyfit(ts, vs, 2)   # around "now": value ~ c + b*dt + a2*dt^2
+        self.rate, self.accel = float(b), float(2 * a2)
+
+        sign = 1.0 if self.rising else -1.0
+        gap = sign * (self.threshold - c)  # > 0: still short of the threshold
+        # Only deceleration is trusted: extrapolating a speed-up fires far too early
+        rate, accel = sign * b, min(sign * a2, 0.0)
+        if rate < self.min_rate:
+            return None
+        # Smallest positive root of accel*dt^2 + rate*dt - gap = 0
+        if abs(accel) < 1e-9:
+            eta = gap / rate
+        else:
+            # Decelerating: only call it if the turning point clears the threshold by `margin`
+            if rate * rate / (-4 * accel) < gap + self.margin:
+                return None
+            eta = (-rate + np.sqrt(rate * rate + 4 * accel * gap)) / (2 * accel)
+        return float(eta) if 0 < eta <= self.horizon else None
+
+
+class PredictiveCue:
+    """A cue tied to one crossing: spoken early by the measured lead, cancelled if the crossing doesn't come"""
+
+    def __init__(self, speech, predictor, slack=0.25, confirm=3, max_anticipation=0.35):
+        self.speech = speech
+        self.predictor = predictor
+        self.max_anticipation = max_anticipation  # predictions further out than this miss too often
+        self.slack = slack          # extra seconds past the predicted crossing before giving up
+        self.confirm = confirm      # consecutive frames predicting "within the lead" before firing
+        self._streak = 0
+        self.armed = True           # re-armed by the caller once the movement resets
+        self._cue = None
+        self._deadline = None
+        self._fired_eta_at = None   # predicted crossing time for the early cue
+
+        self.early = 0
+        self.late = 0
+        self.missed = 0             # early cues cancelled before they were audible
+        self.wrong = 0              # early cues heard, crossing never came
+        self.errors_ms = deque(maxlen=200)  # audible start - actual crossing
+
+    def rearm(self):
+        self.armed = True
+        self._streak = 0
+        self.predictor.reset()
+
+    def update(self, t, value, text, frame_age=0.0):
+        """Feed one frame (t = capture time). Returns "early", "crossed", "late", "cancelled" or None.
+
+        frame_age: seconds between capture and now - processing time the
+        user has already moved on by.
+        """
+        eta = self.predictor.update(t, value)
+
+        if self._cue is not None:
+            if eta == 0.0:
+                # Crossing confirmed - how close to it was (or will) the cue be heard?
+                started_at = self._cue.started_at
+                if started_at is None:
+                    started_at = time.perf_counter() + self.speech.busy_for()
+                heard_at = started_at + self.speech.latency.start_delay()
+                self.errors_ms.append((heard_at - t) * 1000)
+                self._cue = None
+                self.armed = False
+                return "crossed"
+            if eta is not None:
+                self._deadline = max(self._deadline, t + eta + self.slack)
+            away = -self.predictor.rate if self.predictor.rising else self.predictor.rate
+            if away > self.predictor.min_rate or t > self._deadline:
+                # Turned back or stalled: take it back if still possible
+                if self.speech.cancel(self._cue):
+                    self.missed += 1
+                else:
+                    self.wrong += 1
+                self._cue = None
+                return "cancelled"
+            return None
+
+        if not self.armed:
+            return None
+        if eta == 0.0:
+            # Crossed without a prediction (too fast / too slow to call): speak now
+            self.speech.say(text)
+            self.late += 1
+            self.armed = False
+            return "late"
+        if eta is not None and eta <= min(self.speech.lead(text) + frame_age, self.max_anticipation):
+            self._streak += 1
+            if self._streak >= self.confirm:
+                self._streak = 0
+                self._cue = self.speech.say(text)
+                self._deadline = t + eta + self.slack
+                self.early += 1
+                return "early"
+        else:
+            self._streak = 0
+        return None
+
+    def stats(self) -> dict:
+        errors = np.array(self.errors_ms) if self.errors_ms else None
+        return {"early": self.early, "late": self.late, "cancelled_silent": self.missed,
+                "cancelled_heard": self.wrong,
+                "sync_error_ms_p50": None if errors is None else round(float(np.median(errors)), 1),
+                "sync_error_ms_p90_abs": None if errors is None else round(float(np.percentile(np.abs(errors), 90)), 1)}
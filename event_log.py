@@ -0,0 +1,250 @@
+"""
+FormFit Event Log
+Durable, structured record of what happened in a session - packets the
+agent received, exercise switches, reps, cues spoken, form state changes -
+without putting file I/O on the frame loop or the agent's event loop.
+
+    log = event_log.open_log("speech2")
+    log.emit("rep", reps=5, angle=163.2)       # ~1us: append to a bounded buffer
+
+A background thread drains the buffer every `flush_interval` (or sooner
+when it fills up) and writes one block per flush:
+
+    block  = b"FFEV" | uint32 payload length | uint32 record count | zlib(JSONL payload)
+    record = {"t": unix time, "k": kind, ...fields}
+
+Files rotate at `rotate_bytes` and only the newest `keep` per log name are
+kept. Several processes can share a name (every LiveKit job process opens
+"agent"), so a rotation only deletes another process's old files once they
+have gone STALE_S without a write. If the writer falls behind and the buffer is full, new events are
+dropped and counted per kind; the counts are written as a "log_dropped"
+event once there's room again, and printed on close.
+
+Logs go to FORMFIT_EVENT_LOG_DIR (default ~/.cache/formfit/events);
+FORMFIT_EVENT_LOG=0 turns logging off (open_log returns a NullEventLog).
+
+    python event_log.py cat <file>...          # JSONL to stdout
+    python event_log.py ls
+"""
+
+import atexit
+import glob
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, deque
+
+MAGIC = b"FFEV"
+HEADER = struct.Struct("<4sII")
+
+STALE_S = 3600.0  # another process's file untouched this long is no longer being written
+
+
+def log_dir() -> str:
+    path = os.environ.get("FORMFIT_EVENT_LOG_DIR")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "events")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class NullEventLog:
+    enabled = False
+
+    def emit(self, kind, **fields):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EventLog:
+    enabled = True
+
+    def __init__(self, name, directory=None, capacity=65536, flush_interval=0.5,
+                 rotate_bytes=32 << 20, keep=20, level=6):
+        self.name = name
+        self.directory = directory or log_dir()
+        self.capacity = capacity              # buffered records before dropping
+        self.flush_interval = flush_interval  # seconds between writes
+        self.rotate_bytes = rotate_bytes
+        self.keep = keep                      # files kept per log name
+        self.level = level                    # zlib level
+
+        self._buffer = deque()
+        self._wake = threading.Event()
+        self._closed = False
+        self._dropped = Counter()
+        self._dropped_lock = threading.Lock()
+        self._file = None
+        self._file_bytes = 0
+        self._seq = 0
+
+        self.written = 0
+        self.dropped_total = 0
+        self.blocks = 0
+        self._thread = threading.Thread(target=self._run, name=f"event-log-{name}", daemon=True)
+        self._thread.start()
+
+    # ---------------- producer side ----------------
+
+    def emit(self, kind, **fields):
+        """Record an event; never blocks, drops (and counts) when the buffer is full"""
+        if len(self._buffer) >= self.capacity:
+            with self._dropped_lock:
+                self._dropped[kind] += 1
+            return
+        fields["t"] = time.time()
+        fields["k"] = kind
+        self._buffer.append(fields)
+        if len(self._buffer) >= self.capacity // 2:
+            self._wake.set()
+
+    def flush(self):
+        """Ask the writer to write now (returns immediately)"""
+        self._wake.set()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        if self.dropped_total:
+            print(f"Event log {self.name}: dropped {self.dropped_total} event(s) - writer fell behind")
+
+    # ---------------- writer thread ----------------
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closed
+            try:
+                self._write_pending()
+            except OSError as e:
+                print(f"Event log {self.name}: write failed: {e}")
+            if closing:
+                break
+        if self._file is not None:
+            self._file.close()
+
+    def _take_dropped(self):
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, Counter()
+        return dropped
+
+    def _write_pending(self):
+        records = []
+        pop = self._buffer.popleft
+        for _ in range(len(self._buffer)):
+            records.append(pop())
+        dropped = self._take_dropped()
+        if dropped:
+            self.dropped_total += sum(dropped.values())
+            records.append({"t": time.time(), "k": "log_dropped", "counts": dict(dropped)})
+        if not records:
+            return
+
+        payload = "\n".join(json.dumps(r, separators=(",", ":"), default=str) for r in records).encode()
+        block = zlib.compress(payload, self.level)
+        if self._file is None or self._file_bytes >= self.rotate_bytes:
+            self._rotate()
+        self._file.write(HEADER.pack(MAGIC, len(block), len(records)))
+        self._file.write(block)
+        self._file.flush()
+        self._file_bytes += HEADER.size + len(block)
+        self.written += len(records)
+        self.blocks += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.name}-{stamp}-{os.getpid()}-{self._seq}.ffev")
+        self._seq += 1
+        self._file = open(path, "ab")
+        self._file_bytes = 0
+        # Oldest first by modification time, keep the newest `keep` - but
+        # only delete another process's file once it has gone quiet
+        old = sorted(glob.glob(os.path.join(self.directory, f"{self.name}-*.ffev")), key=_mtime)
+        pid, cutoff = str(os.getpid()), time.time() - STALE_S
+        for stale in old[:max(0, len(old) - self.keep)]:
+            if stale == path:
+                continue
+            if os.path.basename(stale).rsplit("-", 2)[1] != pid and _mtime(stale) > cutoff:
+                continue
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {"written": self.written, "blocks": self.blocks, "buffered": len(self._buffer),
+                "dropped": self.dropped_total + sum(self._dropped.values())}
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0  # deleted by another process since the glob
+
+
+# ============================================================
+# READING
+# ============================================================
+
+def read_events(path):
+    """Yield event dicts from a log file; stops quietly at a truncated last block"""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            magic, length, _count = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: not an event log block")
+            block = f.read(length)
+            if len(block) < length:
+                return  # writer was killed mid-block
+            for line in zlib.decompress(block).splitlines():
+                yield json.loads(line)
+
+
+# ============================================================
+# SETUP
+# ============================================================
+
+_logs = {}
+
+
+def open_log(name, **kwargs):
+    """Process-wide log for `name` (closed at exit), or a NullEventLog if FORMFIT_EVENT_LOG=0"""
+    if os.environ.get("FORMFIT_EVENT_LOG", "1").lower() in ("0", "false", "no", "off"):
+        return NullEventLog()
+    log = _logs.get(name)
+    if log is None:
+        log = _logs[name] = EventLog(name, **kwargs)
+        atexit.register(log.close)
+    return log
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["cat"] and len(sys.argv) > 2:
+        for path in sys.argv[2:]:
+            for event in read_events(path):
+                print(json.dumps(event))
+    elif sys.argv[1:2] == ["ls"]:
+        for path in sorted(glob.glob(os.path.join(log_dir(), "*.ffev")), key=os.path.getmtime):
+            print(f"{os.path.getsize(path):>10,}  {path}")
+    else:
+        print("usage: python event_log.py cat <file>... | ls")
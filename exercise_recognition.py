@@ -0,0 +1,314 @@
+"""
+FormFit Exercise Recognition
+Guesses which exercise the user is doing from the last couple of seconds of
+joint angles, so the coach can follow along without a key press or voice
+command.
+
+- Each frame pushes one feature row (the per-side angles and back from
+  get_all_angles, plus torso tilt from vertical) into a ring buffer.
+- Every STRIDE frames the window is embedded (per-feature mean, std, min,
+  max), standardized and PCA-projected, and its k nearest labeled windows
+  vote, weighted by inverse distance.
+- A switch needs the same label to win with >= `min_confidence` on
+  `confirm` decisions in a row, and not within `hold_s` of the last switch
+  or manual selection. "idle" (standing still) can win a vote but is never
+  switched to.
+
+The labeled windows come from synthetic_poses (varied tempo, noise,
+asymmetry and mistakes) and are cached in FORMFIT_RECOGNITION_INDEX
+(default ~/.cache/formfit/exercise_index.npz); `python
+exercise_recognition.py build` rebuilds them. Lookups use scipy's cKDTree
+when scipy is installed, otherwise a brute-force numpy search (same
+results, fine at this index size).
+
+Cost: a row push per frame (~5us) and one embed + lookup per STRIDE frames
+(~100us), so it can run next to check_form on every frame.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from form_analysis import ANGLE_NAMES, ANGLE_INDEX, EXERCISES
+
+INDEX_VERSION = 1
+WINDOW = 60          # frames (~2s at 30 fps) - about one rep
+STRIDE = 5           # frames between decisions
+PCA_DIMS = 12
+K = 9
+IDLE = "idle"
+
+# Landmarks for torso tilt: shoulder and hip midpoints
+SHOULDERS, HIPS = (11, 12), (23, 24)
+ANGLE_INPUTS = ANGLE_NAMES + ['back']  # angles update() reads (for angle plans)
+FEATURE_COLUMNS = np.array([ANGLE_INDEX[n] for n in ANGLE_INPUTS])
+NUM_FEATURES = len(FEATURE_COLUMNS) + 1  # + torso tilt
+
+
+def index_path() -> str:
+    path = os.environ.get("FORMFIT_RECOGNITION_INDEX")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "exercise_index.npz")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def torso_tilt(landmarks):
+    """Degrees between the hip->shoulder line and vertical; (..., 33, 4) -> (...)"""
+    shoulders = landmarks[..., SHOULDERS, :2].mean(axis=-2)
+    hips = landmarks[..., HIPS, :2].mean(axis=-2)
+    d = shoulders - hips
+    return np.degrees(np.arctan2(np.abs(d[..., 0]), -d[..., 1]))
+
+
+def feature_rows(angle_matrix, landmarks):
+    """batch_angles output (T, len(ANGLE_KEYS)) + landmarks (T, 33, 4) -> (T, NUM_FEATURES)"""
+    return np.column_stack([angle_matrix[:, FEATURE_COLUMNS], torso_tilt(landmarks)]).astype(np.float32)
+
+
+def embed(windows):
+    """(..., WINDOW, NUM_FEATURES) -> (..., 4 * NUM_FEATURES)"""
+    return np.concatenate([windows.mean(axis=-2), windows.std(axis=-2),
+                           windows.min(axis=-2), windows.max(axis=-2)], axis=-1)
+
+
+# ============================================================
+# INDEX
+# ============================================================
+
+class ExerciseIndex:
+    """Labeled window embeddings in PCA space with a nearest-neighbor lookup"""
+
+    def __init__(self, points, labels, classes, mean, scale, components):
+        self.points = points.astype(np.float32)
+        self.labels = labels
+        self.classes = list(classes)
+        self.mean = mean
+        self.scale = scale
+        self.components = components
+        self._idle = self.classes.index(IDLE) if IDLE in self.classes else -1
+        try:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self.points)
+        except ImportError:
+            self._tree = None
+            self._sq_norms = (self.points * self.points).sum(axis=1)
+
+    def __len__(self):
+        return len(self.points)
+
+    def project(self, embeddings):
+        return ((embeddings - self.mean) / self.scale) @ self.components
+
+    def query(self, point, k=K):
+        """Nearest k (distances, labels) for one projected point"""
+        k = min(k, len(self.points))
+        if self._tree is not None:
+            dist, idx = self._tree.query(point, k=k)
+            return np.atleast_1d(dist), self.labels[np.atleast_1d(idx)]
+        sq = self._sq_norms - 2.0 * (self.points @ point) + point @ point
+        idx = np.argpartition(sq, k - 1)[:k]
+        return np.sqrt(np.maximum(sq[idx], 0.0)), self.labels[idx]
+
+    def classify(self, embedding, k=K):
+        """One window embedding -> (label, confidence 0-1)"""
+        dist, labels = self.query(self.project(embedding), k)
+        votes = np.bincount(labels, weights=1.0 / (dist + 1e-3), minlength=len(self.classes))
+        best = int(np.argmax(votes))
+        return self.classes[best], float(votes[best] / votes.sum())
+
+    # ---------------- build / persist ----------------
+
+    @classmethod
+    def fit(cls, embeddings, labels, classes, dims=PCA_DIMS):
+        mean = embeddings.mean(axis=0)
+        scale = embeddings.std(axis=0) + 1e-3
+        z = (embeddings - mean) / scale
+        _, _, vt = np.linalg.svd(z - z.mean(axis=0), full_matrices=False)
+        components = vt[:dims].T.astype(np.float32)
+        return cls(z @ components, labels, classes, mean, scale, components)
+
+    def save(self, path=None):
+        np.savez_compressed(path or index_path(), version=INDEX_VERSION, points=self.points,
+                            labels=self.labels, classes=np.array(self.classes), mean=self.mean,
+                            scale=self.scale, components=self.components)
+
+    @classmethod
+    def load(cls, path=None, build_missing=True):
+        """Cached index, or build (and cache) a synthetic one"""
+        path = path or index_path()
+        if os.path.exists(path):
+            data = np.load(path)
+            if int(data['version']) == INDEX_VERSION:
+                return cls(data['points'], data['labels'], list(data['classes']),
+                           data['mean'], data['scale'], data['components'])
+        if not build_missing:
+            return None
+        index = synthetic_index()
+        index.save(path)
+        return index
+
+
+VARIANTS = [
+    dict(),
+    dict(tempo=1.6, noise=0.006),
+    dict(tempo=3.5, asymmetry=12.0),
+    dict(tempo=2.2, occlusion=0.03),
+]
+
+
+def synthetic_index(reps=24, window_stride=4, seed=0) -> ExerciseIndex:
+    """Labeled windows from synthetic_poses for every exercise, plus standing still"""
+    from form_analysis import batch_angles
+    import synthetic_poses
+
+    rng = np.random.default_rng(seed)
+    classes = list(EXERCISES) + [IDLE]
+    embeddings, labels = [], []
+
+    def add(rows, label):
+        windows = np.lib.stride_tricks.sliding_window_view(rows, WINDOW, axis=0)[::window_stride]
+        embeddings.append(embed(windows.transpose(0, 2, 1)))
+        labels.append(np.full(len(windows), classes.index(label)))
+
+    standing = []
+    for key in EXERCISES:
+        variants = VARIANTS + [dict(mistakes=[m[0] for m in EXERCISES[key].get('common_mistakes', [])][:1],
+                                    mistake_rate=0.5)]
+        for variant in variants:
+            try:
+                trace = synthetic_poses.generate(key, reps=reps, seed=int(rng.integers(1 << 31)), **variant)
+            except ValueError:
+                continue  # mistake synthetic_poses can't render
+            add(feature_rows(batch_angles(trace.landmarks), trace.landmarks), key)
+        if synthetic_poses.BODY_SETUP.get(key, (0.0,))[0] == 0.0:
+            standing.append(trace.landmarks[0])
+
+    # Standing still between sets: start poses of the upright exercises, jittered
+    for pose in standing:
+        frames = np.repeat(pose[None], WINDOW * 8, axis=0)
+        frames[..., :2] += rng.normal(0, 0.004, frames[..., :2].shape).astype(np.float32)
+        add(feature_rows(batch_angles(frames), frames), IDLE)
+
+    return ExerciseIndex.fit(np.concatenate(embeddings), np.concatenate(labels), classes)
+
+
+# ============================================================
+# ONLINE RECOGNIZER
+# ============================================================
+
+class ExerciseRecognizer:
+    def __init__(self, index, min_confidence=0.75, confirm=3, hold_s=6.0):
+        self.index = index
+        self.min_confidence = min_confidence  # vote share the winning label needs
+        self.confirm = confirm                # consecutive winning decisions before a switch
+        self.hold_s = hold_s                  # no automatic switch this soon after the last one
+
+        self.current = None
+        self.label = None        # last decision, for display
+        self.confidence = 0.0
+        self.switches = 0
+        self._rows = np.zeros((WINDOW, NUM_FEATURES), dtype=np.float32)
+        self._filled = 0
+        self._since_decision = 0
+        self._candidate = None
+        self._streak = 0
+        self._held_until = 0.0
+
+    def set_current(self, exercise_key, now=None):
+        """Manual selection (key press, voice, UI): adopt it and hold off auto-switching"""
+        now = time.monotonic() if now is None else now
+        self.current = exercise_key
+        self._held_until = now + self.hold_s
+        self._candidate, self._streak = None, 0
+
+    def reset(self):
+        """Person left the frame: start the window over"""
+        self._filled = 0
+        self._since_decision = 0
+        self._candidate, self._streak = None, 0
+
+    def update(self, angles, landmarks, now=None):
+        """Feed one frame (get_all_angles dict + (33, 4) landmarks).
+
+        Returns the exercise key to switch to, or None.
+        """
+        row = self._rows[self._filled % WINDOW]
+        for i, name in enumerate(ANGLE_NAMES):
+            row[i] = angles[name]
+        row[len(ANGLE_NAMES)] = angles['back']
+        row[-1] = torso_tilt(landmarks)
+        self._filled += 1
+        self._since_decision += 1
+        if self.index is None or self._filled < WINDOW or self._since_decision < STRIDE:
+            return None
+        self._since_decision = 0
+
+        # Row order in the ring doesn't matter - the embedding is order-free
+        self.label, self.confidence = self.index.classify(embed(self._rows))
+        if self.confidence < self.min_confidence or self.label == IDLE:
+            self._candidate, self._streak = None, 0
+            return None
+        if self.label == self._candidate:
+            self._streak += 1
+        else:
+            self._candidate, self._streak = self.label, 1
+
+        now = time.monotonic() if now is None else now
+        if self._streak >= self.confirm and self.label != self.current and now >= self._held_until:
+            self.current = self.label
+            self._held_until = now + self.hold_s
+            self._streak = 0
+            self.switches += 1
+            return self.label
+        return None
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def _evaluate(index, reps=6, seed=123):
+    """Fresh synthetic traces per exercise -> decision accuracy and per-frame cost"""
+    from form_analysis import batch_angles, get_all_angles
+    import synthetic_poses
+
+    rng = np.random.default_rng(seed)
+    frames_total, elapsed_total = 0, 0.0
+    worst = 0.0
+    for key in EXERCISES:
+        trace = synthetic_poses.generate(key, reps=reps, tempo=float(rng.uniform(1.8, 3.2)),
+                                         noise=0.004, seed=int(rng.integers(1 << 31)))
+        angle_dicts = [get_all_angles(lm) for lm in trace.landmarks]
+        recognizer = ExerciseRecognizer(index)
+        decisions = []
+        for angles, lm in zip(angle_dicts, trace.landmarks):
+            t0 = time.perf_counter()
+            recognizer.update(angles, lm)
+            dt = time.perf_counter() - t0
+            elapsed_total += dt
+            worst = max(worst, dt)
+            if recognizer._since_decision == 0 and recognizer._filled >= WINDOW:
+                decisions.append(recognizer.label)
+        frames_total += len(trace.landmarks)
+        correct = np.mean([d == key for d in decisions]) if decisions else 0.0
+        print(f"  {key:<15} {100 * correct:5.1f}% of {len(decisions)} decisions | switched to {recognizer.current}")
+    print(f"  per frame: mean {elapsed_total / frames_total * 1e6:.0f}us, worst {worst * 1e6:.0f}us "
+          f"({'cKDTree' if index._tree is not None else 'numpy'} search, {len(index)} windows)")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:2] == ["build"]:
+        t0 = time.perf_counter()
+        index = synthetic_index()
+        index.save()
+        print(f"{len(index)} labeled windows -> {index_path()} ({time.perf_counter() - t0:.1f}s)")
+        _evaluate(index)
+    elif sys.argv[1:2] == ["eval"]:
+        _evaluate(ExerciseIndex.load())
+    else:
+        print("usage: python exercise_recognition.py build | eval")
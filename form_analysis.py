@@ -0,0 +1,631 @@
+"""
+FormFit Form Analysis
+Exercise definitions, joint-angle extraction and form checking shared by
+the analyzers (moved out of .vscode/stream.py), plus batched versions that
+score several people in one vectorized pass.
+
+angle_plan(exercise) narrows angle evaluation to what the exercise's phases
+and common mistakes read (plus whatever other consumers ask for); build it
+when the exercise changes and pass it to get_all_angles / batch_angles.
+"""
+
+import numpy as np
+
+from landmark_adapter import joint_angles
+
+# ============================================================
+# EXERCISES WITH BETTER ANGLE DEFINITIONS
+# ============================================================
+
+EXERCISES = {
+    "shoulder_press": {
+        "name": "Shoulder Press",
+        "target": "shoulders, triceps",
+        "camera_position": "FRONT or SIDE",
+        "phases": {
+            "BOTTOM": {
+                "description": "Starting position - weights at shoulders",
+                "angles": {
+                    "left_elbow": (70, 110),      # Range: 70-110 degrees
+                    "right_elbow": (70, 110),
+                    "left_arm_raise": (70, 100),  # Arm raised to shoulder height
+                    "right_arm_raise": (70, 100)
+                }
+            },
+            "TOP": {
+                "description": "Arms fully extended overhead",
+                "angles": {
+                    "left_elbow": (150, 180),     # Almost straight
+                    "right_elbow": (150, 180),
+                    "left_arm_raise": (160, 180), # Arms overhead
+                    "right_arm_raise": (160, 180)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("back_arch", "back", "<", 160, "Don't arch your back"),
+            ("elbow_flare", "elbow_diff", ">", 30, "Keep elbows even"),
+        ],
+        "instructions": [
+            "Stand with feet shoulder-width apart",
+            "Hold weights at shoulder height",
+            "Press straight up overhead",
+            "Lower with control"
+        ]
+    },
+    "squat": {
+        "name": "Squat",
+        "target": "quads, glutes, hamstrings",
+        "camera_position": "SIDE view recommended",
+        "phases": {
+            "STANDING": {
+                "description": "Standing tall",
+                "angles": {
+                    "left_knee": (160, 180),
+                    "right_knee": (160, 180),
+                    "left_hip": (160, 180),
+                    "right_hip": (160, 180)
+                }
+            },
+            "BOTTOM": {
+                "description": "Full squat depth",
+                "angles": {
+                    "left_knee": (70, 110),
+                    "right_knee": (70, 110),
+                    "left_hip": (70, 110),
+                    "right_hip": (70, 110)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("knee_cave", "knee_diff", ">", 20, "Knees caving in"),
+            ("forward_lean", "back", "<", 100, "Leaning too far forward"),
+            ("not_deep", "avg_knee", ">", 120, "Go deeper")
+        ],
+        "instructions": [
+            "Feet shoulder-width apart",
+            "Keep chest up, back straight",
+            "Lower until thighs parallel to ground",
+            "Push through heels to stand"
+        ]
+    },
+    "bicep_curl": {
+        "name": "Bicep Curl",
+        "target": "biceps",
+        "camera_position": "FRONT or SIDE",
+        "phases": {
+            "BOTTOM": {
+                "description": "Arms extended",
+                "angles": {
+                    "left_elbow": (150, 180),
+                    "right_elbow": (150, 180)
+                }
+            },
+            "TOP": {
+                "description": "Full contraction",
+                "angles": {
+                    "left_elbow": (30, 60),
+                    "right_elbow": (30, 60)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("swinging", "shoulder_movement", ">", 20, "Don't swing - control the weight"),
+            ("uneven", "elbow_diff", ">", 25, "Keep both arms even")
+        ],
+        "instructions": [
+            "Stand with arms at sides",
+            "Keep elbows close to body",
+            "Curl weights to shoulders",
+            "Lower slowly with control"
+        ]
+    },
+    "pushup": {
+        "name": "Push Up",
+        "target": "chest, triceps, shoulders",
+        "camera_position": "SIDE view recommended",
+        "phases": {
+            "TOP": {
+                "description": "Arms extended",
+                "angles": {
+                    "left_elbow": (160, 180),
+                    "right_elbow": (160, 180),
+                    "back": (160, 180)
+                }
+            },
+            "BOTTOM": {
+                "description": "Chest near ground",
+                "angles": {
+                    "left_elbow": (70, 100),
+                    "right_elbow": (70, 100),
+                    "back": (160, 180)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("sagging_hips", "back", "<", 150, "Keep hips up - straight line"),
+            ("pike", "back", ">", 190, "Don't pike up"),
+            ("partial_rep", "avg_elbow", ">", 120, "Go lower")
+        ],
+        "instructions": [
+            "Hands slightly wider than shoulders",
+            "Keep body in straight line",
+            "Lower until chest nearly touches ground",
+            "Push back up fully"
+        ]
+    },
+    "lunge": {
+        "name": "Lunge",
+        "target": "quads, glutes, hamstrings",
+        "camera_position": "SIDE view recommended",
+        "phases": {
+            "STANDING": {
+                "description": "Standing tall",
+                "angles": {
+                    "left_knee": (160, 180),
+                    "right_knee": (160, 180)
+                }
+            },
+            "BOTTOM": {
+                "description": "Deep lunge",
+                "angles": {
+                    "left_knee": (80, 110),
+                    "right_knee": (80, 110)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("knee_over_toe", "front_knee", "<", 70, "Knee too far forward"),
+            ("not_deep", "avg_knee", ">", 120, "Go deeper")
+        ],
+        "instructions": [
+            "Step forward with one leg",
+            "Lower hips until both knees at 90°",
+            "Keep front knee over ankle",
+            "Push back to start"
+        ]
+    },
+    "plank": {
+        "name": "Plank",
+        "target": "core, shoulders",
+        "camera_position": "SIDE view required",
+        "phases": {
+            "HOLD": {
+                "description": "Straight body line",
+                "angles": {
+                    "back": (165, 185),
+                    "left_hip": (165, 185),
+                    "right_hip": (165, 185)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("sagging", "back", "<", 160, "Hips sagging - engage core"),
+            ("pike", "back", ">", 190, "Hips too high")
+        ],
+        "instructions": [
+            "Forearms on ground, elbows under shoulders",
+            "Keep body in straight line",
+            "Engage core, don't let hips sag",
+            "Hold position"
+        ]
+    },
+    "lateral_raise": {
+        "name": "Lateral Raise",
+        "target": "side deltoids",
+        "camera_position": "FRONT view recommended",
+        "phases": {
+            "BOTTOM": {
+                "description": "Arms at sides",
+                "angles": {
+                    "left_arm_raise": (0, 30),
+                    "right_arm_raise": (0, 30)
+                }
+            },
+            "TOP": {
+                "description": "Arms parallel to ground",
+                "angles": {
+                    "left_arm_raise": (80, 100),
+                    "right_arm_raise": (80, 100)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("too_high", "avg_arm_raise", ">", 110, "Don't raise above shoulder"),
+            ("uneven", "arm_raise_diff", ">", 20, "Keep arms even")
+        ],
+        "instructions": [
+            "Stand with dumbbells at sides",
+            "Slight bend in elbows",
+            "Raise arms to shoulder height",
+            "Lower with control"
+        ]
+    },
+    "deadlift": {
+        "name": "Deadlift",
+        "target": "back, hamstrings, glutes",
+        "camera_position": "SIDE view required",
+        "phases": {
+            "BOTTOM": {
+                "description": "Bent over, gripping bar",
+                "angles": {
+                    "left_hip": (60, 100),
+                    "right_hip": (60, 100),
+                    "back": (140, 180)  # Back should stay straight
+                }
+            },
+            "TOP": {
+                "description": "Standing tall",
+                "angles": {
+                    "left_hip": (165, 185),
+                    "right_hip": (165, 185),
+                    "back": (165, 185)
+                }
+            }
+        },
+        "common_mistakes": [
+            ("rounded_back", "back", "<", 140, "Keep back straight!"),
+            ("not_locked", "avg_hip", "<", 160, "Stand up fully")
+        ],
+        "instructions": [
+            "Feet hip-width apart",
+            "Bend at hips, keep back straight",
+            "Grip bar, chest up",
+            "Drive through heels to stand"
+        ]
+    }
+}
+
+# ============================================================
+# IMPROVED ANGLE CALCULATIONS
+# ============================================================
+
+# Landmark indices
+NOSE = 0
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_ELBOW = 13
+RIGHT_ELBOW = 14
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_HIP = 23
+RIGHT_HIP = 24
+LEFT_KNEE = 25
+RIGHT_KNEE = 26
+LEFT_ANKLE = 27
+RIGHT_ANKLE = 28
+
+# (p1, p2, p3) for every per-joint angle, measured at p2
+ANGLE_TRIPLETS = {
+    'left_elbow': (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST),        # shoulder-elbow-wrist
+    'right_elbow': (RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST),
+    'left_knee': (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE),               # hip-knee-ankle
+    'right_knee': (RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE),
+    'left_hip': (LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE),             # shoulder-hip-knee
+    'right_hip': (RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE),
+    'left_arm_raise': (LEFT_HIP, LEFT_SHOULDER, LEFT_ELBOW),      # torso vs upper arm
+    'right_arm_raise': (RIGHT_HIP, RIGHT_SHOULDER, RIGHT_ELBOW),
+}
+ANGLE_NAMES = list(ANGLE_TRIPLETS)
+ANGLE_TRIPLET_ARRAY = np.array(list(ANGLE_TRIPLETS.values()))
+
+# Back angle is measured on left/right midpoints of shoulder, hip and knee
+BACK_LEFT = [LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE]
+BACK_RIGHT = [RIGHT_SHOULDER, RIGHT_HIP, RIGHT_KNEE]
+BACK_TRIPLET = np.array([[0, 1, 2]])
+
+# Derived values: name -> (op, left, right), over two per-side angles
+DERIVED_ANGLES = {
+    'avg_elbow': ('avg', 'left_elbow', 'right_elbow'),
+    'avg_knee': ('avg', 'left_knee', 'right_knee'),
+    'avg_hip': ('avg', 'left_hip', 'right_hip'),
+    'avg_arm_raise': ('avg', 'left_arm_raise', 'right_arm_raise'),
+    'elbow_diff': ('diff', 'left_elbow', 'right_elbow'),
+    'knee_diff': ('diff', 'left_knee', 'right_knee'),
+    'arm_raise_diff': ('diff', 'left_arm_raise', 'right_arm_raise'),
+}
+
+def get_point(landmarks, idx):
+    """Get x, y coordinates from a (33, 4) landmark array (a view, no copy)"""
+    return landmarks[idx, :2]
+
+# ============================================================
+# ANGLE PLANS (compute only what the exercise reads)
+# ============================================================
+
+class AnglePlan:
+    """The angles a set of consumers reads, and how to get them with the least work.
+
+    Dependencies: a derived value needs its two per-side angles, 'back' needs
+    the shoulder / hip / knee midpoints. Requested names are closed over
+    those, then evaluated in one vectorized pass over just the needed
+    triplets - the back's midpoints are gathered alongside (each per-side
+    triplet is its own "midpoint", so it's the same arithmetic) - followed
+    by the derived values. Names that aren't computable (e.g. a mistake on
+    'shoulder_movement') are ignored, as check_form ignores them.
+    """
+
+    def __init__(self, names):
+        needed = set()
+        for name in names:
+            if name in DERIVED_ANGLES:
+                _, left, right = DERIVED_ANGLES[name]
+                needed.update((name, left, right))
+            elif name in ANGLE_TRIPLETS or name == 'back':
+                needed.add(name)
+        self.keys = [k for k in ANGLE_KEYS if k in needed]
+        self.columns = np.array([ANGLE_INDEX[k] for k in self.keys], dtype=np.intp)
+        self.derived = [(name,) + DERIVED_ANGLES[name] for name in DERIVED_ANGLES if name in needed]
+
+        # (2, K, 3) landmark indices, averaged pairwise before the angle math
+        self.angle_keys = [n for n in ANGLE_NAMES if n in needed]
+        left = [ANGLE_TRIPLETS[n] for n in self.angle_keys]
+        right = list(left)
+        if 'back' in needed:
+            self.angle_keys.append('back')
+            left.append(BACK_LEFT)
+            right.append(BACK_RIGHT)
+        self._gather = np.array([left, right], dtype=np.intp).reshape(2, -1, 3)
+        self._angle_cols = [ANGLE_INDEX[k] for k in self.angle_keys]
+        self.landmarks = np.unique(self._gather)  # landmark indices the plan reads
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _angles(self, landmarks):
+        """(..., 33, 4) -> (..., K) angles of the gathered triplets"""
+        g = landmarks[..., self._gather, :2]
+        pts = (g[..., 0, :, :, :] + g[..., 1, :, :, :]) / 2
+        a, b, c = pts[..., 0, :], pts[..., 1, :], pts[..., 2, :]
+        ba = a - b
+        bc = c - b
+        dot = (ba * bc).sum(-1)
+        norm = np.sqrt((ba * ba).sum(-1) * (bc * bc).sum(-1)) + 1e-6
+        return np.degrees(np.arccos(np.clip(dot / norm, -1.0, 1.0)))
+
+    def evaluate(self, landmarks) -> dict:
+        """The planned angles of one (33, 4) landmark array, as a get_all_angles()-style dict"""
+        angles = dict(zip(self.angle_keys, self._angles(landmarks).tolist())) if self.angle_keys else {}
+        for name, op, left, right in self.derived:
+            if op == 'avg':
+                angles[name] = (angles[left] + angles[right]) / 2
+            else:
+                angles[name] = abs(angles[left] - angles[right])
+        return angles
+
+    def evaluate_batch(self, poses) -> np.ndarray:
+        """(N, 33, 4) -> (N, len(ANGLE_KEYS)), unplanned columns NaN"""
+        n = len(poses)
+        out = np.full((n, len(ANGLE_KEYS)), np.nan, dtype=np.float32)
+        if n == 0:
+            return out
+        if self.angle_keys:
+            out[:, self._angle_cols] = self._angles(poses)
+        col = ANGLE_INDEX
+        for name, op, left, right in self.derived:
+            if op == 'avg':
+                out[:, col[name]] = (out[:, col[left]] + out[:, col[right]]) / 2
+            else:
+                out[:, col[name]] = np.abs(out[:, col[left]] - out[:, col[right]])
+        return out
+
+def exercise_angles(exercise_key) -> list[str]:
+    """Angle names an exercise's phases and common mistakes read"""
+    exercise = EXERCISES.get(exercise_key)
+    if exercise is None:
+        return list(ANGLE_KEYS)
+    names = [n for phase in exercise.get('phases', {}).values() for n in phase.get('angles', {})]
+    names += [m[1] for m in exercise.get('common_mistakes', [])]
+    return names
+
+_angle_plans = {}
+
+def angle_plan(exercise_keys, extra=()) -> AnglePlan:
+    """Plan for one exercise (or several) plus `extra` names other consumers read.
+
+    Cached - call it when the exercise or the set of consumers changes, not
+    per frame. Unknown exercises get every angle.
+    """
+    if isinstance(exercise_keys, str):
+        exercise_keys = (exercise_keys,)
+    cache_key = (frozenset(exercise_keys), frozenset(extra))
+    plan = _angle_plans.get(cache_key)
+    if plan is None:
+        names = [n for key in exercise_keys for n in exercise_angles(key)]
+        plan = _angle_plans[cache_key] = AnglePlan(names + list(extra))
+    return plan
+
+def get_all_angles(landmarks, plan=None):
+    """Calculate angles from a (33, 4) landmark array - every one, or just the plan's"""
+    try:
+        return (FULL_PLAN if plan is None else plan).evaluate(landmarks)
+    except Exception as e:
+        print(f"Angle calculation error: {e}")
+        return {}
+
+# ============================================================
+# IMPROVED FORM CHECKING
+# ============================================================
+
+def check_form(exercise_key, angles):
+    """Check form against exercise definition"""
+    
+    if exercise_key not in EXERCISES:
+        return 50, [], "UNKNOWN", {}
+    
+    exercise = EXERCISES[exercise_key]
+    phases = exercise.get('phases', {})
+    
+    # Determine current phase
+    current_phase = None
+    best_phase_score = 0
+    phase_scores = {}
+    
+    for phase_name, phase_data in phases.items():
+        phase_angles = phase_data.get('angles', {})
+        score = 0
+        total = 0
+        
+        for angle_name, (min_val, max_val) in phase_angles.items():
+            if angle_name in angles:
+                total += 1
+                angle_val = angles[angle_name]
+                
+                if min_val <= angle_val <= max_val:
+                    score += 1
+                elif angle_val < min_val:
+                    # Partial credit for being close
+                    diff = min_val - angle_val
+                    score += max(0, 1 - diff / 30)
+                else:
+                    diff = angle_val - max_val
+                    score += max(0, 1 - diff / 30)
+        
+        phase_score = (score / total * 100) if total > 0 else 0
+        phase_scores[phase_name] = phase_score
+        
+        if phase_score > best_phase_score:
+            best_phase_score = phase_score
+            current_phase = phase_name
+    
+    # Check for common mistakes
+    feedback = []
+    mistakes = exercise.get('common_mistakes', [])
+    penalty = 0
+    
+    for mistake in mistakes:
+        name, angle_key, operator, threshold, message = mistake
+        
+        if angle_key in angles:
+            val = angles[angle_key]
+            
+            triggered = False
+            if operator == '<' and val < threshold:
+                triggered = True
+            elif operator == '>' and val > threshold:
+                triggered = True
+            
+            if triggered:
+                feedback.append(message)
+                penalty += 15
+    
+    # Calculate final score
+    accuracy = max(0, min(100, best_phase_score - penalty))
+    
+    # Add phase-specific feedback
+    if current_phase and current_phase in phases:
+        phase_data = phases[current_phase]
+        for angle_name, (min_val, max_val) in phase_data.get('angles', {}).items():
+            if angle_name in angles:
+                val = angles[angle_name]
+                if val < min_val - 15:
+                    nice_name = angle_name.replace('_', ' ').title()
+                    feedback.append(f"{nice_name}: extend more")
+                elif val > max_val + 15:
+                    nice_name = angle_name.replace('_', ' ').title()
+                    feedback.append(f"{nice_name}: bend more")
+    
+    return accuracy, feedback[:4], current_phase or "ACTIVE", angles
+
+
+# ============================================================
+# BATCHED ANALYSIS (several people per frame)
+# ============================================================
+
+# Column order of batch_angles() output - same names get_all_angles() returns
+ANGLE_KEYS = ANGLE_NAMES + [
+    'back', 'avg_elbow', 'avg_knee', 'avg_hip', 'avg_arm_raise',
+    'elbow_diff', 'knee_diff', 'arm_raise_diff',
+]
+ANGLE_INDEX = {name: i for i, name in enumerate(ANGLE_KEYS)}
+
+FULL_PLAN = AnglePlan(ANGLE_KEYS)
+
+def batch_angles(poses, plan=None):
+    """(N, 33, 4) landmark arrays -> (N, len(ANGLE_KEYS)) angle matrix.
+
+    With a plan only its columns are computed; the rest are NaN.
+    """
+    return (FULL_PLAN if plan is None else plan).evaluate_batch(poses)
+
+_form_plans = {}
+
+def _form_plan(exercise_key):
+    """Per-exercise column indices and thresholds, compiled once"""
+    if exercise_key not in _form_plans:
+        exercise = EXERCISES[exercise_key]
+        phases = []
+        for phase_name, phase_data in exercise.get('phases', {}).items():
+            names = [a for a in phase_data.get('angles', {}) if a in ANGLE_INDEX]
+            ranges = np.array([phase_data['angles'][a] for a in names], dtype=np.float32).reshape(-1, 2)
+            phases.append((phase_name, names, np.array([ANGLE_INDEX[a] for a in names], dtype=np.intp),
+                           ranges[:, 0], ranges[:, 1]))
+        mistakes = [m for m in exercise.get('common_mistakes', []) if m[1] in ANGLE_INDEX]
+        _form_plans[exercise_key] = {
+            'phases': phases,
+            'mistake_cols': np.array([ANGLE_INDEX[m[1]] for m in mistakes], dtype=np.intp),
+            'mistake_thresholds': np.array([m[3] for m in mistakes], dtype=np.float32),
+            'mistake_is_lt': np.array([m[2] == '<' for m in mistakes], dtype=bool),
+            'mistake_messages': [m[4] for m in mistakes],
+        }
+    return _form_plans[exercise_key]
+
+def batch_check_form(exercise_key, angle_matrix):
+    """check_form() for every row of batch_angles() at once.
+
+    Returns (accuracies (N,), feedback lists, phase names) with the same
+    scoring and feedback rules as check_form().
+    """
+    n = len(angle_matrix)
+    if exercise_key not in EXERCISES:
+        return np.full(n, 50.0), [[] for _ in range(n)], ["UNKNOWN"] * n
+    plan = _form_plan(exercise_key)
+    
+    # Phase scores: 1 inside the range, linear falloff to 0 over 30 degrees outside
+    phase_scores = np.zeros((n, max(1, len(plan['phases']))), dtype=np.float32)
+    for p, (_, _, cols, lo, hi) in enumerate(plan['phases']):
+        if len(cols) == 0:
+            continue
+        vals = angle_matrix[:, cols]
+        diff = np.maximum(lo - vals, 0) + np.maximum(vals - hi, 0)
+        phase_scores[:, p] = np.clip(1 - diff / 30, 0, 1).mean(axis=1) * 100
+    best = phase_scores.argmax(axis=1)  # first max wins, like check_form
+    best_score = phase_scores[np.arange(n), best]
+    
+    # Common mistakes
+    if len(plan['mistake_cols']):
+        vals = angle_matrix[:, plan['mistake_cols']]
+        thresholds = plan['mistake_thresholds']
+        triggered = np.where(plan['mistake_is_lt'], vals < thresholds, vals > thresholds)
+    else:
+        triggered = np.zeros((n, 0), dtype=bool)
+    accuracy = np.clip(best_score - 15 * triggered.sum(axis=1), 0, 100)
+    
+    # Phase-specific extend/bend flags, for each person's best phase
+    has_phase = best_score > 0
+    phase_flags = []
+    for p, (_, _, cols, lo, hi) in enumerate(plan['phases']):
+        vals = angle_matrix[:, cols]
+        rows = (best == p) & has_phase
+        phase_flags.append(((vals < lo - 15) & rows[:, None], (vals > hi + 15) & rows[:, None]))
+    
+    # Feedback text - only people with something to say touch Python
+    names = [phase[0] for phase in plan['phases']]
+    phase_names = [names[b] if ok else "ACTIVE" for b, ok in zip(best.tolist(), has_phase.tolist())]
+    feedback = [[] for _ in range(n)]
+    any_flag = triggered.any(axis=1)
+    for extend, bend in phase_flags:
+        any_flag |= extend.any(axis=1) | bend.any(axis=1)
+    for i in np.flatnonzero(any_flag).tolist():
+        fb = [plan['mistake_messages'][j] for j in np.flatnonzero(triggered[i]).tolist()]
+        if has_phase[i]:
+            _, angle_names, _, _, _ = plan['phases'][best[i]]
+            extend, bend = phase_flags[best[i]]
+            for j, name in enumerate(angle_names):
+                if extend[i, j]:
+                    fb.append(f"{name.replace('_', ' ').title()}: extend more")
+                elif bend[i, j]:
+                    fb.append(f"{name.replace('_', ' ').title()}: bend more")
+        feedback[i] = fb[:4]
+    
+    return accuracy, feedback, phase_names
@@ -0,0 +1,105 @@
+"""
+FormFit Frame Ingest
+Allocation-free capture -> RGB path for the analyzer loops.
+
+Captured frames and their RGB conversions land in preallocated, double
+buffered arrays (the previous frame stays valid while the next is written),
+using OpenCV's dst= outputs. Mirroring for display is done in place on the
+captured frame after the RGB copy is taken; the landmarks are mirrored in
+landmark space (LandmarkAdapter.mirror) instead of flipping pixels for the
+model.
+
+Set FORMFIT_ALLOC_REPORT=1 to trace per-frame allocations with tracemalloc
+and print a report on exit (adds overhead - leave it off normally).
+"""
+
+import os
+import tracemalloc
+
+import cv2
+import numpy as np
+
+
+class FrameIngest:
+    def __init__(self):
+        self._bgr = [None, None]
+        self._rgb = [None, None]
+        self._idx = 0
+        self.frames = 0
+        self.buffer_allocations = 0
+        self.buffer_bytes = 0
+
+    def _ensure(self, shape):
+        if self._rgb[0] is None or self._rgb[0].shape != shape:
+            # Only on the first frame or a resolution change
+            self._bgr = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+            self._rgb = [np.empty(shape, dtype=np.uint8) for _ in range(2)]
+            self.buffer_allocations += 4
+            self.buffer_bytes += 4 * int(np.prod(shape))
+
+    def read(self, cap):
+        """cap.read() into the next capture buffer -> (ret, frame)"""
+        self.frames += 1
+        self._idx ^= 1
+        buf = self._bgr[self._idx]
+        ret, frame = cap.read(buf) if buf is not None else cap.read()
+        if ret and frame is not buf:
+            # First frame (or the driver changed resolution): adopt its shape
+            self._ensure(frame.shape)
+            np.copyto(self._bgr[self._idx], frame)
+            frame = self._bgr[self._idx]
+        return ret, frame
+
+    def to_rgb(self, frame):
+        """BGR -> RGB into the RGB buffer paired with the current capture buffer"""
+        self._ensure(frame.shape)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb[self._idx])
+
+    @staticmethod
+    def mirror_inplace(frame):
+        """Horizontal flip for display, in place (take the RGB copy first)"""
+        return cv2.flip(frame, 1, dst=frame)
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "buffer_allocations": self.buffer_allocations,
+            "buffer_mb": round(self.buffer_bytes / 1e6, 1),
+        }
+
+
+class AllocationMeter:
+    """Peak transient allocation per frame, via tracemalloc (opt-in)"""
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get("FORMFIT_ALLOC_REPORT", "").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self.frames = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self._base = 0
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def frame_start(self):
+        if self.enabled:
+            tracemalloc.reset_peak()
+            self._base = tracemalloc.get_traced_memory()[0]
+
+    def frame_end(self):
+        if self.enabled:
+            _, peak = tracemalloc.get_traced_memory()
+            used = max(0, peak - self._base)
+            self.frames += 1
+            self.total_bytes += used
+            self.max_bytes = max(self.max_bytes, used)
+
+    def report(self, ingest=None):
+        if not self.enabled or not self.frames:
+            return
+        mean_kb = self.total_bytes / self.frames / 1024
+        print(f"Allocations: {mean_kb:.1f} KB/frame mean, {self.max_bytes / 1024:.1f} KB max "
+              f"over {self.frames} frames")
+        if ingest is not None:
+            print(f"Ingest buffers: {ingest.stats()}")
@@ -90,6 +90,10 @@ const useLiveKit = (livekitUrl, getToken) => {
      */
     const handleAgentMessage = useCallback((data) => {
         switch (data.type) {
+            case 'batch':
+                // Agent merges commands sent in the same tick into one packet
+                data.commands.forEach(handleAgentMessage);
+                break;
             case 'transcript':
                 setTranscript(data.text);
                 break;
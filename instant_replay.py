@@ -0,0 +1,242 @@
+"""
+FormFit Instant Replay
+Keeps the last few seconds of video in memory and writes a short clip when
+a form mistake fires, so a coach can watch the exact rep behind "Don't arch
+your back" without the session being recorded.
+
+    replay = ReplayBuffer()
+    ...
+    replay.push(frame)                  # frame loop, every frame (~0.3ms)
+    replay.update(errors)               # clips the mistakes that just appeared
+    ...
+    replay.close()                      # finishes pending clips
+
+Frames are downscaled to REPLAY_WIDTH and stored in a ring of preallocated
+slots - JPEG bytes (default) or raw pixels with FORMFIT_REPLAY_JPEG=0 - so
+memory is fixed from the first frame on. A trigger waits POST_ROLL_S for
+the end of the movement, then hands the window's slot range to one
+background thread, which decodes and writes the clip straight from the
+ring. The frame loop never encodes a clip or waits for the writer: a full
+clip queue drops the trigger, and the ring keeps ENCODER_SLACK_S of spare
+slots so frames are not overwritten while they are being written (if the
+writer ever falls that far behind, the clip is cut short and counted as an
+overrun).
+
+    FORMFIT_REPLAY_SECONDS   seconds before the mistake kept (default 4, 0 disables)
+    FORMFIT_REPLAY_WIDTH     stored frame width in pixels (default 320)
+    FORMFIT_REPLAY_JPEG      JPEG quality of stored frames, 0 stores raw pixels (default 80)
+    FORMFIT_REPLAY_DIR       where clips go (default ./replays)
+"""
+
+import os
+import queue
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+REPLAY_SECONDS = float(os.environ.get("FORMFIT_REPLAY_SECONDS", "4"))
+REPLAY_WIDTH = int(os.environ.get("FORMFIT_REPLAY_WIDTH", "320"))
+REPLAY_JPEG = int(os.environ.get("FORMFIT_REPLAY_JPEG", "80"))
+REPLAY_DIR = os.environ.get("FORMFIT_REPLAY_DIR", "replays")
+
+POST_ROLL_S = 1.0        # after the trigger, so the clip shows the rep finishing
+ENCODER_SLACK_S = 2.0    # extra ring slots the writer can lag behind by
+COOLDOWN_S = 10.0        # per mistake, between clips
+CLIP_QUEUE = 4           # clips waiting for the writer before triggers are dropped
+JPEG_SLOT_RATIO = 0.125  # JPEG slot capacity as a fraction of the raw frame size
+MIN_JPEG_QUALITY = 20
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")[:40] or "mistake"
+
+
+class ReplayBuffer:
+    def __init__(self, seconds=REPLAY_SECONDS, fps=30, width=REPLAY_WIDTH, jpeg_quality=REPLAY_JPEG,
+                 out_dir=REPLAY_DIR, post_roll=POST_ROLL_S, cooldown=COOLDOWN_S):
+        self.enabled = seconds > 0
+        self.fps = fps
+        self.width = width
+        self.jpeg_quality = jpeg_quality
+        self.quality = jpeg_quality  # current, lowered while frames overflow their slots
+        self.out_dir = out_dir
+        self.pre_frames = int(round(seconds * fps))
+        self.post_frames = int(round(post_roll * fps))
+        self.capacity = self.pre_frames + self.post_frames + int(round(ENCODER_SLACK_S * fps))
+        self.cooldown = cooldown
+
+        # Allocated on the first frame, when the size is known
+        self._shape = None          # (h, w, 3) stored
+        self._raw = None            # (capacity, h, w, 3) uint8
+        self._jpeg = None           # (capacity, slot_bytes) uint8
+        self._lengths = np.zeros(self.capacity, dtype=np.int64)   # JPEG bytes per slot, 0 = empty
+        self._seqs = np.full(self.capacity, -1, dtype=np.int64)   # frame number each slot holds
+        self._small = None          # resize target before JPEG encoding
+        self.seq = -1               # last frame pushed
+
+        self._pending = None        # [reasons, first_seq, due_seq] waiting for the post-roll
+        self._last_clip = {}        # reason -> time.monotonic() of its last clip
+        self._active = ()           # mistakes on the last update()
+        self._jobs = queue.Queue(CLIP_QUEUE)
+        self._writer = None
+
+        self.clips = []
+        self.dropped = 0            # triggers lost to a full queue
+        self.oversize = 0           # JPEG frames too big for their slot (skipped in clips)
+        self.overruns = 0           # clips cut short because the ring caught up with the writer
+
+    # ---------------- frame loop ----------------
+
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        width = min(self.width, w)
+        height = max(2, int(round(h * width / w)) // 2 * 2)
+        self._shape = (height, width, 3)
+        if self.jpeg_quality > 0:
+            self._small = np.empty(self._shape, dtype=np.uint8)
+            slot = int(height * width * 3 * JPEG_SLOT_RATIO)
+            self._jpeg = np.zeros((self.capacity, slot), dtype=np.uint8)
+        else:
+            self._raw = np.zeros((self.capacity,) + self._shape, dtype=np.uint8)
+
+    def push(self, frame):
+        """Store a downscaled copy of a BGR frame in the next slot"""
+        if not self.enabled:
+            return
+        if self._shape is None:
+            self._allocate(frame)
+        self.seq += 1
+        i = self.seq % self.capacity
+        self._seqs[i] = -1  # being rewritten: the writer must not take it
+        size = (self._shape[1], self._shape[0])
+        if self._raw is not None:
+            cv2.resize(frame, size, dst=self._raw[i], interpolation=cv2.INTER_LINEAR)
+        else:
+            cv2.resize(frame, size, dst=self._small, interpolation=cv2.INTER_LINEAR)
+            n, data = self._encode()
+            if n > self._jpeg.shape[1] and self.quality > MIN_JPEG_QUALITY:
+                # Noisy scene (low light): lower the quality until frames fit again
+                self.quality = max(MIN_JPEG_QUALITY, self.quality - 20)
+                n, data = self._encode()
+            elif n < self._jpeg.shape[1] // 2 and self.quality < self.jpeg_quality:
+                self.quality += 1
+            if n > self._jpeg.shape[1]:
+                self.oversize += 1
+                n = 0
+            if n:
+                self._jpeg[i, :n] = data.reshape(-1)[:n]
+            self._lengths[i] = n
+        self._seqs[i] = self.seq
+
+        if self._pending is not None and self.seq >= self._pending[2]:
+            self._submit()
+
+    def _encode(self):
+        ok, data = cv2.imencode(".jpg", self._small, (cv2.IMWRITE_JPEG_QUALITY, self.quality))
+        return (len(data) if ok else 0), data
+
+    def trigger(self, reason) -> bool:
+        """Save the window around the latest frame; False if on cooldown or disabled"""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if now - self._last_clip.get(reason, -self.cooldown) < self.cooldown:
+            return False
+        self._last_clip[reason] = now
+        if self._pending is not None:
+            # Same movement: one clip named after both mistakes
+            self._pending[0].append(reason)
+            return True
+        self._pending = [[reason], max(0, self.seq - self.pre_frames + 1), self.seq + self.post_frames]
+        return True
+
+    def update(self, mistakes) -> list:
+        """Trigger for each mistake that wasn't in the previous call's; returns the ones clipped"""
+        new = [m for m in mistakes if m not in self._active]
+        self._active = tuple(mistakes)
+        return [m for m in new if self.trigger(m)]
+
+    def _submit(self):
+        reasons, first, last = self._pending
+        self._pending = None
+        if self._writer is None:
+            os.makedirs(self.out_dir, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_clips, name="replay-writer", daemon=True)
+            self._writer.start()
+        try:
+            self._jobs.put_nowait((reasons, first, min(last, self.seq)))
+        except queue.Full:
+            self.dropped += 1
+
+    # ---------------- writer thread ----------------
+
+    def _read(self, seq):
+        """Frame `seq` from the ring; None if it was skipped or overwritten (check _lapped)"""
+        i = seq % self.capacity
+        if self._seqs[i] != seq:
+            return None
+        if self._raw is not None:
+            frame = self._raw[i].copy()
+        else:
+            n = self._lengths[i]
+            frame = cv2.imdecode(self._jpeg[i, :n], cv2.IMREAD_COLOR) if n else None
+        return None if self._lapped(seq) else frame
+
+    def _lapped(self, seq):
+        """The ring has moved past `seq` (or is rewriting its slot)"""
+        return self._seqs[seq % self.capacity] != seq
+
+    def _write_clips(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            reasons, first, last = job
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(self.out_dir, f"{stamp}_{_slug(reasons[0])}.mp4")
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps,
+                                     (self._shape[1], self._shape[0]))
+            if not writer.isOpened():
+                print(f"Replay: can't write {path}")
+                continue
+            written = 0
+            for seq in range(first, last + 1):
+                frame = self._read(seq)
+                if frame is None:
+                    if self._lapped(seq):
+                        self.overruns += 1
+                        break
+                    continue  # oversize JPEG
+                writer.write(frame)
+                written += 1
+            writer.release()
+            self.clips.append({"path": path, "reasons": reasons, "frames": written})
+            print(f"Replay saved: {path} ({', '.join(reasons)}, {written / self.fps:.1f}s)")
+
+    def close(self):
+        """Write the pending clip (without the rest of its post-roll) and wait for the writer"""
+        if self._pending is not None:
+            self._submit()
+        if self._writer is not None:
+            self._jobs.put(None)
+            self._writer.join()
+
+    # ---------------- stats ----------------
+
+    def memory_bytes(self) -> int:
+        ring = self._raw if self._raw is not None else self._jpeg
+        return 0 if ring is None else ring.nbytes
+
+    def stats(self) -> dict:
+        return {
+            "clips": len(self.clips),
+            "dropped": self.dropped,
+            "overruns": self.overruns,
+            "oversize_frames": self.oversize,
+            "jpeg_quality": self.quality if self._jpeg is not None else None,
+            "slots": self.capacity,
+            "ring_mb": round(self.memory_bytes() / 1e6, 1),
+        }
@@ -0,0 +1,95 @@
+"""
+FormFit Landmark Adapter
+Turns a backend result's `pose_landmarks` into one reused float32 array per
+frame, so form checks, drawing and history buffers index numbers instead of
+doing attribute lookups on 33 landmark objects each.
+
+Layout: (num_poses, 33, 4) with columns x, y, z, visibility.
+"""
+
+import operator
+
+import numpy as np
+
+NUM_LANDMARKS = 33
+X, Y, Z, VIS = 0, 1, 2, 3
+
+_xyzv = operator.attrgetter("x", "y", "z", "visibility")
+
+# Index permutation that swaps every left/right landmark pair (nose stays put)
+MIRROR_PERMUTATION = np.arange(NUM_LANDMARKS)
+for _left, _right in [(1, 4), (2, 5), (3, 6), (7, 8), (9, 10)] + [(i, i + 1) for i in range(11, 33, 2)]:
+    MIRROR_PERMUTATION[_left], MIRROR_PERMUTATION[_right] = _right, _left
+
+
+class LandmarkAdapter:
+    def __init__(self, max_poses: int = 1):
+        self.max_poses = max_poses
+        self.buffer = np.zeros((max_poses, NUM_LANDMARKS, 4), dtype=np.float32)
+        self._scratch = np.zeros_like(self.buffer)
+        self.num_poses = 0
+
+    def update(self, result) -> np.ndarray:
+        """Copy this frame's poses into the buffer; returns a (num_poses, 33, 4) view.
+
+        The view is only valid until the next update() - copy anything that
+        has to outlive the frame.
+        """
+        poses = result.pose_landmarks if result is not None else None
+        n = min(len(poses), self.max_poses) if poses is not None else 0
+
+        for p in range(n):
+            pose = poses[p]
+            if isinstance(pose, np.ndarray):
+                np.copyto(self.buffer[p], pose)  # backend already produced an array
+            else:
+                try:
+                    self.buffer[p] = [_xyzv(lm) for lm in pose]
+                except TypeError:
+                    # some landmark sources leave visibility unset
+                    self.buffer[p] = [(lm.x, lm.y, lm.z, lm.visibility or 0.0) for lm in pose]
+
+        self.num_poses = n
+        return self.buffer[:n]
+
+    def mirror(self) -> np.ndarray:
+        """Mirror the current poses horizontally, in place.
+
+        Same landmarks the model would have produced on a flipped frame:
+        x -> 1 - x, and left/right labels swap.
+        """
+        n = self.num_poses
+        scratch = self._scratch[:n]
+        np.take(self.buffer[:n], MIRROR_PERMUTATION, axis=1, out=scratch)
+        np.subtract(1.0, scratch[..., X], out=scratch[..., X])
+        np.copyto(self.buffer[:n], scratch)
+        return self.buffer[:n]
+
+    @property
+    def poses(self) -> np.ndarray:
+        return self.buffer[:self.num_poses]
+
+
+# ============================================================
+# VECTORIZED GEOMETRY
+# ============================================================
+
+def joint_angles(landmarks: np.ndarray, triplets: np.ndarray) -> np.ndarray:
+    """Angles in degrees at b for each (a, b, c) landmark triplet, in one numpy pass.
+
+    `landmarks` is (33, 4) or (N, 33, 4); `triplets` is a (K, 3) int array.
+    Returns (K,) or (N, K).
+    """
+    a = landmarks[..., triplets[:, 0], :2]
+    b = landmarks[..., triplets[:, 1], :2]
+    c = landmarks[..., triplets[:, 2], :2]
+    ba = a - b
+    bc = c - b
+    dot = (ba * bc).sum(-1)
+    norm = np.sqrt((ba * ba).sum(-1) * (bc * bc).sum(-1)) + 1e-6
+    return np.degrees(np.arccos(np.clip(dot / norm, -1.0, 1.0)))
+
+
+def to_pixels(landmarks: np.ndarray, w: int, h: int) -> list:
+    """(33, 4) normalized landmarks -> [[x, y], ...] int pixel coords for cv2 drawing"""
+    return (landmarks[:, :2] * (w, h)).astype(np.int32).tolist()
@@ -0,0 +1,95 @@
+"""
+FormFit Landmark Filter
+One Euro smoothing of a whole (33, 4) landmark array per frame, so angles
+and form checks see steady joints without the analyzers having to vote
+over long frame windows (which delays every cue).
+
+One Euro (Casiez et al.) is a low-pass filter whose cutoff rises with
+speed: still joints are smoothed hard, moving joints follow with little
+lag. Here it runs on all 33 landmarks at once - x, y, z filtered with the
+cutoff driven by each landmark's speed, visibility passed through - with
+per-joint-group parameters (the face barely matters and is noisy, wrists
+move fastest) and the real interval between frames, so probe-rate frames
+from the motion governor or a dropped frame don't skew the filter.
+
+    smoother = LandmarkFilter()
+    landmarks = smoother(poses[0], time.perf_counter())
+
+Only filter one tracked person per instance; reset() when the person is
+lost or detection indices may have changed.
+"""
+
+import numpy as np
+
+from landmark_adapter import NUM_LANDMARKS
+
+# Joint groups: (landmark indices, min_cutoff Hz, beta)
+#   min_cutoff - smoothing when still (lower = steadier, more lag)
+#   beta       - how fast the cutoff opens up with speed (higher = less lag)
+JOINT_GROUPS = {
+    "face":  (range(0, 11), 0.5, 2.0),
+    "torso": ((11, 12, 23, 24), 1.0, 10.0),
+    "arms":  ((13, 14, 15, 16, 17, 18, 19, 20, 21, 22), 1.0, 20.0),
+    "legs":  (range(25, 33), 1.0, 15.0),
+}
+D_CUTOFF = 1.0    # Hz, for the speed estimate itself
+MAX_GAP_S = 0.5   # longer gaps than this restart the filter instead of smoothing across them
+
+
+def group_params(groups=JOINT_GROUPS):
+    """Per-landmark (min_cutoff, beta) arrays shaped (33, 1) from joint groups"""
+    min_cutoff = np.ones((NUM_LANDMARKS, 1), dtype=np.float32)
+    beta = np.zeros((NUM_LANDMARKS, 1), dtype=np.float32)
+    for indices, cutoff, b in groups.values():
+        indices = list(indices)
+        min_cutoff[indices] = cutoff
+        beta[indices] = b
+    return min_cutoff, beta
+
+
+def _alpha(cutoff, dt):
+    """Smoothing factor of a first-order low-pass at `cutoff` Hz over `dt` seconds"""
+    tau = 1.0 / (2.0 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class LandmarkFilter:
+    def __init__(self, groups=JOINT_GROUPS, d_cutoff=D_CUTOFF, max_gap_s=MAX_GAP_S):
+        self.min_cutoff, self.beta = group_params(groups)
+        self.d_cutoff = d_cutoff
+        self.max_gap_s = max_gap_s
+
+        self.out = np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+        self._speed = np.zeros((NUM_LANDMARKS, 3), dtype=np.float32)  # filtered d(xyz)/dt
+        self._delta = np.zeros((NUM_LANDMARKS, 3), dtype=np.float32)
+        self._t = None
+        self.resets = 0
+
+    def reset(self):
+        self._t = None
+
+    def __call__(self, landmarks, t):
+        """Filter one (33, 4) frame taken at `t` seconds; returns the reused output array"""
+        if self._t is None or not 0.0 < t - self._t <= self.max_gap_s:
+            if self._t is not None and t - self._t > self.max_gap_s:
+                self.resets += 1
+            np.copyto(self.out, landmarks)
+            self._speed.fill(0.0)
+            self._t = t
+            return self.out
+        dt = t - self._t
+        self._t = t
+
+        xyz = self.out[:, :3]
+        np.subtract(landmarks[:, :3], xyz, out=self._delta)
+
+        # Speed estimate, low-passed at d_cutoff
+        a_d = _alpha(self.d_cutoff, dt)
+        self._speed += a_d * (self._delta / dt - self._speed)
+
+        # Cutoff per landmark from its speed (normalized units/s), then smooth x, y, z
+        speed = np.sqrt((self._speed * self._speed).sum(axis=1, keepdims=True))
+        a = _alpha(self.min_cutoff + self.beta * speed, dt)
+        xyz += a * self._delta
+        self.out[:, 3] = landmarks[:, 3]
+        return self.out
@@ -0,0 +1,243 @@
+"""
+FormFit Model Assets
+Resolves pose model files from a shared cache (or an offline bundle) and
+prewarms landmarkers so the first user frame doesn't pay for model setup.
+
+Nothing here touches the network at import time. Models are located in order:
+1. FORMFIT_MODEL_BUNDLE  - explicit offline bundle directory (never downloads)
+2. FORMFIT_MODEL_CACHE   - shared cache (default ~/.cache/formfit/models)
+3. current directory     - legacy location used by the old scripts
+and only downloaded into the cache when none of those has it and
+FORMFIT_OFFLINE is not set.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import urllib.request
+
+# ============================================================
+# MODEL MANIFEST
+# ============================================================
+
+MEDIAPIPE_POSE_URL = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/{name}/float16/latest/{name}.task"
+
+# sha256 of None means "pin on first download": the digest is recorded next to
+# the cached file and every later load is verified against it.
+MODELS = {
+    "pose_landmarker_lite": {
+        "filename": "pose_landmarker_lite.task",
+        "url": MEDIAPIPE_POSE_URL.format(name="pose_landmarker_lite"),
+        "sha256": None,
+    },
+    "pose_landmarker_full": {
+        "filename": "pose_landmarker_full.task",
+        "url": MEDIAPIPE_POSE_URL.format(name="pose_landmarker_full"),
+        "sha256": None,
+    },
+    "pose_landmarker_heavy": {
+        "filename": "pose_landmarker_heavy.task",
+        "url": MEDIAPIPE_POSE_URL.format(name="pose_landmarker_heavy"),
+        "sha256": None,
+    },
+    # MoveNet SinglePose Lightning exported to ONNX. There's no canonical
+    # download for the ONNX export, so it has to come from the cache or bundle.
+    "movenet_lightning": {
+        "filename": "movenet_singlepose_lightning.onnx",
+        "url": None,
+        "sha256": None,
+    },
+}
+
+
+class ModelAssetError(RuntimeError):
+    """Raised when a model can't be found, downloaded or verified"""
+
+
+# ============================================================
+# CACHE LOCATION
+# ============================================================
+
+def cache_dir() -> str:
+    """Shared model cache directory (created on demand)"""
+    path = os.environ.get("FORMFIT_MODEL_CACHE")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "models")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def bundle_dir() -> str | None:
+    """Offline bundle directory, if one is configured"""
+    return os.environ.get("FORMFIT_MODEL_BUNDLE") or None
+
+
+def offline() -> bool:
+    return os.environ.get("FORMFIT_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+# ============================================================
+# CHECKSUMS
+# ============================================================
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sidecar(path: str) -> str:
+    return path + ".sha256.json"
+
+
+def _read_sidecar(path: str) -> dict:
+    try:
+        with open(_sidecar(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_sidecar(path: str, sha256: str):
+    st = os.stat(path)
+    try:
+        with open(_sidecar(path), "w") as f:
+            json.dump({"sha256": sha256, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+    except OSError:
+        pass  # read-only bundle - we'll just re-hash next time
+
+
+def verify(path: str, expected: str | None) -> str:
+    """Verify a model file, returning its sha256.
+
+    The sidecar caches the digest for an unchanged (size, mtime) so a warm
+    start doesn't re-hash tens of MB on every launch.
+    """
+    st = os.stat(path)
+    meta = _read_sidecar(path)
+    if meta.get("size") == st.st_size and meta.get("mtime_ns") == st.st_mtime_ns:
+        actual = meta["sha256"]
+    else:
+        actual = _sha256(path)
+        pinned = meta.get("sha256")
+        if expected is None and pinned and pinned != actual:
+            raise ModelAssetError(f"{path} changed since it was cached (sha256 {actual[:12]} != {pinned[:12]})")
+        _write_sidecar(path, actual)
+
+    if expected is not None and actual != expected:
+        raise ModelAssetError(f"{path} failed checksum (sha256 {actual[:12]} != {expected[:12]})")
+    return actual
+
+
+# ============================================================
+# RESOLVE / DOWNLOAD
+# ============================================================
+
+def _download(url: str, dest: str):
+    tmp = dest + ".part"
+    print(f"Downloading {os.path.basename(dest)}...")
+    try:
+        with urllib.request.urlopen(url) as resp, open(tmp, "wb") as f:
+            shutil.copyfileobj(resp, f)
+        os.replace(tmp, dest)  # atomic, so concurrent processes never see half a file
+    except OSError as e:
+        raise ModelAssetError(f"Download of {os.path.basename(dest)} failed: {e}") from e
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print("Download complete!")
+
+
+def ensure_model(name: str, allow_download: bool = True) -> str:
+    """Return a verified local path for a model in MODELS"""
+    if name not in MODELS:
+        raise ModelAssetError(f"Unknown model: {name}")
+    spec = MODELS[name]
+    filename = spec["filename"]
+
+    bundle = bundle_dir()
+    if bundle:
+        path = os.path.join(bundle, filename)
+        if not os.path.exists(path):
+            raise ModelAssetError(f"{filename} missing from offline bundle {bundle}")
+        verify(path, spec["sha256"])
+        return path
+
+    path = os.path.join(cache_dir(), filename)
+    if not os.path.exists(path):
+        if os.path.exists(filename):
+            shutil.copyfile(filename, path)  # adopt a model the old scripts downloaded
+        elif not allow_download or offline() or not spec.get("url"):
+            raise ModelAssetError(
+                f"{filename} not in cache {cache_dir()} - set FORMFIT_MODEL_BUNDLE or allow downloads"
+            )
+        else:
+            _download(spec["url"], path)
+
+    verify(path, spec["sha256"])
+    return path
+
+
+# ============================================================
+# LANDMARKER SETUP + PREWARM
+# ============================================================
+
+def create_landmarker(model_path: str, **option_kwargs):
+    """Build a VIDEO-mode PoseLandmarker (mediapipe imported lazily)"""
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    option_kwargs.setdefault("running_mode", vision.RunningMode.VIDEO)
+    options = vision.PoseLandmarkerOptions(
+        base_options=python.BaseOptions(model_asset_path=model_path),
+        **option_kwargs
+    )
+    return vision.PoseLandmarker.create_from_options(options)
+
+
+def prewarm(landmarker, width: int = 640, height: int = 480):
+    """Run one dummy inference so graph init happens before the first real frame.
+
+    Uses timestamp 0; real frames start at 1 so VIDEO mode stays monotonic.
+    """
+    import numpy as np
+    import mediapipe as mp
+
+    blank = np.zeros((height, width, 3), dtype=np.uint8)
+    landmarker.detect_for_video(mp.Image(image_format=mp.ImageFormat.SRGB, data=blank), 0)
+
+
+# ============================================================
+# STARTUP TIMING
+# ============================================================
+
+_PROCESS_T0 = time.perf_counter()  # as close to interpreter start as we can get cheaply
+
+
+class StartupTimer:
+    """Records cold-start milestones and time-to-first-feedback"""
+
+    def __init__(self, t0: float | None = None):
+        self.t0 = _PROCESS_T0 if t0 is None else t0
+        self.marks = []
+        self.first_feedback_ms = None
+
+    def mark(self, name: str):
+        self.marks.append((name, (time.perf_counter() - self.t0) * 1000))
+
+    def first_feedback(self):
+        """Call when the first analysis result reaches the user (only the first call counts)"""
+        if self.first_feedback_ms is None:
+            self.first_feedback_ms = (time.perf_counter() - self.t0) * 1000
+            self.report()
+
+    def report(self):
+        parts = [f"{name} {ms:.0f}ms" for name, ms in self.marks]
+        if self.first_feedback_ms is not None:
+            parts.append(f"first feedback {self.first_feedback_ms:.0f}ms")
+        print("Startup: " + " | ".join(parts))
@@ -0,0 +1,126 @@
+"""
+FormFit Motion Governor
+Decides per frame whether full pose inference is worth running.
+
+A tiny grayscale thumbnail is diffed against the previous one (tens of
+microseconds); when the scene is static or nobody is in frame the governor
+drops to a low probe rate, and the first frame with motion goes straight
+back to full rate. The last landmarks tell "resting between sets" apart
+from "moving", which is what drives WorkoutState.is_moving.
+"""
+
+import numpy as np
+
+ACTIVE = "ACTIVE"   # person moving - infer every frame
+IDLE = "IDLE"       # person in frame but still - probe
+EMPTY = "EMPTY"     # nobody in frame - probe
+
+# Joints used for landmark motion: shoulders, elbows, wrists, hips, knees, ankles
+MOTION_JOINTS = [11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28]
+
+
+class MotionGovernor:
+    def __init__(self, probe_interval=10, pixel_threshold=3.0, landmark_threshold=0.008,
+                 still_frames=15, thumb_size=(64, 36)):
+        self.probe_interval = probe_interval        # frames between inferences when idle/empty
+        self.pixel_threshold = pixel_threshold      # mean abs thumbnail diff (0-255) counted as motion
+        self.landmark_threshold = landmark_threshold  # mean joint displacement (normalized) counted as moving
+        self.still_frames = still_frames            # consecutive still frames before going idle
+        self.thumb_size = thumb_size
+
+        self.state = ACTIVE
+        self.is_moving = False
+        self.motion_score = 0.0
+
+        self._thumb_bgr = None
+        self._thumbs = None     # two gray thumbnails, swapped each frame
+        self._diff = None
+        self._still = 0
+        self._since_infer = 0
+        self._last_joints = None
+        self._observed_at = 0
+
+        self.frames = 0
+        self.inferences = 0
+
+    # ---------------- pixel path ----------------
+
+    def _thumbnail_diff(self, frame):
+        import cv2
+
+        w, h = self.thumb_size
+        if self._thumbs is None:
+            self._thumb_bgr = np.empty((h, w, 3), dtype=np.uint8)
+            self._thumbs = [np.empty((h, w), dtype=np.uint8), np.empty((h, w), dtype=np.uint8)]
+            self._diff = np.empty((h, w), dtype=np.uint8)
+            cv2.resize(frame, (w, h), dst=self._thumb_bgr, interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(self._thumb_bgr, cv2.COLOR_BGR2GRAY, dst=self._thumbs[1])
+            return float("inf")  # first frame always counts as motion
+
+        # INTER_LINEAR only samples a few source pixels per output pixel (~25us
+        # at 720p); INTER_AREA is smoother but reads the whole frame (~1ms).
+        cur, prev = self._thumbs[0], self._thumbs[1]
+        cv2.resize(frame, (w, h), dst=self._thumb_bgr, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self._thumb_bgr, cv2.COLOR_BGR2GRAY, dst=cur)
+        cv2.absdiff(cur, prev, dst=self._diff)
+        self._thumbs.reverse()
+        return cv2.mean(self._diff)[0]
+
+    def should_infer(self, frame) -> bool:
+        """Call once per captured frame, before inference"""
+        self.frames += 1
+        self.motion_score = self._thumbnail_diff(frame)
+
+        if self.motion_score > self.pixel_threshold:
+            self._still = 0
+            if self.state != ACTIVE:
+                self.state = ACTIVE  # motion resumed - back to full rate on this frame
+        else:
+            self._still += 1
+            if self.state == ACTIVE and self._still >= self.still_frames:
+                self.state = IDLE if self._last_joints is not None else EMPTY
+
+        run = self.state == ACTIVE or self._since_infer + 1 >= self.probe_interval
+        if run:
+            self._since_infer = 0
+            self.inferences += 1
+        else:
+            self._since_infer += 1
+        return run
+
+    # ---------------- landmark path ----------------
+
+    def observe(self, pose_landmarks):
+        """Feed the first pose's landmarks after inference (None / empty = nobody in frame).
+
+        Accepts the (33, 4) LandmarkAdapter array, or any (33, >=2) x/y sequence.
+        """
+        if pose_landmarks is None or len(pose_landmarks) == 0:
+            self._last_joints = None
+            self.is_moving = False
+            if self.state == IDLE:
+                self.state = EMPTY
+            return
+
+        joints = np.asarray(pose_landmarks, dtype=np.float32)[MOTION_JOINTS, :2]
+
+        if self._last_joints is not None:
+            # Per-frame displacement, so probing every N frames doesn't look like fast motion
+            elapsed = max(1, self.frames - self._observed_at)
+            displacement = float(np.abs(joints - self._last_joints).mean()) / elapsed
+            self.is_moving = displacement > self.landmark_threshold
+            np.copyto(self._last_joints, joints)
+        else:
+            self._last_joints = joints  # fancy indexing above already made a copy
+        self._observed_at = self.frames
+        if self.state == EMPTY:
+            self.state = IDLE  # someone walked in; pixel motion decides if we go ACTIVE
+
+    def stats(self) -> dict:
+        skipped = self.frames - self.inferences
+        return {
+            "state": self.state,
+            "frames": self.frames,
+            "inferences": self.inferences,
+            "skipped_pct": 100.0 * skipped / self.frames if self.frames else 0.0,
+        }
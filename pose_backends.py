@@ -0,0 +1,389 @@
+"""
+FormFit Pose Backends
+One interface over MediaPipe lite/full/heavy and a CPU ONNX model, plus an
+on-device calibration benchmark that picks the most accurate backend still
+meeting the host's FPS / latency budget. The choice is cached per machine.
+
+Every backend's detect() returns an object with a MediaPipe-style
+`pose_landmarks` list; LandmarkAdapter turns either kind into one array,
+so the analyzers don't care which backend is running.
+
+Calibration times each backend on a frame from the camera, so pass the
+opened capture to select_backend(camera=cap). MediaPipe skips its landmark
+stage when nobody is detected, so an empty frame makes every variant look
+fast. If no backend finds a person in the frame, the pick is provisional: the
+fastest backend is used and nothing is cached, and the next run calibrates
+again.
+
+Env overrides:
+    FORMFIT_POSE_BACKEND       - force a backend by name (skips calibration)
+    FORMFIT_RECALIBRATE        - ignore the cached choice and re-run the benchmark
+    FORMFIT_MOVENET_MIN_SCORE  - mean keypoint score below which MoveNet reports no one (default 0.25)
+"""
+
+import json
+import os
+import platform
+import socket
+import time
+from collections import namedtuple
+
+import model_assets
+
+# Non-MediaPipe backends return each pose as a (33, 4) x/y/z/visibility array,
+# which LandmarkAdapter copies without any per-landmark work.
+PoseResult = namedtuple("PoseResult", ["pose_landmarks"])
+
+NUM_LANDMARKS = 33
+
+
+# ============================================================
+# BACKEND INTERFACE
+# ============================================================
+
+class PoseBackend:
+    """Base class - subclasses implement load/detect/close"""
+
+    name = ""
+    model = ""
+    accuracy_rank = 0  # higher = more accurate; calibration prefers higher
+    max_poses = 1      # people per frame the model can detect
+
+    def available(self) -> bool:
+        """Whether the runtime and model can be loaded without the network"""
+        try:
+            model_assets.ensure_model(self.model, allow_download=False)
+            return True
+        except model_assets.ModelAssetError:
+            return False
+
+    def load(self, width: int = 640, height: int = 480, allow_download: bool = True):
+        raise NotImplementedError
+
+    def detect(self, rgb_frame, timestamp_ms: int):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MediaPipeBackend(PoseBackend):
+    """MediaPipe PoseLandmarker in VIDEO mode (lite / full / heavy)"""
+
+    RANKS = {"lite": 1, "full": 2, "heavy": 3}
+
+    def __init__(self, variant: str = "lite", num_poses: int = 1, **option_kwargs):
+        self.variant = variant
+        self.name = f"mediapipe_{variant}"
+        self.model = f"pose_landmarker_{variant}"
+        self.accuracy_rank = self.RANKS[variant]
+        self.max_poses = num_poses
+        self.option_kwargs = dict(option_kwargs, num_poses=num_poses)
+        self.landmarker = None
+
+    def load(self, width=640, height=480, allow_download=True):
+        model_path = model_assets.ensure_model(self.model, allow_download=allow_download)
+        self.landmarker = model_assets.create_landmarker(model_path, **self.option_kwargs)
+        model_assets.prewarm(self.landmarker, width, height)
+        return self
+
+    def detect(self, rgb_frame, timestamp_ms):
+        import mediapipe as mp
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
+        return self.landmarker.detect_for_video(mp_image, timestamp_ms)
+
+    def close(self):
+        if self.landmarker is not None:
+            self.landmarker.close()
+            self.landmarker = None
+
+
+# COCO-17 keypoint order (MoveNet) -> MediaPipe 33-landmark index
+COCO_TO_MEDIAPIPE = [0, 2, 5, 7, 8, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28]
+
+# MediaPipe landmarks MoveNet doesn't predict -> the predicted one they sit
+# next to (eye corners -> eye, mouth -> nose, hand -> wrist, foot -> ankle)
+UNMAPPED_ANCHORS = {1: 2, 3: 2, 4: 5, 6: 5, 9: 0, 10: 0,
+                    17: 15, 19: 15, 21: 15, 18: 16, 20: 16, 22: 16,
+                    29: 27, 31: 27, 30: 28, 32: 28}
+
+MOVENET_MIN_SCORE = float(os.environ.get("FORMFIT_MOVENET_MIN_SCORE", "0.25"))
+
+
+class OnnxMoveNetBackend(PoseBackend):
+    """MoveNet SinglePose on onnxruntime's CPU provider.
+
+    SinglePose always outputs one set of keypoints, even for an empty
+    room; a frame whose mean keypoint score is under MOVENET_MIN_SCORE
+    returns no pose. MoveNet only predicts 17 keypoints; the MediaPipe-only
+    ones (hands, feet, eye corners) sit on their neighbouring keypoint with
+    visibility 0.
+    """
+
+    name = "onnx_movenet_lightning"
+    model = "movenet_lightning"
+    accuracy_rank = 0
+
+    def __init__(self, num_threads: int = 0, min_score: float = MOVENET_MIN_SCORE):
+        self.num_threads = num_threads
+        self.min_score = min_score
+        self.session = None
+
+    def available(self):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            return False
+        return super().available()
+
+    def load(self, width=640, height=480, allow_download=True):
+        import numpy as np
+        import onnxruntime as ort
+
+        model_path = model_assets.ensure_model(self.model, allow_download=allow_download)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.num_threads
+        self.session = ort.InferenceSession(model_path, opts, providers=["CPUExecutionProvider"])
+
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        size = inp.shape[1] if isinstance(inp.shape[1], int) else 192
+        self.input_size = size
+        self.input_dtype = np.int32 if "int32" in inp.type else np.float32
+        self._pose = np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+        self._unmapped = np.array(list(UNMAPPED_ANCHORS))
+        self._anchors = np.array(list(UNMAPPED_ANCHORS.values()))
+        self.detect(np.zeros((height, width, 3), dtype=np.uint8), 0)  # prewarm
+        return self
+
+    def detect(self, rgb_frame, timestamp_ms):
+        import cv2
+        import numpy as np
+
+        resized = cv2.resize(rgb_frame, (self.input_size, self.input_size))
+        tensor = resized[np.newaxis].astype(self.input_dtype)
+        keypoints = self.session.run(None, {self.input_name: tensor})[0].reshape(17, 3)
+
+        if keypoints[:, 2].mean() < self.min_score:
+            return PoseResult([])
+
+        pose = self._pose
+        pose[COCO_TO_MEDIAPIPE, 0] = keypoints[:, 1]
+        pose[COCO_TO_MEDIAPIPE, 1] = keypoints[:, 0]
+        pose[COCO_TO_MEDIAPIPE, 3] = keypoints[:, 2]
+        pose[self._unmapped, :2] = pose[self._anchors, :2]
+        pose[self._unmapped, 3] = 0.0
+        return PoseResult([pose])
+
+    def close(self):
+        self.session = None
+
+
+def all_backends(num_poses: int = 1) -> list:
+    """Every backend that can detect num_poses people, least to most accurate"""
+    backends = [
+        OnnxMoveNetBackend(),
+        MediaPipeBackend("lite", num_poses),
+        MediaPipeBackend("full", num_poses),
+        MediaPipeBackend("heavy", num_poses),
+    ]
+    return [b for b in backends if b.max_poses >= num_poses]
+
+
+def get_backend(name: str, num_poses: int = 1) -> PoseBackend:
+    for backend in all_backends(num_poses):
+        if backend.name == name:
+            return backend
+    raise ValueError(f"Unknown pose backend for {num_poses} people: {name}")
+
+
+# ============================================================
+# CALIBRATION BENCHMARK
+# ============================================================
+
+TARGET_FPS = 25
+LATENCY_BUDGET_MS = 40
+CALIBRATION_FRAMES = 30
+CAMERA_WARMUP_FRAMES = 10  # the first frames of many webcams are dark
+
+
+def camera_frame(camera, warmup: int = CAMERA_WARMUP_FRAMES):
+    """An RGB frame from an opened cv2.VideoCapture to calibrate on; None if it gives none"""
+    import cv2
+
+    frame = None
+    for _ in range(warmup):
+        ok, bgr = camera.read()
+        if ok:
+            frame = bgr
+    return None if frame is None else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def benchmark(backend: PoseBackend, frames: int = CALIBRATION_FRAMES, width: int = 640,
+              height: int = 480, sample_frame=None) -> dict:
+    """Time detect() on this host. Returns mean/p95 latency, fps and whether a person was found.
+
+    The timings only mean something when `sample_frame` shows a person
+    ("person" True): without one, MediaPipe never runs its landmark stage.
+    With no frame, a blank one is used, which has nobody in it.
+    """
+    import numpy as np
+
+    if sample_frame is None:
+        sample_frame = np.zeros((height, width, 3), dtype=np.uint8)
+    h, w = sample_frame.shape[:2]
+
+    backend.load(w, h, allow_download=False)
+    try:
+        timings = []
+        found = 0
+        for i in range(frames):
+            t0 = time.perf_counter()
+            result = backend.detect(sample_frame, i + 1)
+            timings.append((time.perf_counter() - t0) * 1000)
+            found += bool(result.pose_landmarks)
+    finally:
+        backend.close()
+
+    timings = np.array(timings)
+    mean_ms = float(timings.mean())
+    return {
+        "mean_ms": round(mean_ms, 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        "fps": round(1000 / mean_ms, 1) if mean_ms > 0 else float("inf"),
+        "person": found * 2 >= frames,
+    }
+
+
+def calibrate(target_fps: float = TARGET_FPS, latency_budget_ms: float = LATENCY_BUDGET_MS,
+              sample_frame=None, num_poses: int = 1) -> dict:
+    """Benchmark the backends this machine can run and pick one.
+
+    Picks the most accurate backend meeting both the FPS target and the p95
+    latency budget; if none does, falls back to the fastest one measured.
+    MediaPipe variants go least to most accurate, each model downloaded (unless
+    offline) just before it is measured, and stop at the first that misses
+    the budget - a heavier one won't be faster. Nothing more is downloaded
+    once a backend has measured a frame without a person.
+
+    Without a person in `sample_frame` the timings are meaningless: the
+    result is "provisional" and picks the least accurate backend measured.
+    """
+    results = {}
+    for backend in all_backends(num_poses):
+        if isinstance(backend, MediaPipeBackend):
+            # No person so far: the timings can't rank models, so don't fetch more
+            fetch = not results or any(r["person"] for r in results.values())
+            try:
+                model_assets.ensure_model(backend.model, allow_download=fetch)
+            except model_assets.ModelAssetError as e:
+                print(f"Skipping {backend.name}: {e}")
+                continue
+        elif not backend.available():
+            continue
+        r = results[backend.name] = dict(benchmark(backend, sample_frame=sample_frame),
+                                         accuracy_rank=backend.accuracy_rank)
+        print(f"  {backend.name:24} {r['mean_ms']:6.1f}ms "
+              f"p95 {r['p95_ms']:6.1f}ms  {r['fps']:5.1f} fps{'' if r['person'] else '  (no person)'}")
+        r["passed"] = r["fps"] >= target_fps and r["p95_ms"] <= latency_budget_ms
+        if isinstance(backend, MediaPipeBackend) and r["person"] and not r["passed"]:
+            break
+
+    if not results:
+        raise model_assets.ModelAssetError("No pose backend available - add a model to the cache or bundle")
+
+    provisional = not any(r["person"] for r in results.values())
+    passing = [name for name, r in results.items() if r["passed"] and r["person"]]
+    if provisional:
+        chosen = min(results, key=lambda n: results[n]["accuracy_rank"])
+    elif passing:
+        chosen = max(passing, key=lambda n: results[n]["accuracy_rank"])
+    else:
+        chosen = min(results, key=lambda n: results[n]["mean_ms"])
+
+    return {"backend": chosen, "target_fps": target_fps,
+            "latency_budget_ms": latency_budget_ms, "results": results,
+            "provisional": provisional, "calibrated_at": time.time()}
+
+
+# ============================================================
+# PER-MACHINE SELECTION CACHE
+# ============================================================
+
+def machine_key() -> str:
+    """Identifies this host's hardware for the selection cache"""
+    return "|".join([socket.gethostname(), platform.system(), platform.machine(),
+                     platform.processor() or "?", str(os.cpu_count())])
+
+
+def _selection_path() -> str:
+    return os.path.join(model_assets.cache_dir(), "backend_selection.json")
+
+
+def _load_selections() -> dict:
+    try:
+        with open(_selection_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def select_backend(target_fps: float = TARGET_FPS, latency_budget_ms: float = LATENCY_BUDGET_MS,
+                   sample_frame=None, num_poses: int = 1, camera=None) -> PoseBackend:
+    """Return the (unloaded) backend for this machine, calibrating on first run.
+
+    Calibration measures `sample_frame`, or else a frame read from `camera`
+    (an opened cv2.VideoCapture) - step into view before the first run.
+    """
+    forced = os.environ.get("FORMFIT_POSE_BACKEND")
+    if forced:
+        return get_backend(forced, num_poses)
+
+    selections = _load_selections()
+    key = f"{machine_key()}|{target_fps}|{latency_budget_ms}"
+    if num_poses > 1:
+        key += f"|{num_poses}p"
+    cached = selections.get(key)
+    recalibrate = os.environ.get("FORMFIT_RECALIBRATE", "").lower() in ("1", "true", "yes")
+
+    if cached and not recalibrate:
+        backend = get_backend(cached["backend"], num_poses)
+        if backend.available():
+            return backend
+
+    if sample_frame is None and camera is not None:
+        sample_frame = camera_frame(camera)
+
+    print("Calibrating pose backends for this machine...")
+    selection = calibrate(target_fps, latency_budget_ms, sample_frame, num_poses)
+    if selection["provisional"]:
+        print(f"No person in the calibration frame - using {selection['backend']} for now, "
+              f"calibrating again next run")
+        return get_backend(selection["backend"], num_poses)
+    print(f"Selected pose backend: {selection['backend']}")
+
+    selections[key] = selection
+    tmp = _selection_path() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(selections, f, indent=2)
+    os.replace(tmp, _selection_path())
+
+    return get_backend(selection["backend"], num_poses)
+
+
+if __name__ == "__main__":
+    # python pose_backends.py  -> re-run calibration for this machine (stand in view of the camera)
+    import cv2
+
+    os.environ["FORMFIT_RECALIBRATE"] = "1"
+    cap = cv2.VideoCapture(0)
+    try:
+        print(select_backend(camera=cap).name)
+    finally:
+        cap.release()
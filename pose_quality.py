@@ -0,0 +1,125 @@
+"""
+FormFit Pose Quality Gate
+Skips angle and form evaluation on frames where the joints the current
+exercise uses can't be trusted - low visibility, or outside the picture
+(wrists above the top edge during a press are "detected" at the border and
+turn into false "Stack wrists over elbows" cues).
+
+Only the exercise's own landmarks are checked (AnglePlan.landmarks, or the
+analyzer's triplets), one gather and a short loop, ~4us. A rejected
+frame keeps the last good analysis; after REPOSITION_FRAMES rejected frames
+in a row the status turns to "reposition" (with a hint naming the joint
+that failed most), and the first good frame turns it back.
+
+The landmark arrays carry visibility only, so presence is judged from
+position: a joint more than FRAME_MARGIN outside the normalized [0, 1]
+frame counts as not present.
+
+    FORMFIT_MIN_VISIBILITY   visibility a joint needs (default 0.5; MoveNet's
+                             keypoint scores run lower - try 0.3)
+"""
+
+import os
+
+import numpy as np
+
+from landmark_adapter import NUM_LANDMARKS, VIS
+
+MIN_VISIBILITY = float(os.environ.get("FORMFIT_MIN_VISIBILITY", "0.5"))
+FRAME_MARGIN = 0.1       # normalized units a joint may sit outside the frame (models extrapolate a little)
+REPOSITION_FRAMES = 6    # consecutive rejected frames (~0.2s) before "reposition"
+
+OK = "ok"
+REPOSITION = "reposition"
+
+JOINT_NAMES = {
+    0: "nose", 11: "left shoulder", 12: "right shoulder", 13: "left elbow", 14: "right elbow",
+    15: "left wrist", 16: "right wrist", 23: "left hip", 24: "right hip", 25: "left knee",
+    26: "right knee", 27: "left ankle", 28: "right ankle",
+}
+
+
+class QualityGate:
+    def __init__(self, joints=(), min_visibility=MIN_VISIBILITY, margin=FRAME_MARGIN,
+                 reposition_frames=REPOSITION_FRAMES):
+        self.min_visibility = min_visibility
+        self.margin = margin
+        self.reposition_frames = reposition_frames
+        self.status = OK
+        self.changed = False    # status flipped on the last check()
+        self._bad_streak = 0
+
+        self.frames = 0
+        self.rejected = 0
+        self.repositions = 0
+        self.joint_failures = np.zeros(NUM_LANDMARKS, dtype=np.int64)
+        self._streak_failures = np.zeros(NUM_LANDMARKS, dtype=np.int64)  # since the last good frame
+        self.set_joints(joints)
+
+    def set_joints(self, joints):
+        """Landmark indices to check - call when the exercise changes"""
+        self.joints = np.unique(np.asarray(joints, dtype=np.intp))
+        self._bad_streak = 0
+        self._streak_failures[:] = 0
+
+    def check(self, landmarks) -> bool:
+        """True if the frame is good enough to analyse; updates status and counters"""
+        self.frames += 1
+        previous = self.status
+        # A dozen rows: plain Python over tolist() beats numpy's per-call overhead
+        lo, hi, min_vis = -self.margin, 1.0 + self.margin, self.min_visibility
+        good = True
+        for x, y, _, v in landmarks[self.joints].tolist():
+            if not (v >= min_vis and lo <= x <= hi and lo <= y <= hi):
+                good = False
+                break
+        if good:
+            if self._bad_streak:
+                self._bad_streak = 0
+                self._streak_failures[:] = 0
+            self.status = OK
+        else:
+            self.rejected += 1
+            self._bad_streak += 1
+            points = landmarks[self.joints]
+            failed = ~((points[:, VIS] >= min_vis) & ((points[:, :2] >= lo) & (points[:, :2] <= hi)).all(axis=1))
+            self.joint_failures[self.joints[failed]] += 1
+            self._streak_failures[self.joints[failed]] += 1
+            if self._bad_streak >= self.reposition_frames:
+                self.status = REPOSITION
+        self.changed = self.status != previous
+        if self.changed and self.status == REPOSITION:
+            self.repositions += 1
+        return good
+
+    def reset(self):
+        """Nobody in frame: nothing to judge"""
+        self._bad_streak = 0
+        self._streak_failures[:] = 0
+        self.changed = self.status != OK
+        self.status = OK
+
+    def worst_joint(self, recent=False):
+        """Name of the checked joint rejected most often (in the current bad streak), or None"""
+        failures = (self._streak_failures if recent else self.joint_failures)[self.joints]
+        if not failures.any():
+            return None
+        joint = int(self.joints[failures.argmax()])
+        return JOINT_NAMES.get(joint, f"landmark {joint}")
+
+    def hint(self) -> str:
+        """What to tell the user while the status is "reposition" ("" otherwise)"""
+        if self.status != REPOSITION:
+            return ""
+        joint = self.worst_joint(recent=True)
+        return f"Reposition - {joint} not visible" if joint else "Reposition - step into view"
+
+    def stats(self) -> dict:
+        return {
+            "status": self.status,
+            "frames": self.frames,
+            "rejected": self.rejected,
+            "rejected_pct": round(100 * self.rejected / max(1, self.frames), 1),
+            "repositions": self.repositions,
+            "worst_joint": self.worst_joint(),
+        }
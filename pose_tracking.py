@@ -0,0 +1,159 @@
+"""
+FormFit Multi-Person Tracking
+Stable person IDs across frames (greedy IoU matching on landmark bounding
+boxes) and per-person rep / phase / feedback state, with everyone's form
+analysis done in one batched call.
+"""
+
+import itertools
+import time
+
+import numpy as np
+
+from form_analysis import angle_plan, batch_angles, batch_check_form
+from landmark_adapter import VIS
+from rep_metrics import RepTracker, has_reps
+
+MIN_VISIBILITY = 0.5
+
+
+def pose_boxes(poses):
+    """(N, 33, 4) -> (N, 4) x1, y1, x2, y2 boxes over reasonably visible landmarks"""
+    xy = poses[..., :2]
+    visible = poses[..., VIS:VIS + 1] >= MIN_VISIBILITY
+    # Poses with nothing visible fall back to all landmarks
+    visible |= ~visible.any(axis=1, keepdims=True)
+    lo = np.where(visible, xy, np.inf).min(axis=1)
+    hi = np.where(visible, xy, -np.inf).max(axis=1)
+    return np.concatenate([lo, hi], axis=1)
+
+
+def iou_matrix(a, b):
+    """(T, 4) x (N, 4) boxes -> (T, N) IoU"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+class PersonState:
+    """Rep, phase and feedback state for one tracked person.
+
+    Reps are counted by a rep_metrics.RepTracker on the exercise's driver
+    joints (leave the start band, reach REACH of the way, come back), not
+    by phase flips - the classified phase jitters at its boundaries with
+    unsmoothed group landmarks and would count every flicker.
+    """
+
+    def __init__(self, person_id):
+        self.person_id = person_id
+        self.reps = 0
+        self.phase = None
+        self.accuracy = 0.0
+        self.feedback = []
+        self.rep_tracker = None  # for the exercise of the last update()
+
+    def reset(self):
+        self.reps = 0
+        self.phase = None
+        self.rep_tracker = None
+
+    def update(self, exercise_key, accuracy, feedback, phase, angles=None, now=None):
+        """One frame; `angles` is the person's batch_angles() row (needed to count reps)"""
+        if self.rep_tracker is None or self.rep_tracker.exercise_key != exercise_key:
+            self.rep_tracker = RepTracker(exercise_key) if has_reps(exercise_key) else None
+        if self.rep_tracker is not None and angles is not None:
+            axis = self.rep_tracker.axis
+            left, right = float(angles[axis.left_col]), float(angles[axis.right_col])
+            if left == left and right == right:  # not NaN
+                if self.rep_tracker.update_pair(left, right, time.monotonic() if now is None else now):
+                    self.reps += 1
+        self.phase = phase
+        self.accuracy = accuracy
+        self.feedback = feedback
+
+
+class Track:
+    def __init__(self, person_id, box):
+        self.person_id = person_id
+        self.box = box
+        self.missed = 0
+        self.pose_index = -1  # row in this frame's poses, -1 when unmatched
+        self.state = PersonState(person_id)
+
+
+class PoseTracker:
+    """Greedy IoU matcher - cheap and good enough for a handful of people"""
+
+    def __init__(self, iou_threshold=0.3, max_missed=15):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed  # frames a track survives without a match
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, poses):
+        """Match this frame's poses to tracks; returns tracks matched this frame"""
+        boxes = pose_boxes(poses) if len(poses) else np.zeros((0, 4))
+        for track in self.tracks:
+            track.pose_index = -1
+
+        unmatched = set(range(len(boxes)))
+        if self.tracks and len(boxes):
+            iou = iou_matrix(np.array([t.box for t in self.tracks]), boxes)
+            # Best pairs first; each track and each pose used once
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                t, p = divmod(int(flat), len(boxes))
+                if iou[t, p] < self.iou_threshold:
+                    break
+                track = self.tracks[t]
+                if track.pose_index == -1 and p in unmatched:
+                    track.pose_index = p
+                    track.box = boxes[p]
+                    track.missed = 0
+                    unmatched.discard(p)
+
+        for track in self.tracks:
+            if track.pose_index == -1:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        for p in sorted(unmatched):
+            track = Track(next(self._ids), boxes[p])
+            track.pose_index = p
+            self.tracks.append(track)
+
+        return [t for t in self.tracks if t.pose_index >= 0]
+
+
+class GroupCoach:
+    """Tracking + batched form analysis for everyone in frame"""
+
+    def __init__(self, **tracker_kwargs):
+        self.tracker = PoseTracker(**tracker_kwargs)
+        self._plan_key, self._plan = None, None
+
+    def reset(self):
+        """Call when the exercise changes"""
+        for track in self.tracker.tracks:
+            track.state.reset()
+
+    def update(self, exercise_key, poses, now=None):
+        """Track and analyse this frame's (N, 33, 4) poses; `now` in seconds (default monotonic clock)"""
+        tracks = self.tracker.update(poses)
+        if not tracks:
+            return []
+
+        # Only the angles this exercise's checks read; re-planned when it changes
+        if exercise_key != self._plan_key:
+            self._plan_key, self._plan = exercise_key, angle_plan(exercise_key)
+        angles = batch_angles(poses, self._plan)
+        accuracy, feedback, phases = batch_check_form(exercise_key, angles)
+        now = time.monotonic() if now is None else now
+        for track in tracks:
+            i = track.pose_index
+            track.state.update(exercise_key, float(accuracy[i]), feedback[i], phases[i], angles[i], now)
+        return tracks
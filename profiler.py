@@ -0,0 +1,260 @@
+"""
+FormFit Profiler
+Per-stage timings for the analyzer loops and the agent, for "the coach is
+laggy on this machine" reports.
+
+    python .vscode/stream.py --profile
+    python .vscode/stream.py --profile --profile-out=trace.json            # Chrome trace / Perfetto
+    python .vscode/stream.py --profile --profile-out=run.speedscope.json   # speedscope
+    python agent.py dev --profile --profile-sampler                        # + py-spy (or cProfile)
+
+Spans go into a fixed-size ring buffer (perf_counter_ns, no allocation per
+span beyond the int writes); percentiles per stage are printed on exit.
+FORMFIT_PROFILE=1 does the same as --profile and is inherited by the
+agent's job processes ("{pid}" in --profile-out is replaced per process).
+
+Two ways to record:
+- laps: frame_start() at the top of a loop iteration, lap("stage") after
+  each stage - the time since the previous mark goes to that stage, so
+  stages don't need re-indenting;
+- spans: `with prof.span("stage"):` for code that isn't a frame loop.
+
+When profiling is off, from_argv() returns a NullProfiler whose methods do
+nothing (one no-op call per mark, ~0.1us; ~1us per mark when on).
+
+speedscope's evented format needs properly nested spans - fine for the
+analyzer loops; for the agent (overlapping async spans across sessions)
+export a Chrome trace instead.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+FLAG = "--profile"
+OUT_FLAG = "--profile-out="
+SAMPLER_FLAG = "--profile-sampler"
+
+
+class NullProfiler:
+    enabled = False
+
+    def frame_start(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def span(self, name):
+        return contextlib.nullcontext()
+
+    def report(self):
+        pass
+
+
+class _Span:
+    __slots__ = ("profiler", "stage", "start")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.stage, self.start, time.perf_counter_ns() - self.start)
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, capacity=1 << 18, out=None):
+        self.capacity = capacity
+        self.out = out
+        self._stage = np.zeros(capacity, dtype=np.int16)
+        self._start = np.zeros(capacity, dtype=np.int64)
+        self._dur = np.zeros(capacity, dtype=np.int64)
+        self._count = 0
+        self._names = []
+        self._ids = {}
+        self._frame_at = None
+        self._mark = None
+        self._origin = time.perf_counter_ns()
+
+    def _id(self, name):
+        stage = self._ids.get(name)
+        if stage is None:
+            stage = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return stage
+
+    def _record(self, stage, start, dur):
+        i = self._count % self.capacity
+        self._stage[i] = stage
+        self._start[i] = start
+        self._dur[i] = dur
+        self._count += 1
+
+    # ---------------- recording ----------------
+
+    def frame_start(self):
+        now = time.perf_counter_ns()
+        if self._frame_at is not None:
+            self._record(self._id("frame"), self._frame_at, now - self._frame_at)
+        self._frame_at = self._mark = now
+
+    def lap(self, name):
+        now = time.perf_counter_ns()
+        if self._mark is not None:
+            self._record(self._id(name), self._mark, now - self._mark)
+        self._mark = now
+
+    def span(self, name):
+        return _Span(self, self._id(name))
+
+    # ---------------- results ----------------
+
+    def _events(self):
+        """Recorded (stage, start_ns, dur_ns), oldest first"""
+        n = min(self._count, self.capacity)
+        order = np.arange(self._count - n, self._count) % self.capacity
+        return self._stage[order], self._start[order], self._dur[order]
+
+    def summary(self) -> dict:
+        stages, _, durs = self._events()
+        frame_id = self._ids.get("frame")
+        frame_total = durs[stages == frame_id].sum() if frame_id is not None else 0
+        out = {}
+        for stage, name in enumerate(self._names):
+            d = durs[stages == stage] / 1e6
+            if not len(d):
+                continue
+            p50, p95, p99 = np.percentile(d, [50, 95, 99])
+            out[name] = {"count": len(d), "mean_ms": d.mean(), "p50_ms": p50, "p95_ms": p95,
+                         "p99_ms": p99, "max_ms": d.max(),
+                         "share": d.sum() * 1e6 / frame_total if frame_total and name != "frame" else None}
+        return out
+
+    def report(self):
+        summary = self.summary()
+        if not summary:
+            return
+        dropped = max(0, self._count - self.capacity)
+        print(f"\nProfile ({min(self._count, self.capacity)} spans{f', {dropped} oldest dropped' if dropped else ''}):")
+        print(f"  {'stage':<16}{'count':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  of frame")
+        for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["mean_ms"] * kv[1]["count"]):
+            share = f"{100 * s['share']:5.1f}%" if s["share"] is not None else ""
+            print(f"  {name:<16}{s['count']:>8}{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+                  f"{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}  {share}")
+        if self.out:
+            self.export(self.out)
+
+    def export(self, path):
+        if path.endswith(".speedscope.json"):
+            data = self._speedscope()
+        else:
+            data = self._chrome_trace()
+        with open(path, "w") as f:
+            json.dump(data, f)
+        print(f"Profile written to {path}")
+
+    def _chrome_trace(self):
+        stages, starts, durs = self._events()
+        pid = os.getpid()
+        return {"traceEvents": [
+            {"name": self._names[s], "ph": "X", "pid": pid, "tid": 0,
+             "ts": (int(t) - self._origin) / 1000, "dur": int(d) / 1000}
+            for s, t, d in zip(stages.tolist(), starts.tolist(), durs.tolist())
+        ]}
+
+    def _speedscope(self):
+        stages, starts, durs = self._events()
+        # Open/close events, parents (longer spans) open first and close last
+        events = []
+        for s, t, d in zip(stages.tolist(), starts.tolist(), durs.tolist()):
+            events.append((t, 1, -d, "O", s))
+            events.append((t + d, 0, d, "C", s))
+        events.sort()
+        origin = events[0][0] if events else 0
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": n} for n in self._names]},
+            "profiles": [{
+                "type": "evented", "name": "formfit", "unit": "nanoseconds",
+                "startValue": 0, "endValue": (events[-1][0] - origin) if events else 0,
+                "events": [{"type": kind, "frame": s, "at": t - origin} for t, _, _, kind, s in events],
+            }],
+        }
+
+
+# ============================================================
+# SAMPLING PROFILER
+# ============================================================
+
+def _start_sampler(path):
+    """py-spy on our own pid if installed, otherwise cProfile (deterministic, slower)"""
+    if shutil.which("py-spy"):
+        proc = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--rate", "200",
+                                 "--format", "speedscope", "--output", path + ".pyspy.json"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        def stop():
+            proc.send_signal(signal.SIGINT)
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                proc.wait(timeout=10)
+            print(f"py-spy profile written to {path}.pyspy.json")
+        return stop
+
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+
+    def stop():
+        profile.disable()
+        profile.dump_stats(path + ".prof")
+        print(f"cProfile stats written to {path}.prof (py-spy not installed)")
+    return stop
+
+
+# ============================================================
+# SETUP
+# ============================================================
+
+def from_argv(argv=None):
+    """Profiler configured from --profile flags (removed from argv) / FORMFIT_PROFILE"""
+    argv = sys.argv if argv is None else argv
+    enabled = FLAG in argv or os.environ.get("FORMFIT_PROFILE", "").lower() in ("1", "true", "yes")
+    out = os.environ.get("FORMFIT_PROFILE_OUT") or None
+    sampler = SAMPLER_FLAG in argv or bool(os.environ.get("FORMFIT_PROFILE_SAMPLER"))
+    for arg in list(argv[1:]):
+        if arg.startswith(OUT_FLAG):
+            out = arg[len(OUT_FLAG):]
+        if arg == FLAG or arg == SAMPLER_FLAG or arg.startswith(OUT_FLAG):
+            argv.remove(arg)
+    if not enabled:
+        return NullProfiler()
+
+    # Inherited by child processes (agent jobs)
+    os.environ["FORMFIT_PROFILE"] = "1"
+    if out:
+        os.environ["FORMFIT_PROFILE_OUT"] = out
+    if sampler:
+        os.environ["FORMFIT_PROFILE_SAMPLER"] = "1"
+
+    pid = str(os.getpid())
+    profiler = Profiler(out=out.replace("{pid}", pid) if out else None)
+    atexit.register(profiler.report)
+    if sampler:
+        stop = _start_sampler((out or "formfit-profile-{pid}").replace("{pid}", pid).removesuffix(".json"))
+        atexit.register(stop)  # registered last, runs first
+    return profiler
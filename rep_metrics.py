@@ -0,0 +1,276 @@
+"""
+FormFit Rep Metrics
+Per-rep numbers beyond the count: range of motion, time under tension,
+eccentric / concentric split, peak angular velocity and left/right
+asymmetry.
+
+Each exercise is driven by one joint pair (knees for squats, elbows for
+presses...). The driver's left/right average is placed on the exercise's
+phase axis - 0 at the middle of the first phase's range, 1 at the middle of
+the other phase's - and a rep is the stretch where it is more than LEAVE
+away from the start, provided it got at least REACH of the way and lasted
+MIN_REP_S. Within that
+stretch the turning point is the frame furthest from the start; the rest
+position before it is the frame closest to the start since the last rep.
+
+    RepTracker   online, O(1) per frame - a handful of running extremes
+    analyze      offline over a (T, len(ANGLE_KEYS)) angle matrix, vectorized
+                 with reduceat over the rep / rest segments
+
+Both produce the same RepMetrics for the same frames.
+
+    python rep_metrics.py squat --reps 10 --tempo 3
+    python rep_metrics.py --trace squat.npz
+"""
+
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from form_analysis import EXERCISES, ANGLE_INDEX
+
+# Joint pair that moves the rep; exercises without one (plank) have no reps
+DRIVERS = {
+    "shoulder_press": "elbow",
+    "squat": "knee",
+    "bicep_curl": "elbow",
+    "pushup": "elbow",
+    "lunge": "knee",
+    "lateral_raise": "arm_raise",
+    "deadlift": "hip",
+}
+
+# Exercises whose first movement out of the start position is the lowering one
+ECCENTRIC_FIRST = {"squat", "pushup", "lunge"}
+
+LEAVE = 0.2  # fraction of the way to the far phase that starts / ends a rep
+REACH = 0.7  # fraction a rep has to reach to count
+MIN_REP_S = 0.3  # shorter excursions are landmark glitches, not reps
+
+RepMetrics = namedtuple("RepMetrics", [
+    "rep",                 # 1-based within the set
+    "start_s",             # when the rep left the start position
+    "rom_deg",             # rest position to turning point, driver average
+    "tut_s",               # time under tension: out of the start band and back
+    "eccentric_s",
+    "concentric_s",
+    "peak_velocity_dps",   # fastest driver change, deg/s over two frames
+    "asymmetry_deg",       # mean |left - right| over the rep
+    "rom_asymmetry_deg",   # |left ROM - right ROM|
+])
+
+
+class DriverAxis:
+    """Where an exercise's driver joint starts and turns, from its phase ranges"""
+
+    def __init__(self, exercise_key):
+        joint = DRIVERS[exercise_key]
+        self.exercise_key = exercise_key
+        self.left_key, self.right_key = f"left_{joint}", f"right_{joint}"
+        self.left_col, self.right_col = ANGLE_INDEX[self.left_key], ANGLE_INDEX[self.right_key]
+        phases = list(EXERCISES[exercise_key]["phases"].values())
+        start = phases[0]["angles"][self.left_key]
+        far = phases[1]["angles"][self.left_key]
+        self.start_ref = (start[0] + start[1]) / 2
+        self.scale = 1.0 / ((far[0] + far[1]) / 2 - self.start_ref)
+        self.eccentric_first = exercise_key in ECCENTRIC_FIRST
+
+    def progress(self, driver):
+        """0 at the start position, 1 at the far phase (works on arrays too)"""
+        return (driver - self.start_ref) * self.scale
+
+    def metrics(self, rep, t_leave, t_turn, t_back, d_rest, d_turn, l_rest, r_rest, l_turn, r_turn,
+                peak_velocity, asymmetry):
+        away, back = t_turn - t_leave, t_back - t_turn
+        eccentric, concentric = (away, back) if self.eccentric_first else (back, away)
+        return RepMetrics(rep, float(t_leave), float(abs(d_turn - d_rest)), float(t_back - t_leave),
+                          float(eccentric), float(concentric), float(peak_velocity), float(asymmetry),
+                          float(abs(abs(l_turn - l_rest) - abs(r_turn - r_rest))))
+
+
+def has_reps(exercise_key) -> bool:
+    return exercise_key in DRIVERS and len(EXERCISES.get(exercise_key, {}).get("phases", {})) > 1
+
+
+# ============================================================
+# ONLINE
+# ============================================================
+
+class RepTracker:
+    """Streaming rep metrics for one person and exercise.
+
+    update() returns a RepMetrics when a rep finishes, else None. Partial
+    reps (never reaching REACH, or over in under MIN_REP_S) are dropped
+    without a result.
+    """
+
+    def __init__(self, exercise_key):
+        self.axis = DriverAxis(exercise_key)
+        self.exercise_key = exercise_key
+        self.left_key, self.right_key = self.axis.left_key, self.axis.right_key
+        self.reps = 0
+        self.last = None
+        self.reset()
+
+    def reset(self):
+        self._in_rep = False
+        self._rest = None          # (progress, driver, left, right) closest to start since last rep
+        self._history = [None, None]  # (driver, t) two frames back, one frame back
+
+    def update(self, angles, now):
+        """Feed one get_all_angles() dict"""
+        return self.update_pair(angles[self.left_key], angles[self.right_key], now)
+
+    def update_pair(self, left, right, now):
+        d = (left + right) / 2
+        p = self.axis.progress(d)
+        two_back, one_back = self._history
+        self._history = [one_back, (d, now)]
+
+        if not self._in_rep:
+            if p <= LEAVE:
+                if self._rest is None or p < self._rest[0]:
+                    self._rest = (p, d, left, right)
+                return None
+            if self._rest is None:
+                return None  # started mid-rep: wait for the start position
+            self._in_rep = True
+            self._t_leave = now
+            self._turn = (p, d, left, right, now)
+            self._peak_velocity = 0.0
+            self._asym_sum, self._frames = 0.0, 0
+
+        if p <= LEAVE:
+            # Back in the start band: the rep is over
+            self._in_rep = False
+            rest, turn = self._rest, self._turn
+            self._rest = (p, d, left, right)
+            if turn[0] < REACH or now - self._t_leave < MIN_REP_S:
+                return None
+            self.reps += 1
+            self.last = self.axis.metrics(
+                self.reps, self._t_leave, turn[4], now, rest[1], turn[1], rest[2], rest[3], turn[2], turn[3],
+                self._peak_velocity, self._asym_sum / self._frames)
+            return self.last
+
+        if p > self._turn[0]:
+            self._turn = (p, d, left, right, now)
+        if two_back is not None and now > two_back[1]:
+            velocity = abs(d - two_back[0]) / (now - two_back[1])
+            if velocity > self._peak_velocity:
+                self._peak_velocity = velocity
+        self._asym_sum += abs(left - right)
+        self._frames += 1
+        return None
+
+
+# ============================================================
+# OFFLINE
+# ============================================================
+
+def _segment_reduce(ufunc, values, starts, ends):
+    """ufunc over values[s:e] for each segment (non-empty, e < len(values))"""
+    return ufunc.reduceat(values, np.column_stack([starts, ends]).ravel())[::2]
+
+
+def _first_argmax(values, starts, ends):
+    """Index of the first maximum of values[s:e] for each segment"""
+    peaks = _segment_reduce(np.maximum, values, starts, ends)
+    lengths = ends - starts
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    hits = values[index] == peaks[segment]
+    _, first = np.unique(segment[hits], return_index=True)
+    return index[hits][first]
+
+
+def analyze(exercise_key, angle_matrix, times):
+    """RepMetrics for every complete rep in (T, len(ANGLE_KEYS)) angles at `times` seconds"""
+    axis = DriverAxis(exercise_key)
+    times = np.asarray(times, dtype=np.float64)
+    left = angle_matrix[:, axis.left_col].astype(np.float64)
+    right = angle_matrix[:, axis.right_col].astype(np.float64)
+    d = (left + right) / 2
+    p = axis.progress(d)
+
+    # Out-of-start runs [s, e): e is the first frame back in the band
+    out = np.concatenate([[False], p > LEAVE, [False]])
+    edges = np.flatnonzero(np.diff(out.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = (ends < len(p)) & (starts > 0)  # complete, and a rest frame before
+    starts, ends = starts[keep], ends[keep]
+    if not len(starts):
+        return []
+
+    # Rest segment before each run: from the previous run's return frame
+    rest_starts = np.concatenate([[0], ends[:-1]])
+    rest = _first_argmax(-p, rest_starts, starts)
+    turn = _first_argmax(p, starts, ends)
+    reached = (p[turn] >= REACH) & (times[ends] - times[starts] >= MIN_REP_S)
+
+    velocity = np.zeros(len(p))
+    velocity[2:] = np.abs(d[2:] - d[:-2]) / np.maximum(times[2:] - times[:-2], 1e-9)
+    peak_velocity = _segment_reduce(np.maximum, velocity, starts, ends)
+    asym = _segment_reduce(np.add, np.abs(left - right), starts, ends) / (ends - starts)
+
+    results = []
+    for i in np.flatnonzero(reached):
+        r, t = rest[i], turn[i]
+        results.append(axis.metrics(len(results) + 1, times[starts[i]], times[t], times[ends[i]],
+                                    d[r], d[t], left[r], right[r], left[t], right[t],
+                                    peak_velocity[i], asym[i]))
+    return results
+
+
+def summarize(reps) -> dict:
+    """Set-level means of a list of RepMetrics"""
+    if not reps:
+        return {}
+    values = np.array([r[2:] for r in reps], dtype=np.float64)
+    return dict(zip(RepMetrics._fields[2:], values.mean(axis=0).round(2).tolist()), reps=len(reps))
+
+
+def describe(m) -> str:
+    """One line for overlays and the coach's digest"""
+    return (f"ROM {m.rom_deg:.0f}deg, {m.eccentric_s:.1f}s down / {m.concentric_s:.1f}s up"
+            f" (TUT {m.tut_s:.1f}s), peak {m.peak_velocity_dps:.0f}deg/s, L/R {m.rom_asymmetry_deg:.0f}deg")
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    import synthetic_poses
+    from form_analysis import batch_angles
+
+    parser = argparse.ArgumentParser(description="Per-rep metrics for a synthetic or recorded trace")
+    parser.add_argument("exercise", nargs="?", choices=sorted(DRIVERS))
+    parser.add_argument("--trace", help="synthetic_poses .npz trace")
+    parser.add_argument("--reps", type=int, default=10)
+    parser.add_argument("--tempo", type=float, default=2.5)
+    parser.add_argument("--asymmetry", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = synthetic_poses.load_trace(args.trace)
+    elif args.exercise:
+        trace = synthetic_poses.generate(args.exercise, reps=args.reps, tempo=args.tempo,
+                                         asymmetry=args.asymmetry, seed=args.seed)
+    else:
+        parser.error("give an exercise or --trace")
+    times = trace.timestamps_ms / 1000.0
+    angles = batch_angles(trace.landmarks)
+    offline = analyze(trace.exercise, angles, times)
+
+    tracker = RepTracker(trace.exercise)
+    online = [m for m in (tracker.update_pair(float(row[tracker.axis.left_col]), float(row[tracker.axis.right_col]), t)
+                          for row, t in zip(angles, times)) if m is not None]
+
+    print(f"{trace.exercise}: {len(offline)} reps offline, {len(online)} online "
+          f"({'match' if np.allclose(np.array(offline), np.array(online), atol=1e-3) else 'MISMATCH'})")
+    for m in offline:
+        print(f"  {m.rep:>3}  {describe(m)}")
+    print(f"Set: {summarize(offline)}")
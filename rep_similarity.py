@@ -0,0 +1,292 @@
+"""
+FormFit Rep Similarity
+Scores each finished rep's joint-angle trajectory against a library of
+reference reps for the exercise, so a rushed or jerky rep scores lower than
+a controlled one even when every frame is inside check_form's ranges.
+
+- Reps are resampled to REP_LENGTH steps over the exercise's phase joints.
+- Candidates are ranked by LB_Keogh (both directions, one vectorized pass
+  over the whole library). Sakoe-Chiba banded DTW (DP vectorized across
+  references) runs on the closest batch, then once more on every reference
+  whose bound is still below the best distance found.
+- The best match is backtracked to find the joint that deviated most.
+- Resampling removes tempo, so rep duration is scored separately against
+  the library's median duration: a rep done in half the time loses ~60%.
+
+Libraries live in FORMFIT_REP_LIBRARY (default ~/.cache/formfit/reps) as
+<exercise>.npz; `python rep_similarity.py build` seeds them from
+synthetic_poses, and RepLibrary.add() / save() grow them from real reps.
+"""
+
+import os
+
+import numpy as np
+
+from form_analysis import ANGLE_INDEX, ANGLE_NAMES, EXERCISES
+
+REP_LENGTH = 48
+BAND = 6            # Sakoe-Chiba radius in resampled steps
+BATCH = 16          # references in the first (closest by lower bound) DTW pass
+SCORE_SCALE = 15.0  # RMS degrees at which similarity drops to ~37%
+TEMPO_SCALE = 0.75  # |log(duration ratio)| at which the tempo factor drops to ~37%
+
+
+def library_dir() -> str:
+    path = os.environ.get("FORMFIT_REP_LIBRARY")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "formfit", "reps")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def rep_features(exercise_key) -> list[str]:
+    """Per-side joint angles (and back) the exercise's phases care about"""
+    used = set()
+    for phase in EXERCISES[exercise_key]['phases'].values():
+        used.update(phase.get('angles', {}))
+    names = [n for n in ANGLE_NAMES + ['back'] if n in used]
+    return names or list(ANGLE_NAMES)
+
+
+def resample(trajectory, length=REP_LENGTH):
+    """(T, K) -> (length, K) by linear interpolation over normalized time"""
+    trajectory = np.asarray(trajectory, dtype=np.float32)
+    t = len(trajectory)
+    if t == length:
+        return trajectory
+    src = np.linspace(0.0, 1.0, t)
+    dst = np.linspace(0.0, 1.0, length)
+    return np.stack([np.interp(dst, src, trajectory[:, k]) for k in range(trajectory.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+# ============================================================
+# LOWER BOUND + BANDED DTW
+# ============================================================
+
+def envelopes(refs, band=BAND):
+    """(N, L, K) -> upper, lower envelopes over a +/- band window (vectorized)"""
+    n, length, k = refs.shape
+    padded_hi = np.pad(refs, ((0, 0), (band, band), (0, 0)), mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded_hi, 2 * band + 1, axis=1)
+    return windows.max(axis=-1), windows.min(axis=-1)
+
+
+def lb_keogh(query, upper, lower):
+    """Lower bound of banded DTW between query (L, K) and every reference -> (N,)"""
+    above = np.clip(query - upper, 0, None)
+    below = np.clip(lower - query, 0, None)
+    return (above * above + below * below).sum(axis=(1, 2)) / query.shape[1]
+
+
+def banded_dtw(query, refs, band=BAND):
+    """Banded DTW of query (L, K) against refs (M, L, K), vectorized across M.
+
+    The DP runs in band coordinates (row i, offset k = j - i + band), so each
+    step is one small numpy op over all M references. Step cost is the mean
+    squared angle difference across joints. Returns (M,) accumulated costs
+    and the (L, 2*band+1, M) table for backtracking.
+    """
+    m, length, _ = refs.shape
+    width = 2 * band + 1
+    j = np.arange(length)[:, None] + np.arange(width)[None, :] - band    # (L, W)
+    valid = (j >= 0) & (j < length)
+    diff = query[:, None, None, :] - refs.transpose(1, 0, 2)[np.clip(j, 0, length - 1)]  # (L, W, M, K)
+    cost = (diff * diff).mean(axis=-1)
+    cost[~valid] = np.inf
+
+    acc = np.full((length, width, m), np.inf, dtype=np.float32)
+    acc[0, band] = cost[0, band]
+    for k in range(band + 1, width):
+        acc[0, k] = cost[0, k] + acc[0, k - 1]
+    for i in range(1, length):
+        # From (i-1, j-1) -> same offset, from (i-1, j) -> offset + 1
+        prev = acc[i - 1].copy()
+        np.minimum(prev[:-1], acc[i - 1, 1:], out=prev[:-1])
+        row = acc[i]
+        np.add(cost[i], prev, out=row)
+        # From (i, j-1) -> offset - 1, sequential along the row
+        for k in range(1, width):
+            np.minimum(row[k], cost[i, k] + row[k - 1], out=row[k])
+    return acc[length - 1, band], acc
+
+
+def _path(acc, band=BAND):
+    """Optimal warping path (i, j) pairs from one (L, W) band table"""
+    length, width = acc.shape
+    i, k = length - 1, band
+    path = [(i, i + k - band)]
+    while i > 0 or k != band:
+        steps = []
+        if i > 0:
+            steps.append((acc[i - 1, k], i - 1, k))              # diagonal
+            if k + 1 < width:
+                steps.append((acc[i - 1, k + 1], i - 1, k + 1))  # up
+        if k > 0 and i + k - 1 - band >= 0:
+            steps.append((acc[i, k - 1], i, k - 1))              # left
+        _, i, k = min(steps, key=lambda s: s[0])
+        path.append((i, i + k - band))
+    return np.array(path[::-1])
+
+
+# ============================================================
+# LIBRARY + SCORER
+# ============================================================
+
+class RepLibrary:
+    def __init__(self, exercise_key, refs=None, band=BAND):
+        self.exercise_key = exercise_key
+        self.features = rep_features(exercise_key)
+        self.columns = np.array([ANGLE_INDEX[n] for n in self.features])
+        self.band = band
+        self.refs = np.zeros((0, REP_LENGTH, len(self.features)), dtype=np.float32)
+        self.durations = np.zeros(0, dtype=np.float32)  # seconds, nan when unknown
+        self._upper = self._lower = self.refs
+        if refs is not None and len(refs):
+            self.add(refs)
+
+    def __len__(self):
+        return len(self.refs)
+
+    def add(self, reps, durations=None):
+        """Add (T, K) trajectories (feature columns only) or an (N, L, K) array"""
+        if isinstance(reps, np.ndarray) and reps.ndim == 3 and reps.shape[1] == REP_LENGTH:
+            new = reps.astype(np.float32)
+        else:
+            new = np.stack([resample(r) for r in reps])
+        if durations is None:
+            durations = np.full(len(new), np.nan)
+        self.refs = np.concatenate([self.refs, new])
+        self.durations = np.concatenate([self.durations, np.asarray(durations, dtype=np.float32)])
+        self._upper, self._lower = envelopes(self.refs, self.band)
+
+    def path(self):
+        return os.path.join(library_dir(), f"{self.exercise_key}.npz")
+
+    def save(self, path=None):
+        np.savez_compressed(path or self.path(), refs=self.refs, durations=self.durations,
+                            features=np.array(self.features))
+
+    @classmethod
+    def load(cls, exercise_key, path=None):
+        """Stored library, or a synthetic one when nothing has been saved yet"""
+        lib = cls(exercise_key)
+        path = path or lib.path()
+        if os.path.exists(path):
+            data = np.load(path)
+            if list(data['features']) == lib.features:
+                lib.add(data['refs'], data['durations'])
+                return lib
+        return synthetic_library(exercise_key)
+
+    # ---------------- scoring ----------------
+
+    def score(self, trajectory, duration_s=None):
+        """(T, K) rep -> (similarity 0-100, worst joint name, details) or None if empty.
+
+        `trajectory` holds the feature columns (see rep_features); use
+        score_angles() for full ANGLE_KEYS rows.
+        """
+        if not len(self.refs) or len(trajectory) < 2:
+            return None
+        query = resample(trajectory)
+        q_upper, q_lower = envelopes(query[None], self.band)
+        bounds = np.maximum(lb_keogh(query, self._upper, self._lower),
+                            lb_keogh(self.refs, q_upper, q_lower))
+        order = np.argsort(bounds)
+
+        # Closest BATCH by lower bound first, then one pass over whatever the
+        # bound can't rule out against that best distance
+        best, best_idx, best_acc, computed = np.inf, -1, None, 0
+        rest = order[BATCH:]
+        for batch in (order[:BATCH], None):
+            if batch is None:
+                batch = rest[bounds[rest] < best]
+                if not len(batch):
+                    break
+            dist, acc = banded_dtw(query, self.refs[batch], self.band)
+            computed += len(batch)
+            k = int(np.argmin(dist))
+            if dist[k] < best:
+                best, best_idx, best_acc = float(dist[k]), int(batch[k]), acc[:, :, k]
+
+        path = _path(best_acc, self.band)
+        diff = query[path[:, 0]] - self.refs[best_idx][path[:, 1]]
+        joint_rms = np.sqrt((diff * diff).mean(axis=0))
+        rms = float(np.sqrt(best / len(path)))
+        worst = int(np.argmax(joint_rms))
+        similarity = 100.0 * np.exp(-rms / SCORE_SCALE)
+
+        tempo_ratio = None
+        known = self.durations[~np.isnan(self.durations)]
+        if duration_s and len(known):
+            tempo_ratio = duration_s / float(np.median(known))
+            similarity *= np.exp(-abs(np.log(tempo_ratio)) / TEMPO_SCALE)
+
+        return similarity, self.features[worst], {
+            "rms_deg": rms, "tempo_ratio": tempo_ratio, "reference": best_idx, "dtw_computed": computed,
+            "joint_rms_deg": dict(zip(self.features, joint_rms.round(1).tolist())),
+        }
+
+    def score_angles(self, angle_rows, duration_s=None):
+        """Same as score() for (T, len(ANGLE_KEYS)) rows from batch_angles / RepRecorder"""
+        return self.score(np.asarray(angle_rows)[:, self.columns], duration_s)
+
+
+def synthetic_library(exercise_key, n=200, seed=0) -> RepLibrary:
+    """Reference reps from synthetic_poses: clean form, varied tempo and noise"""
+    from form_analysis import batch_angles
+    import synthetic_poses
+
+    lib = RepLibrary(exercise_key)
+    trace = synthetic_poses.generate(exercise_key, reps=n, tempo_jitter=0.15, noise=0.002, seed=seed)
+    angles = batch_angles(trace.landmarks)[:, lib.columns]
+    bounds = np.flatnonzero(np.diff(trace.rep)) + 1
+    lib.add(np.split(angles, bounds), np.bincount(trace.rep) / trace.fps)
+    return lib
+
+
+class RepRecorder:
+    """Collects per-frame angle rows and cuts a rep each time the first phase comes back"""
+
+    def __init__(self, exercise_key, max_frames=600):
+        self.exercise_key = exercise_key
+        self.phases = list(EXERCISES[exercise_key]['phases'])
+        self.max_frames = max_frames  # drop a "rep" that never finishes
+        self._rows = []
+        self._started_at = None
+        self._left_start = False
+
+    def update(self, angle_row, phase, now):
+        """Feed one frame (now = seconds); returns (rows (T, K), duration_s) for a finished rep"""
+        if not self._rows:
+            self._started_at = now
+        self._rows.append(angle_row)
+        if len(self._rows) > self.max_frames:
+            self._rows.clear()
+            self._left_start = False
+        if len(self.phases) < 2 or phase not in self.phases:
+            return None
+        if phase != self.phases[0]:
+            self._left_start = True
+        elif self._left_start:
+            self._left_start = False
+            rep, duration = np.array(self._rows), now - self._started_at
+            self._rows, self._started_at = [angle_row], now
+            return rep, duration
+        return None
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if sys.argv[1:2] == ["build"]:
+        for key in EXERCISES:
+            t0 = time.perf_counter()
+            lib = synthetic_library(key)
+            lib.save()
+            print(f"{key}: {len(lib)} reference reps -> {lib.path()} ({time.perf_counter() - t0:.1f}s)")
+    else:
+        print("usage: python rep_similarity.py build")
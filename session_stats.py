@@ -0,0 +1,401 @@
+"""
+FormFit Session Statistics
+Set and session summaries ("average depth 95deg, asymmetry down 30% since
+the first set") without keeping frames: every angle the exercise reads
+(stats_angles), every per-rep metric and every mistake's rate, in
+constant memory.
+
+RunningStats tracks named columns together:
+
+    count / mean / variance   Welford, combined per batch with Chan's formula
+    min / max
+    ema                       exponential moving average ("lately")
+    percentiles               merging t-digest per column (~DELTA centroids)
+
+Rows are copied into a small buffer and folded in with a few numpy calls
+per BUFFER rows, so the per-frame cost is one row copy. copy() and merge()
+are cheap (arrays of a few hundred numbers), so snapshots can be taken per
+set, merged per exercise and across sessions (to_dict / from_dict are
+JSON-safe).
+
+SessionStats is the per-session bundle: current set, per-exercise totals,
+the last MAX_SETS set snapshots and mistake rates; summary() / describe()
+answer end-of-workout questions.
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+
+from form_analysis import ANGLE_KEYS, angle_plan
+from rep_metrics import DRIVERS, RepMetrics
+
+BUFFER = 256        # rows folded in per batch
+DELTA = 100         # t-digest compression: more centroids, tighter percentiles
+EMA_FRAMES = 300    # ~10s at 30fps
+MAX_SETS = 20       # set snapshots kept per session
+
+REP_FIELDS = list(RepMetrics._fields[2:])
+
+
+# ============================================================
+# T-DIGEST
+# ============================================================
+
+def _compress(means, weights, delta=DELTA):
+    """Merge sorted-by-mean centroids so each spans at most one unit of the k1 scale"""
+    order = np.argsort(means, kind="stable")
+    means, weights = means[order], weights[order]
+    cum = np.cumsum(weights)
+    q = (cum - weights / 2) / cum[-1]
+    bucket = np.floor(delta / (2 * np.pi) * np.arcsin(2 * q - 1))
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+    w = np.add.reduceat(weights, starts)
+    return np.add.reduceat(means * weights, starts) / w, w
+
+
+def _quantiles(means, weights, lo, hi, qs):
+    """Interpolated quantiles from centroids, pinned to the exact min / max"""
+    if not len(means):
+        return np.full(len(qs), np.nan)
+    cum = np.cumsum(weights)
+    total = cum[-1]
+    xs = np.concatenate([[0.0], cum - weights / 2, [total]])
+    ys = np.concatenate([[lo], means, [hi]])
+    return np.interp(np.asarray(qs) * total, xs, ys)
+
+
+# ============================================================
+# RUNNING STATS
+# ============================================================
+
+class RunningStats:
+    def __init__(self, columns, ema_frames=EMA_FRAMES, delta=DELTA):
+        self.columns = list(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.alpha = 2.0 / (ema_frames + 1)
+        self.delta = delta
+        k = len(self.columns)
+        self.count = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.ema = np.full(k, np.nan)
+        self.digests = [(np.zeros(0), np.zeros(0)) for _ in range(k)]
+        self._buf = np.empty((BUFFER, k))
+        self._n = 0
+
+    # ---------------- input ----------------
+
+    def add(self, row):
+        """One row of values in column order"""
+        self._buf[self._n] = row
+        self._n += 1
+        if self._n == BUFFER:
+            self._fold()
+
+    def add_batch(self, rows):
+        """(N, len(columns)) rows at once (offline traces)"""
+        rows = np.asarray(rows, dtype=np.float64)
+        for start in range(0, len(rows), BUFFER):
+            self._fold_rows(rows[start:start + BUFFER])
+
+    def _fold(self):
+        if self._n:
+            rows, self._n = self._buf[:self._n], 0
+            self._fold_rows(rows)
+
+    def _fold_rows(self, rows):
+        n = len(rows)
+        if not n:
+            return
+        # Chan et al.: combine (count, mean, M2) with the batch's
+        b_mean = rows.mean(axis=0)
+        b_m2 = ((rows - b_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = b_mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + b_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+        np.minimum(self.min, rows.min(axis=0), out=self.min)
+        np.maximum(self.max, rows.max(axis=0), out=self.max)
+
+        # EMA over the batch in closed form: decay^n * ema + sum of weighted rows
+        decay = 1.0 - self.alpha
+        weights = self.alpha * decay ** np.arange(n - 1, -1, -1)
+        start = np.where(np.isnan(self.ema), rows[0], self.ema)
+        self.ema = decay ** n * start + weights @ rows
+
+        for c in range(len(self.columns)):
+            means, w = self.digests[c]
+            self.digests[c] = _compress(np.concatenate([means, rows[:, c]]),
+                                        np.concatenate([w, np.ones(n)]), self.delta)
+
+    # ---------------- snapshots ----------------
+
+    def copy(self):
+        """Independent snapshot (folds the buffer first)"""
+        self._fold()
+        other = RunningStats.__new__(RunningStats)
+        other.__dict__.update(self.__dict__)
+        for name in ("mean", "m2", "min", "max", "ema"):
+            setattr(other, name, getattr(self, name).copy())
+        other.digests = list(self.digests)  # centroid arrays are replaced, never mutated
+        other._buf = np.empty_like(self._buf)
+        return other
+
+    def merge(self, other):
+        """Combined stats of two runs over the same columns; EMA follows `other` (the later one)"""
+        if other.columns != self.columns:
+            raise ValueError("can only merge stats over the same columns")
+        a, b = self.copy(), other.copy()
+        if not a.count:
+            return b
+        if not b.count:
+            return a
+        total = a.count + b.count
+        delta = b.mean - a.mean
+        a.mean = a.mean + delta * (b.count / total)
+        a.m2 = a.m2 + b.m2 + delta ** 2 * (a.count * b.count / total)
+        a.count = total
+        a.min, a.max = np.minimum(a.min, b.min), np.maximum(a.max, b.max)
+        a.ema = b.ema.copy()
+        a.digests = [_compress(np.concatenate([ma, mb]), np.concatenate([wa, wb]), a.delta)
+                     for (ma, wa), (mb, wb) in zip(a.digests, b.digests)]
+        return a
+
+    # ---------------- queries ----------------
+
+    def quantiles(self, column, qs):
+        self._fold()
+        c = self.index[column]
+        means, weights = self.digests[c]
+        return _quantiles(means, weights, self.min[c], self.max[c], qs)
+
+    def stats(self, column, percentiles=(5, 50, 95)) -> dict:
+        self._fold()
+        c = self.index[column]
+        if not self.count:
+            return {"count": 0}
+        out = {"count": self.count, "mean": float(self.mean[c]),
+               "std": float(np.sqrt(self.m2[c] / max(1, self.count - 1))),
+               "min": float(self.min[c]), "max": float(self.max[c]), "ema": float(self.ema[c])}
+        for p, v in zip(percentiles, self.quantiles(column, np.asarray(percentiles) / 100)):
+            out[f"p{p}"] = float(v)
+        return out
+
+    def to_dict(self) -> dict:
+        self._fold()
+        return {"columns": self.columns, "count": self.count, "alpha": self.alpha, "delta": self.delta,
+                "mean": self.mean.tolist(), "m2": self.m2.tolist(), "min": self.min.tolist(),
+                "max": self.max.tolist(), "ema": self.ema.tolist(),
+                "digests": [[m.tolist(), w.tolist()] for m, w in self.digests]}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data["columns"], delta=data["delta"])
+        stats.alpha = data["alpha"]
+        stats.count = data["count"]
+        for name in ("mean", "m2", "min", "max", "ema"):
+            setattr(stats, name, np.array(data[name], dtype=np.float64))
+        stats.digests = [(np.array(m), np.array(w)) for m, w in data["digests"]]
+        return stats
+
+
+# ============================================================
+# SESSION
+# ============================================================
+
+class MistakeRates:
+    """Share of frames each mistake shows up in, overall and lately (EMA)"""
+
+    def __init__(self, ema_frames=EMA_FRAMES):
+        self.alpha = 2.0 / (ema_frames + 1)
+        self.frames = 0
+        self.counts = {}
+        self._ema = {}  # mistake -> (rate, frame it was last updated)
+
+    def add(self, mistakes):
+        self.frames += 1
+        for m in mistakes:
+            self.counts[m] = self.counts.get(m, 0) + 1
+            rate, at = self._ema.get(m, (0.0, self.frames - 1))
+            decay = (1 - self.alpha) ** (self.frames - at)
+            self._ema[m] = (rate * decay + self.alpha, self.frames)
+
+    def rates(self) -> dict:
+        return {m: c / self.frames for m, c in self.counts.items()} if self.frames else {}
+
+    def recent(self) -> dict:
+        return {m: rate * (1 - self.alpha) ** (self.frames - at) for m, (rate, at) in self._ema.items()}
+
+    def merge(self, other):
+        out = MistakeRates()
+        out.alpha, out.frames = self.alpha, self.frames + other.frames
+        out.counts = dict(self.counts)
+        for m, c in other.counts.items():
+            out.counts[m] = out.counts.get(m, 0) + c
+        out._ema = {m: (rate, at + self.frames) for m, (rate, at) in other._ema.items()}
+        return out
+
+
+def stats_angles(exercise) -> list[str]:
+    """Angle columns kept per set: what the exercise's checks read, plus its rep driver"""
+    driver = DRIVERS.get(exercise)
+    return angle_plan(exercise, extra=(f"avg_{driver}",) if driver else ()).keys
+
+
+class SetStats:
+    """Everything about one set (or, merged, one exercise over the session)"""
+
+    def __init__(self, exercise):
+        self.exercise = exercise
+        self.started = time.time()
+        self.ended = None
+        self.sets = 1
+        self.angles = RunningStats(stats_angles(exercise))
+        self.reps = RunningStats(REP_FIELDS)
+        self.mistakes = MistakeRates()
+
+    def merge(self, other):
+        out = SetStats(self.exercise)
+        out.started, out.ended = self.started, other.ended
+        out.sets = self.sets + other.sets
+        out.angles = self.angles.merge(other.angles)
+        out.reps = self.reps.merge(other.reps)
+        out.mistakes = self.mistakes.merge(other.mistakes)
+        return out
+
+    def summary(self) -> dict:
+        driver = DRIVERS.get(self.exercise)
+        out = {"exercise": self.exercise, "sets": self.sets, "frames": self.angles.count,
+               "reps": self.reps.count,
+               "mistake_rates": {m: round(r, 3) for m, r in sorted(self.mistakes.rates().items(),
+                                                                   key=lambda kv: -kv[1])[:5]}}
+        if driver and self.angles.count:
+            out["driver"] = {k: round(v, 1) for k, v in self.angles.stats(f"avg_{driver}").items()}
+        if self.reps.count:
+            out["per_rep"] = {f: round(self.reps.stats(f, ())["mean"], 2) for f in REP_FIELDS}
+        return out
+
+
+class SessionStats:
+    def __init__(self, max_sets=MAX_SETS):
+        self.current = None
+        self.sets = deque(maxlen=max_sets)  # finished SetStats, newest last
+        self.totals = {}                    # exercise -> merged SetStats
+
+    def start_set(self, exercise):
+        """Close the running set (if it saw anything) and start one for `exercise`"""
+        self.end_set()
+        self.current = SetStats(exercise)
+
+    def end_set(self):
+        current, self.current = self.current, None
+        if current is None or not (current.angles.count or current.reps.count or current.mistakes.frames):
+            return
+        current.ended = time.time()
+        current.angles._fold()
+        current.reps._fold()
+        self.sets.append(current)
+        total = self.totals.get(current.exercise)
+        self.totals[current.exercise] = current if total is None else total.merge(current)
+
+    def observe(self, angles=None, mistakes=None):
+        """One frame: an angles dict (with at least stats_angles()) and / or the mistakes shown for it"""
+        if self.current is None:
+            return
+        if angles is not None:
+            try:
+                self.current.angles.add([angles[k] for k in self.current.angles.columns])
+            except KeyError:
+                pass  # angles from another exercise's plan
+        if mistakes is not None:
+            self.current.mistakes.add(mistakes)
+
+    def add_rep(self, metrics):
+        if self.current is not None:
+            self.current.reps.add(metrics[2:])
+
+    def exercise_totals(self):
+        """Per-exercise totals including the running set"""
+        totals = dict(self.totals)
+        if self.current is not None:
+            # Fold buffered rows so counts include the latest frames and reps
+            self.current.angles._fold()
+            self.current.reps._fold()
+        if self.current is not None and self.current.angles.count + self.current.reps.count:
+            running = self.current
+            total = totals.get(running.exercise)
+            totals[running.exercise] = running if total is None else total.merge(running)
+        return totals
+
+    def summary(self) -> dict:
+        return {exercise: s.summary() for exercise, s in self.exercise_totals().items()}
+
+    def describe(self) -> str:
+        """Plain-text workout summary for the coach"""
+        totals = self.exercise_totals()
+        if not totals:
+            return "No exercise data yet."
+        lines = []
+        for exercise, total in totals.items():
+            s = total.summary()
+            parts = [f"{exercise}: {s['sets']} set(s), {s['reps']} measured reps"]
+            if "driver" in s:
+                d = s["driver"]
+                parts.append(f"{DRIVERS[exercise]} angle avg {d['mean']:.0f}deg "
+                             f"(5th-95th percentile {d['p5']:.0f}-{d['p95']:.0f}deg)")
+            if "per_rep" in s:
+                r = s["per_rep"]
+                parts.append(f"ROM {r['rom_deg']:.0f}deg, {r['eccentric_s']:.1f}s eccentric / "
+                             f"{r['concentric_s']:.1f}s concentric, L/R difference {r['asymmetry_deg']:.0f}deg")
+            trend = self.trend(exercise, "asymmetry_deg")
+            if trend is not None:
+                parts.append(f"L/R difference {'down' if trend < 0 else 'up'} {abs(trend):.0f}% since the first set")
+            if s["mistake_rates"]:
+                m, rate = next(iter(s["mistake_rates"].items()))
+                parts.append(f"most common issue: {m} ({100 * rate:.0f}% of frames)")
+            lines.append("; ".join(parts))
+        return "\n".join(lines)
+
+    def trend(self, exercise, rep_field):
+        """% change of a per-rep mean from the first to the latest set of an exercise, or None"""
+        sets = [s for s in self.sets if s.exercise == exercise and s.reps.count]
+        if self.current is not None and self.current.exercise == exercise and self.current.reps.count:
+            sets.append(self.current)
+        if len(sets) < 2:
+            return None
+        first = sets[0].reps.stats(rep_field, ())["mean"]
+        last = sets[-1].reps.stats(rep_field, ())["mean"]
+        return None if abs(first) < 1e-6 else 100.0 * (last - first) / abs(first)
+
+
+if __name__ == "__main__":
+    import synthetic_poses
+    from form_analysis import batch_angles
+
+    # Accuracy / speed check against exact numpy on a long synthetic trace
+    trace = synthetic_poses.generate("squat", reps=400, seed=0)
+    angles = batch_angles(trace.landmarks).astype(np.float64)
+    stats = RunningStats(ANGLE_KEYS)
+    t0 = time.perf_counter()
+    for row in angles:
+        stats.add(row)
+    stats._fold()
+    per_frame = (time.perf_counter() - t0) / len(angles) * 1e6
+    for col in ("avg_knee", "back", "knee_diff"):
+        c = ANGLE_KEYS.index(col)
+        exact = np.percentile(angles[:, c], [5, 50, 95])
+        approx = stats.quantiles(col, [0.05, 0.5, 0.95])
+        print(f"{col:>10}: mean {stats.mean[c]:.2f} (exact {angles[:, c].mean():.2f})  "
+              f"p5/p50/p95 {np.round(approx, 1)} (exact {np.round(exact, 1)})")
+    halves = RunningStats(ANGLE_KEYS), RunningStats(ANGLE_KEYS)
+    halves[0].add_batch(angles[:len(angles) // 2])
+    halves[1].add_batch(angles[len(angles) // 2:])
+    merged = halves[0].merge(halves[1])
+    print(f"{len(angles):,} frames, {per_frame:.2f}us/frame, "
+          f"{sum(len(m) for m, _ in stats.digests)} centroids total, "
+          f"merged std error {np.abs(np.sqrt(merged.m2 / (merged.count - 1)) - angles.std(axis=0, ddof=1)).max():.2e}")
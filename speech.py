@@ -1,36 +1,45 @@
 import cv2
 import numpy as np
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 import threading
 import queue
 import platform
 import os
+import time
 from collections import deque
 
+import analysis_bus
+import event_log
+import model_assets
+import profiler
+import pose_backends
+from motion_governor import MotionGovernor
+from frame_ingest import FrameIngest, AllocationMeter
+from landmark_adapter import LandmarkAdapter, joint_angles, to_pixels, X
+from landmark_filter import LandmarkFilter
+from pose_quality import QualityGate, REPOSITION
+from instant_replay import ReplayBuffer
+
 # -----------------------
 # 0️⃣ Model
 # -----------------------
-MODEL_PATH = "pose_landmarker_lite.task"
-if not os.path.exists(MODEL_PATH):
-    import urllib.request
-    print("Downloading pose model...")
-    url = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task"
-    urllib.request.urlretrieve(url, MODEL_PATH)
-    print("Download complete!")
+# Pose backend is picked per machine in main() - importing this module never downloads
 
 # -----------------------
 # 1️⃣ Landmarks
 # -----------------------
 LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST = 11, 13, 15
 RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST = 12, 14, 16
+ELBOW_TRIPLETS = np.array([
+    [LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST],
+    [RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST],
+])
 
 
 # -----------------------
 # 2️⃣ Speech thread setup
 # -----------------------
 speech_queue = queue.Queue()
+log = event_log.NullEventLog()  # opened in main() - importing starts no writer thread
 last_spoken = ""
 last_spoken_time = 0
 SPEECH_COOLDOWN = 1.5
@@ -42,8 +51,10 @@ VOICE_MAP = {
     "GOOD": "Good rep"
 }
 
-state_history = deque(maxlen=10)  # Last 10 frames
-MIN_FRAMES_FOR_STATE_CHANGE = 6   # Need 6/10 frames to confirm
+# Landmarks are One Euro filtered, so a short vote is enough (was 6 of 10:
+# same false-alarm rate on noisy synthetic reps, cues ~60ms sooner)
+state_history = deque(maxlen=6)   # Last 6 frames
+MIN_FRAMES_FOR_STATE_CHANGE = 4   # Need 4/6 frames to confirm
 last_spoken_state = ""
 
 
@@ -76,6 +87,7 @@ def speak_async(text, current_time):
         last_spoken = text
         last_spoken_time = current_time
         speech_queue.put(text)
+        log.emit("cue", text=text)
 
 def get_top_error(errors):
     for err in ERROR_PRIORITY:
@@ -86,34 +98,11 @@ def get_top_error(errors):
 # -----------------------
 # 3️⃣ Helper functions
 # -----------------------
-def calculate_angle(a, b, c):
-    """Calculate angle between three points"""
-    a = np.array(a)
-    b = np.array(b)
-    c = np.array(c)
-    
-    ba = a - b
-    bc = c - b
-    
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    angle = np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-    return angle
-
 def check_shoulder_press_form(landmarks):
-    """Check shoulder press form - returns (is_correct, errors, angles)"""
+    """Check shoulder press form on a (33, 4) landmark array - returns (is_correct, errors, angles)"""
     
-    # Get landmark coordinates
-    left_shoulder = [landmarks[LEFT_SHOULDER].x, landmarks[LEFT_SHOULDER].y]
-    left_elbow = [landmarks[LEFT_ELBOW].x, landmarks[LEFT_ELBOW].y]
-    left_wrist = [landmarks[LEFT_WRIST].x, landmarks[LEFT_WRIST].y]
-    
-    right_shoulder = [landmarks[RIGHT_SHOULDER].x, landmarks[RIGHT_SHOULDER].y]
-    right_elbow = [landmarks[RIGHT_ELBOW].x, landmarks[RIGHT_ELBOW].y]
-    right_wrist = [landmarks[RIGHT_WRIST].x, landmarks[RIGHT_WRIST].y]
-    
-    # Calculate elbow angles
-    left_elbow_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
-    right_elbow_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
+    # Calculate both elbow angles in one pass
+    left_elbow_angle, right_elbow_angle = joint_angles(landmarks, ELBOW_TRIPLETS)
     
     errors = []
     
@@ -122,10 +111,10 @@ def check_shoulder_press_form(landmarks):
         errors.append("Keep arms moving evenly")
     
     # Elbow-over-wrist check (important for safety)
-    lw_x = left_wrist[0]
-    le_x = left_elbow[0]
-    rw_x = right_wrist[0]
-    re_x = right_elbow[0]
+    lw_x = landmarks[LEFT_WRIST, X]
+    le_x = landmarks[LEFT_ELBOW, X]
+    rw_x = landmarks[RIGHT_WRIST, X]
+    re_x = landmarks[RIGHT_ELBOW, X]
     
     if abs(le_x - lw_x) > 0.05 or abs(re_x - rw_x) > 0.05:
         errors.append("Stack wrists over elbows")
@@ -135,8 +124,9 @@ def check_shoulder_press_form(landmarks):
     return is_correct, errors, (left_elbow_angle, right_elbow_angle)
 
 def draw_landmarks(image, landmarks, color):
-    """Draw pose landmarks on image with connecting lines"""
+    """Draw pose landmarks (33, 4 array) on image with connecting lines"""
     h, w = image.shape[:2]
+    pts = to_pixels(landmarks, w, h)
     
     # Connections for upper body (arms and torso)
     connections = [
@@ -148,19 +138,11 @@ def draw_landmarks(image, landmarks, color):
     
     # Draw connections
     for start, end in connections:
-        if start < len(landmarks) and end < len(landmarks):
-            x1 = int(landmarks[start].x * w)
-            y1 = int(landmarks[start].y * h)
-            x2 = int(landmarks[end].x * w)
-            y2 = int(landmarks[end].y * h)
-            cv2.line(image, (x1, y1), (x2, y2), color, 3)
+        cv2.line(image, pts[start], pts[end], color, 3)
     
     # Draw joint points
     for i in [11, 12, 13, 14, 15, 16, 23, 24]:  # Upper body landmarks
-        if i < len(landmarks):
-            x = int(landmarks[i].x * w)
-            y = int(landmarks[i].y * h)
-            cv2.circle(image, (x, y), 5, color, -1)
+        cv2.circle(image, pts[i], 5, color, -1)
 
 def get_stable_state(current_state):
     state_history.append(current_state)
@@ -180,88 +162,168 @@ def get_stable_state(current_state):
 
     return None
 # -----------------------
-# 4️⃣ Main loop
+# 4️⃣ Subscribers
 # -----------------------
-def main():
+# The frame loop only captures, detects and checks form; voice and display
+# consume its results from the analysis bus at their own pace
+def on_voice(result):
+    """Vote over every frame's state and speak confirmed changes (lossless)"""
     global last_spoken_state
-    # Setup pose landmarker
-    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
-    options = vision.PoseLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.VIDEO
-    )
-    
+    if not result["fresh"]:
+        return  # no pose, or held over from the last good frame
+    errors = result["errors"]
+    if "Stack wrists over elbows" in errors:
+        current_state = "WRISTS"
+    elif "Keep arms moving evenly" in errors:
+        current_state = "ASYMMETRY"
+    else:
+        current_state = "GOOD"
+
+    # Only speak if stable state confirmed
+    stable_state = get_stable_state(current_state)
+    if stable_state and stable_state != last_spoken_state:
+        log.emit("form", state=stable_state, errors=errors)
+        speak_async(VOICE_MAP[stable_state], result["time"])
+        last_spoken_state = stable_state
+
+
+def make_display(pool, startup):
+    """Draw overlays on the frame snapshot and show it (latest-wins, main thread)"""
+    def on_display(result):
+        frame = result["frame"]
+        if result["status"] == REPOSITION:
+            cv2.putText(frame, result["hint"], (50, 50),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 255), 2)
+        elif result["landmarks"] is not None:
+            # Set color: Green = correct, Red = incorrect
+            color = (0, 255, 0) if result["is_correct"] else (0, 0, 255)
+            draw_landmarks(frame, result["landmarks"], color)
+            status = "GOOD FORM!" if result["is_correct"] else "FIX FORM"
+            cv2.putText(frame, status, (50, 50),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
+            startup.first_feedback()
+        cv2.imshow('Shoulder Press Form Checker', frame)
+        pool.release(frame)
+    return on_display
+
+# -----------------------
+# 5️⃣ Main loop
+# -----------------------
+def main():
+    global log
+    log = event_log.open_log("speech")
+    prof = profiler.from_argv()  # --profile: per-stage timings on exit
+    startup = model_assets.StartupTimer()
+
     cap = cv2.VideoCapture(0)
-    
-    with vision.PoseLandmarker.create_from_options(options) as landmarker:
-        frame_count = 0
-        
-        prev_angles = {
-            "left": None,
-            "right": None
-        }
+    startup.mark("camera")
+
+    # Pick the best pose backend for this host (cached after the first calibration,
+    # measured on a camera frame - stand in view on the first run)
+    backend = pose_backends.select_backend(camera=cap)
+    startup.mark("backend")
+    log.emit("session_start", exercise="shoulder_press", backend=backend.name)
+
+    pool = analysis_bus.FramePool()
+    bus = analysis_bus.AnalysisBus()
+    bus.subscribe("voice", on_voice, policy="lossless", capacity=256)
+    bus.subscribe("display", make_display(pool, startup), main_thread=True,
+                  on_drop=lambda result: pool.release(result["frame"]))
+    bus.start()
+    stop = threading.Event()
+    governor = MotionGovernor()
+    ingest = FrameIngest()
+    alloc_meter = AllocationMeter()
+    gate = QualityGate(ELBOW_TRIPLETS)  # shoulders, elbows, wrists
+    replay = ReplayBuffer()  # last few seconds, saved as a clip when a mistake appears
+    frame_count = 0
+
+    def frame_loop():
+        nonlocal frame_count
+        adapter = LandmarkAdapter()
+        smoother = LandmarkFilter()  # One Euro, single person
+        poses = adapter.poses
+        landmarks, is_correct, errors = None, True, []  # last good analysis
         
-        while cap.isOpened():
-            ret, frame = cap.read()
+        while cap.isOpened() and not stop.is_set():
+            alloc_meter.frame_start()
+            prof.frame_start()
+            ret, frame = ingest.read(cap)
+            prof.lap("capture")
             if not ret:
                 break
             
             frame_count += 1
             
-            # Convert to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-            
-            # Detect pose
-            timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
-            result = landmarker.detect_for_video(mp_image, timestamp_ms)
-            
-            if result.pose_landmarks and len(result.pose_landmarks) > 0:
-                landmarks = result.pose_landmarks[0]
-                
-                # Check form
-                is_correct, errors, (left_angle, right_angle) = check_shoulder_press_form(landmarks)
+            # Skip inference while the scene is static (last result is reused)
+            infer = governor.should_infer(frame)
+            prof.lap("governor")
+            if infer:
+                # Convert to RGB (into a reused buffer)
+                rgb_frame = ingest.to_rgb(frame)
+                prof.lap("to_rgb")
                 
-                # Speech feedback for errors
-                current_time = frame_count/30.0
+                # Detect pose
+                timestamp_ms = int(frame_count * 1000 / 30)  # Assuming 30 fps
+                result = backend.detect(rgb_frame, timestamp_ms)
+                poses = adapter.update(result)
+                governor.observe(poses[0] if len(poses) > 0 else None)
+                prof.lap("detect")
                 
-                # Determine current message
-                if "Stack wrists over elbows" in errors:
-                    current_state = "WRISTS"
-                elif "Keep arms moving evenly" in errors:
-                    current_state = "ASYMMETRY"
+                # Angles and checks run on smoothed landmarks (filtered in the buffer)
+                if len(poses) == 1:
+                    poses[0] = smoother(poses[0], time.perf_counter())
                 else:
-                    current_state = "GOOD"
-
-                # Only speak if stable state confirmed
-                stable_state = get_stable_state(current_state)
+                    smoother.reset()
+                prof.lap("smooth")
+            
+            # Arms occluded or out of frame: keep the last good analysis
+            fresh = len(poses) > 0 and gate.check(poses[0])
+            if fresh:
+                # Copied: the adapter's buffer is rewritten by the next detection
+                landmarks = poses[0].copy()
+                is_correct, errors, _ = check_shoulder_press_form(landmarks)
+                prof.lap("check_form")
+                for mistake in replay.update(errors):
+                    log.emit("replay", mistake=mistake)
+            elif len(poses) == 0:
+                landmarks, is_correct, errors = None, True, []
+                gate.reset()
+            if gate.changed:
+                log.emit("quality", status=gate.status, hint=gate.hint())
 
-                if stable_state and stable_state != last_spoken_state:
-                    speak_async(VOICE_MAP[stable_state], current_time)
-                    last_spoken_state = stable_state
-                
-                # Set color: Green = correct, Red = incorrect
-                color = (0, 255, 0) if is_correct else (0, 0, 255)
-                
-                # Draw skeleton
-                draw_landmarks(frame, landmarks, color)
-                
-                # Display status
-                status = "GOOD FORM!" if is_correct else "FIX FORM"
-                cv2.putText(frame, status, (50, 50), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
-                
-            cv2.imshow('Shoulder Press Form Checker', frame)
+            replay.push(frame)
+            prof.lap("replay")
             
+            bus.publish({"frame": pool.snapshot(frame), "landmarks": landmarks, "is_correct": is_correct,
+                         "errors": errors, "fresh": fresh, "status": gate.status, "hint": gate.hint(),
+                         "time": frame_count / 30.0})
+            prof.lap("publish")
+            alloc_meter.frame_end()
+
+    with backend.load():
+        startup.mark("load")
+        producer = analysis_bus.run_producer(frame_loop, stop)
+        while not stop.is_set():
+            bus.pump(0.005)
             if cv2.waitKey(1) & 0xFF == 27: # press ESC to exit
-                break
+                stop.set()
+        producer.join()
 
+    bus.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(f"Motion governor: {governor.stats()}")
+    alloc_meter.report(ingest)
+    bus.report()
+    print(f"Quality gate: {gate.stats()}")
+    replay.close()
+    print(f"Instant replay: {replay.stats()}")
+    log.emit("session_end", frames=frame_count, quality=gate.stats())
     
     # Stop speech thread
     speech_queue.put(None)
     speech_thread.join()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,69 +1,62 @@
 import cv2
 import numpy as np
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
 import threading
-import queue
-import platform
-import os
-from collections import deque
+import time
+
+import analysis_bus
+import event_log
+import model_assets
+import profiler
+import pose_backends
+from motion_governor import MotionGovernor
+from frame_ingest import FrameIngest, AllocationMeter
+from landmark_adapter import LandmarkAdapter, joint_angles, to_pixels, X
+from landmark_filter import LandmarkFilter
+from pose_quality import QualityGate, REPOSITION
+from instant_replay import ReplayBuffer
+from cue_timing import SpeechChannel, CrossingPredictor, PredictiveCue
+from rep_metrics import RepTracker, describe, summarize
 
 # -----------------------
 # 0️⃣ Model
 # -----------------------
-MODEL_PATH = "pose_landmarker_lite.task"
-if not os.path.exists(MODEL_PATH):
-    import urllib.request
-    print("Downloading pose model...")
-    url = "https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_lite/float16/latest/pose_landmarker_lite.task"
-    urllib.request.urlretrieve(url, MODEL_PATH)
-    print("Download complete!")
+# Pose backend is picked per machine in main() - importing this module never downloads
 
 # -----------------------
 # 1️⃣ Landmarks
 # -----------------------
 LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST = 11, 13, 15
 RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST = 12, 14, 16
+ELBOW_TRIPLETS = np.array([
+    [LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST],
+    [RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST],
+])
 
 # -----------------------
 # 2️⃣ Speech thread setup
 # -----------------------
-speech_queue = queue.Queue()
+# Cancellable speech with a per-host latency estimate (calibrated on first
+# run) - created in main(), so importing this module starts no TTS
+speech = None
+log = event_log.NullEventLog()  # opened in main() - importing starts no writer thread
 last_spoken = ""
 last_spoken_time = 0
 SPEECH_COOLDOWN = 1.5
 ERROR_PRIORITY = ["Stack wrists over elbows", "Keep arms moving evenly"]
 
-def speech_worker():
-    system = platform.system()
-    while True:
-        text = speech_queue.get()
-        if text is None:
-            break
-        try:
-            if system == "Windows":
-                import subprocess
-                subprocess.run(['powershell', '-Command',
-                                f'(New-Object -ComObject SAPI.SpVoice).Speak("{text}")'],
-                               capture_output=True)
-            elif system == "Darwin":
-                os.system(f'say "{text}"')
-            else:
-                os.system(f'espeak "{text}"')
-        except Exception as e:
-            print(f"Speech error: {e}")
-        speech_queue.task_done()
-
-speech_thread = threading.Thread(target=speech_worker, daemon=True)
-speech_thread.start()
-
 def speak_async(text, current_time):
     global last_spoken, last_spoken_time
     if text != last_spoken or current_time - last_spoken_time > SPEECH_COOLDOWN:
         last_spoken = text
         last_spoken_time = current_time
-        speech_queue.put(text)
+        speech.say(text)
+        log.emit("cue", text=text)
+
+def mark_spoken(text, current_time):
+    """A predictive cue went out - keep speak_async from repeating it"""
+    global last_spoken, last_spoken_time
+    last_spoken = text
+    last_spoken_time = current_time
 
 def get_top_error(errors):
     for err in ERROR_PRIORITY:
@@ -74,24 +67,9 @@ def get_top_error(errors):
 # -----------------------
 # 3️⃣ Helper functions
 # -----------------------
-def calculate_angle(a, b, c):
-    a = np.array(a); b = np.array(b); c = np.array(c)
-    ba, bc = a - b, c - b
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    return np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-
 def check_shoulder_press_form(landmarks):
-    # Coordinates
-    l_sh, l_el, l_wr = [landmarks[LEFT_SHOULDER].x, landmarks[LEFT_SHOULDER].y], \
-                       [landmarks[LEFT_ELBOW].x, landmarks[LEFT_ELBOW].y], \
-                       [landmarks[LEFT_WRIST].x, landmarks[LEFT_WRIST].y]
-    r_sh, r_el, r_wr = [landmarks[RIGHT_SHOULDER].x, landmarks[RIGHT_SHOULDER].y], \
-                       [landmarks[RIGHT_ELBOW].x, landmarks[RIGHT_ELBOW].y], \
-                       [landmarks[RIGHT_WRIST].x, landmarks[RIGHT_WRIST].y]
-
-    # Angles
-    l_angle = calculate_angle(l_sh, l_el, l_wr)
-    r_angle = calculate_angle(r_sh, r_el, r_wr)
+    # Angles (both elbows in one pass over the (33, 4) landmark array)
+    l_angle, r_angle = joint_angles(landmarks, ELBOW_TRIPLETS)
 
     errors = []
 
@@ -100,7 +78,8 @@ def check_shoulder_press_form(landmarks):
         errors.append("Keep arms moving evenly")
 
     # Wrist over elbow
-    if abs(l_el[0] - l_wr[0]) > 0.05 or abs(r_el[0] - r_wr[0]) > 0.05:
+    if abs(landmarks[LEFT_ELBOW, X] - landmarks[LEFT_WRIST, X]) > 0.05 or \
+       abs(landmarks[RIGHT_ELBOW, X] - landmarks[RIGHT_WRIST, X]) > 0.05:
         errors.append("Stack wrists over elbows")
 
     is_correct = len(errors) == 0
@@ -108,90 +87,224 @@ def check_shoulder_press_form(landmarks):
 
 def draw_landmarks(image, landmarks, color):
     h, w = image.shape[:2]
+    pts = to_pixels(landmarks, w, h)
     connections = [
         (11, 12), (11, 13), (13, 15), (12, 14), (14, 16), (11, 23), (12, 24), (23, 24)
     ]
     for start, end in connections:
-        if start < len(landmarks) and end < len(landmarks):
-            x1, y1 = int(landmarks[start].x * w), int(landmarks[start].y * h)
-            x2, y2 = int(landmarks[end].x * w), int(landmarks[end].y * h)
-            cv2.line(image, (x1, y1), (x2, y2), color, 3)
+        cv2.line(image, pts[start], pts[end], color, 3)
     for i in [11,12,13,14,15,16,23,24]:
-        if i < len(landmarks):
-            x, y = int(landmarks[i].x * w), int(landmarks[i].y * h)
-            cv2.circle(image, (x, y), 5, color, -1)
+        cv2.circle(image, pts[i], 5, color, -1)
+
+def make_display(pool, startup):
+    """Overlays on the frame snapshot + imshow, as a latest-wins bus subscriber"""
+    def on_display(result):
+        frame = result["frame"]
+        if result["status"] == REPOSITION:
+            cv2.putText(frame, result["hint"], (50,50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,255,255), 2)
+        elif result["landmarks"] is not None:
+            is_correct, errors = result["is_correct"], result["errors"]
+            color = (0,255,0) if is_correct else (0,0,255)
+            draw_landmarks(frame, result["landmarks"], color)
+            cv2.putText(frame, f"Reps: {result['reps']}", (50,100), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255,255,0), 2)
+            if result["last_rep"] is not None:
+                cv2.putText(frame, describe(result["last_rep"]), (50,140), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,0), 2)
+            status = "GOOD FORM!" if is_correct else "FIX FORM"
+            cv2.putText(frame, status, (50,50), cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
+            for i, error in enumerate(errors):
+                cv2.putText(frame, error, (50, 200 + i*40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,0,255), 2)
+            # Show what is being spoken
+            cv2.putText(frame, f"VOICE: {result['voice']}", (50, 400), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255,255,0), 2)
+            startup.first_feedback()
+        cv2.imshow("Shoulder Press Tracker", frame)
+        pool.release(frame)
+    return on_display
 
 # -----------------------
 # 4️⃣ Main loop
 # -----------------------
 def main():
-    base_options = python.BaseOptions(model_asset_path=MODEL_PATH)
-    options = vision.PoseLandmarkerOptions(
-        base_options=base_options, running_mode=vision.RunningMode.VIDEO
-    )
-
+    global speech, log
+    log = event_log.open_log("speech2")
+    prof = profiler.from_argv()  # --profile: per-stage timings on exit
+    startup = model_assets.StartupTimer()
     cap = cv2.VideoCapture(0)
-    rep_count = 0
+    startup.mark("camera")
+
+    backend = pose_backends.select_backend(camera=cap)
+    startup.mark("backend")
     state = "bottom"  # Track motion for reps
 
-    with vision.PoseLandmarker.create_from_options(options) as landmarker:
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
+    speech = SpeechChannel()
+    # Cues fire ahead of the crossing by the measured speech lead, and are
+    # taken back if the crossing doesn't come (see cue_timing)
+    lockout_cue = PredictiveCue(speech, CrossingPredictor(160, rising=True, margin=5))
+    symmetry_cue = PredictiveCue(speech, CrossingPredictor(20, rising=True))
+    wrist_cue = PredictiveCue(speech, CrossingPredictor(0.05, rising=True, min_rate=0.1))
+    # ROM / tempo / left-right balance per rep, from the elbows (O(1) per frame)
+    tracker = RepTracker("shoulder_press")
+    set_metrics = []
+    print(f"Speech lead: {speech.lead() * 1000:.0f}ms ({speech.engine or 'no TTS'}, "
+          f"synthesis {speech.latency.synth_s * 1000:.0f}ms)")
+    log.emit("session_start", exercise="shoulder_press", backend=backend.name,
+             speech_lead_ms=round(speech.lead() * 1000))
+
+    # Drawing and imshow run off the analysis bus, on the main thread
+    pool = analysis_bus.FramePool()
+    bus = analysis_bus.AnalysisBus()
+    bus.subscribe("display", make_display(pool, startup), main_thread=True,
+                  on_drop=lambda result: pool.release(result["frame"]))
+    bus.start()
+    stop = threading.Event()
+    governor = MotionGovernor()
+    ingest = FrameIngest()
+    alloc_meter = AllocationMeter()
+    gate = QualityGate(ELBOW_TRIPLETS)  # shoulders, elbows, wrists
+    replay = ReplayBuffer()  # last few seconds, saved as a clip when a mistake appears
+    frame_count = rep_count = 0
+
+    def frame_loop():
+        nonlocal frame_count, rep_count, state
+        adapter = LandmarkAdapter()
+        smoother = LandmarkFilter()  # One Euro, single person
+        poses = adapter.poses
+        last_errors = None  # form state, logged on change
+        landmarks, is_correct, errors = None, True, []  # last good analysis
+        while cap.isOpened() and not stop.is_set():
+            alloc_meter.frame_start()
+            prof.frame_start()
+            ret, frame = ingest.read(cap)
+            captured_at = time.perf_counter()
+            prof.lap("capture")
             if not ret: break
             frame_count += 1
 
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-            timestamp_ms = int(frame_count * 1000 / 30)
-            result = landmarker.detect_for_video(mp_image, timestamp_ms)
+            # Skip inference while the scene is static (last result is reused)
+            infer = governor.should_infer(frame)
+            prof.lap("governor")
+            if infer:
+                rgb_frame = ingest.to_rgb(frame)
+                prof.lap("to_rgb")
+                timestamp_ms = int(frame_count * 1000 / 30)
+                result = backend.detect(rgb_frame, timestamp_ms)
+                poses = adapter.update(result)
+                governor.observe(poses[0] if len(poses) > 0 else None)
+                prof.lap("detect")
+                
+                # Angles and checks run on smoothed landmarks (filtered in the buffer)
+                if len(poses) == 1:
+                    poses[0] = smoother(poses[0], captured_at)
+                else:
+                    smoother.reset()
+                prof.lap("smooth")
 
-            if result.pose_landmarks and len(result.pose_landmarks) > 0:
-                landmarks = result.pose_landmarks[0]
+            # Arms occluded or out of frame: skip the checks (no false wrist
+            # cues) and keep the last good analysis
+            fresh = len(poses) > 0 and gate.check(poses[0])
+            if fresh:
+                # Copied: the adapter's buffer is rewritten by the next detection
+                landmarks = poses[0].copy()
                 is_correct, errors, (l_angle, r_angle) = check_shoulder_press_form(landmarks)
+                prof.lap("check_form")
+                if errors != last_errors:
+                    log.emit("form", correct=is_correct, errors=errors)
+                    last_errors = errors
+                for mistake in replay.update(errors):
+                    log.emit("replay", mistake=mistake)
 
                 # -----------------------
                 # Rep counting (lockout logic)
                 # -----------------------
+                current_time = frame_count/30.0
+                frame_age = time.perf_counter() - captured_at
                 top_elbow_angle = (l_angle + r_angle)/2
-                if top_elbow_angle > 160 and state == "bottom":
-                    state = "top"
-                    rep_count += 1
-                    speak_async(f"Rep {rep_count}", frame_count/30.0)
+                if state == "bottom":
+                    text = f"Rep {rep_count + 1}"
+                    event = lockout_cue.update(captured_at, top_elbow_angle, text, frame_age)
+                    if event in ("early", "late"):
+                        mark_spoken(text, current_time)
+                        log.emit("cue", text=text, timing=event)
+                    elif event == "cancelled":
+                        log.emit("cue_cancelled", text=text)
+                        if last_spoken == text:
+                            mark_spoken("", 0)
+                    if event in ("crossed", "late"):
+                        state = "top"
+                        rep_count += 1
+                        log.emit("rep", reps=rep_count, angle=round(float(top_elbow_angle), 1))
                 elif top_elbow_angle < 90 and state == "top":
                     state = "bottom"
+                    lockout_cue.rearm()
+                metrics = tracker.update_pair(float(l_angle), float(r_angle), captured_at)
+                if metrics is not None:
+                    set_metrics.append(metrics)
+                    log.emit("rep_metrics", **{k: round(v, 3) for k, v in metrics._asdict().items()})
 
                 # -----------------------
                 # Speech feedback for errors
                 # -----------------------
-                current_time = frame_count/30.0
+                # Onsets are anticipated; re-armed once the error has clearly cleared
+                wrist_offset = max(abs(landmarks[LEFT_ELBOW, X] - landmarks[LEFT_WRIST, X]),
+                                   abs(landmarks[RIGHT_ELBOW, X] - landmarks[RIGHT_WRIST, X]))
+                for cue, value, text, clear_below in (
+                        (wrist_cue, wrist_offset, "Stack wrists over elbows", 0.035),
+                        (symmetry_cue, abs(l_angle - r_angle), "Keep arms moving evenly", 12)):
+                    event = cue.update(captured_at, value, text, frame_age)
+                    if event in ("early", "late"):
+                        mark_spoken(text, current_time)
+                        log.emit("cue", text=text, timing=event)
+                    elif event == "cancelled":
+                        log.emit("cue_cancelled", text=text)
+                        if last_spoken == text:
+                            mark_spoken("", 0)
+                    if not cue.armed and value < clear_below:
+                        cue.rearm()
                 error_to_speak = get_top_error(errors)
                 if error_to_speak:
                     speak_async(error_to_speak, current_time)
                 elif is_correct:
                     speak_async("Good shoulder press", current_time)
+            elif len(poses) == 0:
+                landmarks, is_correct, errors = None, True, []
+                gate.reset()
+            if gate.changed:
+                log.emit("quality", status=gate.status, hint=gate.hint())
 
-                # -----------------------
-                # Draw overlays
-                # -----------------------
-                color = (0,255,0) if is_correct else (0,0,255)
-                draw_landmarks(frame, landmarks, color)
-                cv2.putText(frame, f"Reps: {rep_count}", (50,100), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255,255,0), 2)
-                status = "GOOD FORM!" if is_correct else "FIX FORM"
-                cv2.putText(frame, status, (50,50), cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
-                for i, error in enumerate(errors):
-                    cv2.putText(frame, error, (50, 200 + i*40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,0,255), 2)
-                # Show what is being spoken
-                cv2.putText(frame, f"VOICE: {last_spoken}", (50, 400), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255,255,0), 2)
-
-            cv2.imshow("Shoulder Press Tracker", frame)
-            if cv2.waitKey(1) & 0xFF == 27: break
+            replay.push(frame)
+            prof.lap("replay")
+            
+            bus.publish({"frame": pool.snapshot(frame), "landmarks": landmarks, "is_correct": is_correct,
+                         "errors": errors, "reps": rep_count,
+                         "last_rep": set_metrics[-1] if set_metrics else None, "voice": last_spoken,
+                         "status": gate.status, "hint": gate.hint()})
+            prof.lap("publish")
+            alloc_meter.frame_end()
+
+    with backend.load():
+        startup.mark("load")
+        producer = analysis_bus.run_producer(frame_loop, stop)
+        while not stop.is_set():
+            bus.pump(0.005)
+            if cv2.waitKey(1) & 0xFF == 27:
+                stop.set()
+        producer.join()
 
+    bus.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(f"Motion governor: {governor.stats()}")
+    alloc_meter.report(ingest)
+    bus.report()
+    print(f"Quality gate: {gate.stats()}")
+    replay.close()
+    print(f"Instant replay: {replay.stats()}")
+    for name, cue in (("lockout", lockout_cue), ("wrists", wrist_cue), ("symmetry", symmetry_cue)):
+        print(f"Cue timing {name}: {cue.stats()}")
+    if set_metrics:
+        print(f"Rep metrics: {summarize(set_metrics)}")
+    log.emit("session_end", reps=rep_count, frames=frame_count, quality=gate.stats())
     # Stop speech thread
-    speech_queue.put(None)
-    speech_thread.join()
+    speech.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,337 @@
+"""
+FormFit Synthetic Poses
+Parametric skeleton motion for every exercise in form_analysis.EXERCISES,
+for benchmarks, soak tests of check_form / rep logic and agent load tests.
+
+Joint angles are keyframed from each exercise's `phases` ranges and turned
+into 33 MediaPipe-layout landmarks with vectorized 2D forward kinematics, so
+get_all_angles() on the output reads back the angles that were asked for.
+Tempo, noise, occlusion, left/right asymmetry and `common_mistakes` can all
+be dialed in. Everything is numpy over the whole trace - a few million
+frames per minute on one core.
+
+    python synthetic_poses.py squat --reps 20 --mistake knee_cave --out squat.npz
+    python synthetic_poses.py --benchmark
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from form_analysis import EXERCISES
+
+NUM_LANDMARKS = 33
+JOINTS = ['elbow', 'knee', 'hip', 'arm_raise']
+
+# Standing neutral angles for joints an exercise's phases don't mention
+NEUTRAL = {'elbow': 170.0, 'knee': 175.0, 'hip': 175.0, 'arm_raise': 15.0}
+
+# Exercises done lying / in plank: same joint angles, skeleton rotated flat.
+# (orientation in degrees, neutral overrides)
+BODY_SETUP = {
+    'pushup': (-80.0, {'arm_raise': 80.0}),
+    'plank': (-80.0, {'arm_raise': 80.0, 'elbow': 90.0}),
+}
+
+# Segment lengths in normalized image units
+SHANK, THIGH, TORSO, UPPER_ARM, FOREARM = 0.20, 0.20, 0.28, 0.15, 0.14
+SIDE_OFFSET = 0.015  # left/right separation in the side view
+
+
+# ============================================================
+# ANGLE TIMELINE
+# ============================================================
+
+def _phase_targets(exercise_key):
+    """(P, 2 sides, 4 joints) keyframe angles - midpoints of each phase's ranges"""
+    exercise = EXERCISES[exercise_key]
+    _, overrides = BODY_SETUP.get(exercise_key, (0.0, {}))
+    targets = []
+    for phase in exercise['phases'].values():
+        ranges = phase.get('angles', {})
+        frame = np.empty((2, len(JOINTS)))
+        for j, joint in enumerate(JOINTS):
+            for s, side in enumerate(['left', 'right']):
+                name = f"{side}_{joint}"
+                if name in ranges:
+                    frame[s, j] = min(180.0, sum(ranges[name]) / 2)
+                elif joint == 'hip' and 'back' in ranges:
+                    # Side view: the back angle is the hip angle of the mid-skeleton
+                    frame[s, j] = min(180.0, sum(ranges['back']) / 2)
+                else:
+                    frame[s, j] = overrides.get(joint, NEUTRAL[joint])
+        targets.append(frame)
+    return np.array(targets)
+
+
+def _timeline(num_phases, reps, fps, tempo, tempo_jitter, rng):
+    """Per frame: rep index, position within the rep (0-1) and segment index"""
+    durations = tempo * np.clip(1 + tempo_jitter * rng.standard_normal(reps), 0.3, None)
+    frames_per_rep = np.maximum(2, np.round(durations * fps).astype(int))
+    rep = np.repeat(np.arange(reps), frames_per_rep)
+    starts = np.concatenate([[0], np.cumsum(frames_per_rep)[:-1]])
+    u = (np.arange(len(rep)) - starts[rep]) / frames_per_rep[rep]
+    return rep, u
+
+
+def _angles_over_time(targets, u):
+    """Cosine-eased interpolation start -> each phase -> back to start"""
+    keys = np.concatenate([targets, targets[:1]])  # cycle back to the first phase
+    segments = len(keys) - 1
+    pos = u * segments
+    seg = np.minimum(pos.astype(int), segments - 1)
+    t = pos - seg
+    ease = (1 - np.cos(np.pi * t)) / 2
+    a, b = keys[seg], keys[seg + 1]
+    angles = a + (b - a) * ease[:, None, None]
+    phase = np.where(ease < 0.5, seg, (seg + 1) % len(targets))  # nearest keyframe
+    return angles, phase
+
+
+# ============================================================
+# MISTAKE INJECTION
+# ============================================================
+
+def _apply_mistake(angles, mistake, active):
+    """Push the mistake's angle past its threshold on frames where `active`"""
+    name, key, op, threshold, _ = mistake
+    margin = 12.0
+    target = threshold + margin if op == '>' else threshold - margin
+    if op == '>' and threshold >= 180 and not key.endswith('_diff'):
+        raise ValueError(f"{name}: {key} > {threshold} can't be produced by joint angles (max 180)")
+
+    def joint_index(joint):
+        if joint not in JOINTS:
+            raise ValueError(f"{name}: unsupported angle key {key!r}")
+        return JOINTS.index(joint)
+
+    rows = np.flatnonzero(active)
+    if key == 'back':
+        key = 'avg_hip'  # side view: back tracks the hip angle
+    if key.endswith('_diff'):
+        j = joint_index(key[:-len('_diff')])
+        mean = angles[rows, :, j].mean(axis=1)
+        # Keep both sides in range while opening the gap
+        half = target / 2
+        mean = np.clip(mean, half, 180 - half)
+        angles[rows, 0, j] = mean + half
+        angles[rows, 1, j] = mean - half
+    elif key.startswith('avg_'):
+        j = joint_index(key[len('avg_'):])
+        clamp = np.maximum if op == '>' else np.minimum
+        angles[rows, :, j] = clamp(angles[rows, :, j], min(target, 180.0))
+    elif key.startswith(('left_', 'right_')):
+        side, joint = key.split('_', 1)
+        s, j = (0 if side == 'left' else 1), joint_index(joint)
+        clamp = np.maximum if op == '>' else np.minimum
+        angles[rows, s, j] = clamp(angles[rows, s, j], min(target, 180.0))
+    else:
+        raise ValueError(f"{name}: unsupported angle key {key!r}")
+
+
+# ============================================================
+# FORWARD KINEMATICS
+# ============================================================
+
+def _rotate(d, degrees):
+    """Rotate (T, 2) unit directions by per-frame angles"""
+    r = np.radians(degrees)
+    c, s = np.cos(r), np.sin(r)
+    return np.stack([c * d[:, 0] - s * d[:, 1], s * d[:, 0] + c * d[:, 1]], axis=1)
+
+
+def _side_chain(ankle, knee_a, hip_a, raise_a, elbow_a):
+    """One side of a side-view skeleton facing +x (image y points down)"""
+    n = len(knee_a)
+    down = np.tile([0.0, 1.0], (n, 1))
+    knee = ankle - SHANK * down                 # shank vertical
+    d_kh = _rotate(down, knee_a)                # thigh goes back as the knee bends
+    hip = knee + THIGH * d_kh
+    d_hs = _rotate(-d_kh, -hip_a)               # torso leans forward as the hip bends
+    shoulder = hip + TORSO * d_hs
+    d_se = _rotate(-d_hs, -raise_a)             # arm raises forward
+    elbow = shoulder + UPPER_ARM * d_se
+    d_ew = _rotate(-d_se, elbow_a)              # forearm curls up
+    wrist = elbow + FOREARM * d_ew
+    return ankle, knee, hip, shoulder, elbow, wrist, d_hs, d_ew
+
+
+def _build_landmarks(angles, orientation):
+    """(T, 2, 4) joint angles -> (T, 33, 4) landmarks, visibility 1"""
+    n = len(angles)
+    out = np.zeros((n, NUM_LANDMARKS, 4), dtype=np.float32)
+    out[..., 3] = 1.0
+
+    sides = {}
+    for s, (offset, idx) in enumerate([(SIDE_OFFSET, 0), (-SIDE_OFFSET, 1)]):
+        ankle = np.tile([0.5 + offset, 0.92], (n, 1))
+        joint = {name: angles[:, s, j] for j, name in enumerate(JOINTS)}
+        sides[idx] = _side_chain(ankle, joint['knee'], joint['hip'], joint['arm_raise'], joint['elbow'])
+
+    # MediaPipe indices: (ankle, knee, hip, shoulder, elbow, wrist) per side
+    for s, idx in enumerate([(27, 25, 23, 11, 13, 15), (28, 26, 24, 12, 14, 16)]):
+        ankle, knee, hip, shoulder, elbow, wrist, d_hs, d_ew = sides[s]
+        for landmark, point in zip(idx, (ankle, knee, hip, shoulder, elbow, wrist)):
+            out[:, landmark, :2] = point
+        # Hands: pinky / index / thumb just past the wrist
+        for k, landmark in enumerate((17 + s, 19 + s, 21 + s)):
+            out[:, landmark, :2] = wrist + 0.03 * _rotate(d_ew, (k - 1) * 20.0)
+        # Feet: heel behind the ankle, toes in front
+        out[:, 29 + s, :2] = ankle + [-0.03, 0.02]
+        out[:, 31 + s, :2] = ankle + [0.06, 0.02]
+
+    # Head along the torso line above the mid-shoulder
+    mid_shoulder = (out[:, 11, :2] + out[:, 12, :2]) / 2
+    d_up = (sides[0][6] + sides[1][6]) / 2
+    nose = mid_shoulder + 0.10 * d_up + [0.03, 0.0]
+    out[:, 0, :2] = nose
+    for landmark, offset in zip(range(1, 11), [(-0.005, -0.02)] * 3 + [(-0.012, -0.02)] * 3
+                                + [(-0.04, -0.01), (-0.04, -0.01), (0.0, 0.02), (0.0, 0.02)]):
+        out[:, landmark, :2] = nose + offset
+
+    if orientation:
+        # Rotate the whole body about the mid-hip (push ups, planks)
+        pivot = (out[:, 23:24, :2] + out[:, 24:25, :2]) / 2
+        r = np.radians(orientation)
+        rot = np.array([[np.cos(r), -np.sin(r)], [np.sin(r), np.cos(r)]], dtype=np.float32)
+        out[..., :2] = (out[..., :2] - pivot) @ rot.T + pivot
+    return out
+
+
+# ============================================================
+# PUBLIC API
+# ============================================================
+
+class SyntheticTrace:
+    """Generated landmarks plus the ground truth that produced them"""
+
+    def __init__(self, exercise, landmarks, timestamps_ms, phase, rep, mistakes, mistake_mask, fps):
+        self.exercise = exercise
+        self.landmarks = landmarks          # (T, 33, 4) float32 x, y, z, visibility
+        self.timestamps_ms = timestamps_ms  # (T,) int64
+        self.phase = phase                  # (T,) index into the exercise's phases
+        self.rep = rep                      # (T,) rep index
+        self.mistakes = mistakes            # injected mistake names
+        self.mistake_mask = mistake_mask    # (T, len(mistakes)) bool - frames with each mistake
+        self.fps = fps
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def save(self, path):
+        np.savez_compressed(path, exercise=self.exercise, landmarks=self.landmarks,
+                            timestamps_ms=self.timestamps_ms, phase=self.phase, rep=self.rep,
+                            mistakes=np.array(self.mistakes, dtype=str),
+                            mistake_mask=self.mistake_mask, fps=self.fps)
+
+
+def load_trace(path) -> SyntheticTrace:
+    data = np.load(path)
+    return SyntheticTrace(str(data['exercise']), data['landmarks'], data['timestamps_ms'],
+                          data['phase'], data['rep'], data['mistakes'].tolist(),
+                          data['mistake_mask'], float(data['fps']))
+
+
+def generate(exercise_key, reps=10, fps=30, tempo=2.5, tempo_jitter=0.1, noise=0.003,
+             occlusion=0.0, asymmetry=0.0, mistakes=(), mistake_rate=1.0, seed=None) -> SyntheticTrace:
+    """Generate `reps` reps of an exercise.
+
+    tempo         seconds per rep (tempo_jitter = relative std-dev per rep)
+    noise         landmark position noise std-dev (normalized units)
+    occlusion     per-landmark, per-frame probability of low visibility + drift
+    asymmetry     degrees added to the left side / removed from the right
+    mistakes      names from the exercise's common_mistakes to inject
+    mistake_rate  fraction of reps each mistake appears in
+    """
+    if exercise_key not in EXERCISES:
+        raise ValueError(f"Unknown exercise: {exercise_key}")
+    rng = np.random.default_rng(seed)
+    exercise = EXERCISES[exercise_key]
+    orientation, _ = BODY_SETUP.get(exercise_key, (0.0, {}))
+
+    targets = _phase_targets(exercise_key)
+    rep, u = _timeline(len(targets), reps, fps, tempo, tempo_jitter, rng)
+    if len(targets) == 1:
+        # Holds (plank): small sway around the single phase
+        angles = np.repeat(targets, len(u), axis=0) + 2.0 * np.sin(2 * np.pi * u)[:, None, None]
+        phase = np.zeros(len(u), dtype=int)
+    else:
+        angles, phase = _angles_over_time(targets, u)
+
+    if asymmetry:
+        angles[:, 0] += asymmetry / 2
+        angles[:, 1] -= asymmetry / 2
+
+    known = {m[0]: m for m in exercise.get('common_mistakes', [])}
+    mistake_mask = np.zeros((len(u), len(mistakes)), dtype=bool)
+    for m, name in enumerate(mistakes):
+        if name not in known:
+            raise ValueError(f"{exercise_key} has no mistake {name!r} (has: {', '.join(known)})")
+        rep_has = rng.random(reps) < mistake_rate
+        mistake_mask[:, m] = rep_has[rep]
+        _apply_mistake(angles, known[name], mistake_mask[:, m])
+
+    np.clip(angles, 1.0, 180.0, out=angles)
+    landmarks = _build_landmarks(angles, orientation)
+
+    if noise:
+        landmarks[..., :2] += rng.normal(0, noise, landmarks[..., :2].shape).astype(np.float32)
+    if occlusion:
+        hidden = rng.random(landmarks.shape[:2]) < occlusion
+        landmarks[..., 3] = np.where(hidden, rng.uniform(0.0, 0.3, hidden.shape), 0.9 + 0.1 * rng.random(hidden.shape))
+        landmarks[..., :2] += hidden[..., None] * rng.normal(0, 0.05, landmarks[..., :2].shape).astype(np.float32)
+
+    timestamps_ms = (np.arange(len(u)) * 1000 / fps).astype(np.int64)
+    return SyntheticTrace(exercise_key, landmarks, timestamps_ms, phase, rep,
+                          list(mistakes), mistake_mask, fps)
+
+
+def iter_frames(exercise_key, chunk_reps=50, seed=None, **kwargs):
+    """Endless stream of (33, 4) frames for soak tests, generated in chunks"""
+    rng = np.random.default_rng(seed)
+    while True:
+        trace = generate(exercise_key, reps=chunk_reps, seed=int(rng.integers(1 << 31)), **kwargs)
+        yield from trace.landmarks
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def _benchmark():
+    total = 0
+    t0 = time.perf_counter()
+    for key in EXERCISES:
+        total += len(generate(key, reps=2000, seed=0))
+    elapsed = time.perf_counter() - t0
+    print(f"{total:,} frames in {elapsed:.2f}s -> {total / elapsed * 60 / 1e6:.1f}M frames/minute")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic exercise landmark traces")
+    parser.add_argument("exercise", nargs="?", choices=list(EXERCISES))
+    parser.add_argument("--reps", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--tempo", type=float, default=2.5, help="seconds per rep")
+    parser.add_argument("--noise", type=float, default=0.003)
+    parser.add_argument("--occlusion", type=float, default=0.0)
+    parser.add_argument("--asymmetry", type=float, default=0.0)
+    parser.add_argument("--mistake", action="append", default=[])
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--out", help="write an .npz trace file")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        _benchmark()
+    elif args.exercise:
+        trace = generate(args.exercise, reps=args.reps, fps=args.fps, tempo=args.tempo,
+                         noise=args.noise, occlusion=args.occlusion, asymmetry=args.asymmetry,
+                         mistakes=args.mistake, seed=args.seed)
+        print(f"{args.exercise}: {len(trace)} frames, {args.reps} reps")
+        if args.out:
+            trace.save(args.out)
+            print(f"Saved {args.out}")
+    else:
+        parser.print_help()
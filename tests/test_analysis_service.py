@@ -0,0 +1,87 @@
+"""Rep counting over the analysis service when a whole trace arrives at once"""
+
+import asyncio
+
+import numpy as np
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import analysis_service
+import synthetic_poses
+
+REPS = 5
+
+
+@pytest.fixture(autouse=True)
+def no_event_log(monkeypatch):
+    monkeypatch.setenv("FORMFIT_EVENT_LOG", "0")
+
+
+def trace(exercise="squat"):
+    return synthetic_poses.generate(exercise, reps=REPS, seed=0)
+
+
+def run(scenario):
+    async def main():
+        async with TestClient(TestServer(analysis_service.create_app())) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("timed", [False, True])
+def test_one_request_with_the_whole_trace(timed):
+    t = trace()
+    body = {"exercise": "squat", "frames": t.landmarks.tolist()}
+    if timed:
+        body["times"] = (t.timestamps_ms / 1000.0).tolist()
+
+    async def scenario(client):
+        response = await client.post("/analyze", json=body)
+        assert response.status == 200
+        return (await response.json())["results"]
+
+    results = run(scenario)
+    assert len(results) == len(t.landmarks)
+    assert results[-1]["reps"] == REPS
+
+
+def test_timed_binary_frames_sent_back_to_back():
+    t = trace()
+
+    async def scenario(client):
+        async with client.ws_connect("/ws?exercise=squat") as ws:
+            for landmarks, ms in zip(t.landmarks, t.timestamps_ms):
+                await ws.send_bytes(landmarks.astype("<f4").tobytes() + np.float64(ms / 1000).astype("<f8").tobytes())
+            results = [await ws.receive_json() for _ in t.landmarks]
+        return results
+
+    assert run(scenario)[-1]["reps"] == REPS
+
+
+@pytest.mark.parametrize("body", [
+    {"exercise": "squat", "landmarks": [0.5] * 33},
+    {"exercise": "squat", "frames": [[0.5] * 33]},
+    [{"exercise": "squat"}],
+    "squat",
+])
+def test_malformed_http_body_is_a_400(body):
+    async def scenario(client):
+        response = await client.post("/analyze", json=body)
+        return response.status
+
+    assert run(scenario) == 400
+
+
+@pytest.mark.parametrize("message", [{"landmarks": [0.5] * 33}, ["squat"], "squat"])
+def test_malformed_ws_message_gets_an_error_reply(message):
+    async def scenario(client):
+        async with client.ws_connect("/ws?exercise=squat") as ws:
+            await ws.send_json(message)
+            error = await ws.receive_json(timeout=5)
+            # The connection survives it
+            await ws.send_bytes(trace().landmarks[0].astype("<f4").tobytes())
+            return error, await ws.receive_json(timeout=5)
+
+    error, reply = run(scenario)
+    assert error["type"] == "error"
+    assert reply["type"] == "analysis"
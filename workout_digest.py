@@ -0,0 +1,141 @@
+"""
+FormFit Workout Digest
+Condenses the stream of frontend pose updates into short structured notes
+for the realtime model, so the coach can ground its feedback without every
+raw update landing in its context.
+
+Updates are accumulated over a rolling window; a digest is due at a change
+point (exercise switch, finished rep, new dominant error, set started /
+ended) or on a fixed cadence while active, and never more often than
+`min_interval` except for exercise switches.
+
+    [workout] squat | reps 12 (+3) | form ok 78% | main issue: Knees caving in (60%) | phase STANDING>BOTTOM | moving
+
+When the state carries per-rep metrics (WorkoutState.rep_metrics) the newest
+finished rep is appended as "last rep: ROM 82deg, 1.4s down / 0.9s up ...",
+and while its quality gate (WorkoutState.quality) says the exercise's joints
+can't be seen, its hint ("Reposition - left wrist not visible").
+"""
+
+import time
+from collections import Counter
+
+from rep_metrics import describe
+
+DIGEST_ID_PREFIX = "workout_digest_"
+MIN_UPDATES = 5  # fewer pose updates than this in a window: no form numbers yet
+
+
+class WorkoutDigest:
+    def __init__(self, min_interval=4.0, max_interval=20.0, dominant_share=0.4, keep=3):
+        self.min_interval = min_interval      # seconds between digests (exercise switches bypass)
+        self.max_interval = max_interval      # cadence while active even without a change point
+        self.dominant_share = dominant_share  # share of updates an error needs to be "the" issue
+        self.keep = keep                      # digests kept in the model's context
+
+        self.sequence = 0
+        self._last_at = 0.0
+        self._reported_reps = 0
+        self._reported_exercise = None
+        self._reported_error = None
+        self._reported_moving = False
+        self._window_exercise = None
+        self._state = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._updates = 0
+        self._correct = 0
+        self._moving = 0
+        self._errors = Counter()
+        self._phases = []
+
+    # ---------------- accumulate ----------------
+
+    def observe(self, state):
+        """Call after each WorkoutState update"""
+        if state.current_exercise != self._window_exercise:
+            # Switched exercise: the old window says nothing about the new one
+            self._window_exercise = state.current_exercise
+            self._reset_window()
+            self._reported_reps = 0
+        self._updates += 1
+        self._correct += bool(state.is_correct)
+        self._moving += bool(state.is_moving)
+        self._errors.update(state.errors)
+        phase = getattr(state, "phase", None)
+        if phase and (not self._phases or self._phases[-1] != phase):
+            self._phases.append(phase)
+        self._state = state
+
+    def _dominant_error(self):
+        if not self._errors or not self._updates:
+            return None, 0.0
+        error, count = self._errors.most_common(1)[0]
+        share = count / self._updates
+        return (error, share) if share >= self.dominant_share else (None, share)
+
+    # ---------------- emit ----------------
+
+    def due(self, now=None) -> bool:
+        if not self._updates:
+            return False
+        now = time.monotonic() if now is None else now
+        state = self._state
+        if state.current_exercise != self._reported_exercise:
+            return True  # exercise switch: tell the model right away
+        if now - self._last_at < self.min_interval:
+            return False
+        if not state.active:
+            return False
+        moving = self._moving * 2 > self._updates
+        return (state.reps > self._reported_reps
+                or self._dominant_error()[0] != self._reported_error
+                or moving != self._reported_moving
+                or now - self._last_at >= self.max_interval)
+
+    def build(self, now=None) -> str:
+        """Summarize the window, mark it reported and start a new one"""
+        state = self._state
+        error, share = self._dominant_error()
+        moving = self._moving * 2 > self._updates
+
+        if state.current_exercise is None:
+            parts = ["[workout] no exercise active", f"reps {state.reps}"]
+        else:
+            parts = [f"[workout] {state.current_exercise}",
+                     f"reps {state.reps} (+{max(0, state.reps - self._reported_reps)})"]
+            if self._updates >= MIN_UPDATES:
+                parts.append(f"form ok {100 * self._correct / self._updates:.0f}%")
+                if error:
+                    parts.append(f"main issue: {error} ({100 * share:.0f}%)")
+                elif self._reported_error:
+                    parts.append(f"fixed: {self._reported_error}")
+            if self._phases:
+                parts.append("phase " + ">".join(self._phases[-3:]))
+            parts.append("moving" if moving else "resting")
+            rep_metrics = getattr(state, "rep_metrics", None)
+            if rep_metrics:
+                parts.append("last rep: " + describe(rep_metrics[-1]))
+            quality = getattr(state, "quality", None)
+            if quality is not None and quality.hint():
+                parts.append(quality.hint())
+
+        self.sequence += 1
+        self._last_at = time.monotonic() if now is None else now
+        self._reported_reps = state.reps
+        self._reported_exercise = state.current_exercise
+        self._reported_error = error
+        self._reported_moving = moving
+        self._reset_window()
+        return " | ".join(parts)
+
+
+def inject(chat_ctx, digest_text, sequence, keep=3):
+    """Add a digest to a copy of chat_ctx, dropping all but the newest `keep` digests"""
+    chat_ctx = chat_ctx.copy()
+    old = [item for item in chat_ctx.items if item.id.startswith(DIGEST_ID_PREFIX)]
+    for item in old[:max(0, len(old) - keep + 1)]:
+        chat_ctx.items.remove(item)
+    chat_ctx.add_message(role="system", content=digest_text, id=f"{DIGEST_ID_PREFIX}{sequence}")
+    return chat_ctx